@@ -1,8 +1,17 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+import io
+from datetime import date, timedelta
+from flask import (Blueprint, Response, render_template, request, redirect, url_for, flash,
+                   current_app, jsonify, stream_with_context)
 from auth import admin_required
+from data_export import MEAL_EXPORT_COLUMNS, USER_EXPORT_COLUMNS, csv_chunks, ndjson_chunks
+from food_import import import_foods_csv
 
 admin_bp = Blueprint('admin', __name__)
 
+# Number of newest users and meals listed on the dashboard
+DASHBOARD_RECENT_USERS = 5
+DASHBOARD_RECENT_MEALS = 10
+
 @admin_bp.route('/dashboard')
 @admin_required
 def dashboard():
@@ -10,20 +19,19 @@ def dashboard():
     data_store = current_app.config['DATA_STORE']
     
     # Get statistics
-    total_users = len(data_store.get_all_users())
-    total_foods = len(data_store.get_all_foods())
-    total_meals = len(data_store.get_all_meals())
+    counts = data_store.get_counts()
+    meal_stats = data_store.get_meal_stats()
     
     # Get recent activity
-    recent_users = sorted(data_store.get_all_users(), 
-                         key=lambda x: x['created_at'], reverse=True)[:5]
-    recent_meals = sorted(data_store.get_all_meals(), 
-                         key=lambda x: x['created_at'], reverse=True)[:10]
+    recent_users = data_store.get_recent_users(DASHBOARD_RECENT_USERS)
+    recent_meals = data_store.get_recent_meals(DASHBOARD_RECENT_MEALS)
     
     stats = {
-        'total_users': total_users,
-        'total_foods': total_foods,
-        'total_meals': total_meals
+        'total_users': counts['users'],
+        'total_foods': counts['foods'],
+        'total_meals': meal_stats['meals'],
+        'active_users': meal_stats['users'],
+        'total_calories': meal_stats['totals']['calories']
     }
     
     return render_template('admin/dashboard.html', stats=stats, 
@@ -92,6 +100,28 @@ def delete_food(food_id):
     
     return redirect(url_for('admin.foods'))
 
+@admin_bp.route('/api/foods/import', methods=['POST'])
+@admin_required
+def api_import_foods():
+    """Bulk import foods from an uploaded CSV file, returning the import report"""
+    data_store = current_app.config['DATA_STORE']
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'error': 'No CSV file uploaded'}), 400
+    
+    # Uploads are spooled to disk, so the file is read row by row from there
+    csv_file = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    try:
+        report = import_foods_csv(data_store, csv_file)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': str(e)}), 400
+    current_app.logger.info('Imported %d of %d CSV rows from %s', report['imported'],
+                            report['rows'], upload.filename)
+    if 'error' in report:
+        # The foods read before the error are kept; the report says how many
+        return jsonify(report), 400
+    return jsonify(report)
+
 @admin_bp.route('/users')
 @admin_required
 def users():
@@ -116,3 +146,67 @@ def delete_user(user_id):
         flash('Cannot delete admin user or user not found.', 'error')
     
     return redirect(url_for('admin.users'))
+
+@admin_bp.route('/api/meal_stats')
+@admin_required
+def api_meal_stats():
+    """Meal analytics for dashboards: totals, daily trend, top foods and users"""
+    data_store = current_app.config['DATA_STORE']
+    try:
+        days = int(request.args.get('days', 90))
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'error': 'Invalid days or limit'}), 400
+    if not 1 <= days <= current_app.config['SUMMARY_MAX_DAYS'] or limit < 1:
+        return jsonify({'error': 'Invalid days or limit'}), 400
+    limit = min(limit, current_app.config['API_MAX_PAGE_SIZE'])
+    
+    end = date.today()
+    popular_foods = data_store.get_popular_foods(limit)
+    for entry in popular_foods:
+        food = data_store.get_food(entry['food_id'])
+        entry['name'] = food['name'] if food else None
+    return jsonify({
+        'stats': data_store.get_meal_stats(),
+        'trend': data_store.get_meal_trend(end - timedelta(days=days - 1), end),
+        'popular_foods': popular_foods,
+        'active_users': data_store.get_most_active_users(limit)
+    })
+
+def _export(records, columns, name):
+    """Stream records as a CSV (default) or NDJSON (format=ndjson) attachment"""
+    output_format = request.args.get('format', 'csv')
+    if output_format == 'csv':
+        chunks, mimetype = csv_chunks(records, columns), 'text/csv'
+    elif output_format == 'ndjson':
+        chunks, mimetype = ndjson_chunks(records, columns), 'application/x-ndjson'
+    else:
+        return jsonify({'error': 'Unsupported format'}), 400
+    # No Content-Length, so the response goes out with chunked encoding
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={name}.{output_format}'
+    })
+
+@admin_bp.route('/api/export/meals')
+@admin_required
+def api_export_meals():
+    """Stream all meals, optionally only a user's or those between start and end dates"""
+    data_store = current_app.config['DATA_STORE']
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        start = date.fromisoformat(start).isoformat() if start else None
+        end = date.fromisoformat(end).isoformat() if end else None
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    if start and end and start > end:
+        return jsonify({'error': 'start must not be after end'}), 400
+    meals = data_store.iter_meals(start, end, request.args.get('user_id') or None)
+    return _export(meals, MEAL_EXPORT_COLUMNS, 'meals')
+
+@admin_bp.route('/api/export/users')
+@admin_required
+def api_export_users():
+    """Stream all users (without password hashes)"""
+    data_store = current_app.config['DATA_STORE']
+    return _export(data_store.iter_users(), USER_EXPORT_COLUMNS, 'users')
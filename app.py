@@ -1,9 +1,18 @@
+import atexit
 import os
 import logging
+import click
+from collections.abc import Mapping
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date
 from data_store import DataStore
+from food_catalog import SharedFoodCatalog
+from food_import import IMPORT_BATCH_SIZE, import_foods_csv
+from oplog import OperationLog
+from rollup import NUTRIENTS
+from snapshot import SnapshotWriter
 from auth import auth_bp, login_required, admin_required
 from nutrition import nutrition_bp
 from admin import admin_bp
@@ -11,12 +20,73 @@ from admin import admin_bp
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
+class RecordJSONProvider(DefaultJSONProvider):
+    """JSON provider that also serializes the in-memory store's slotted records"""
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, Mapping):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
+
 # Create Flask app
 app = Flask(__name__)
+app.json = RecordJSONProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 
+# Maximum number of ranked results returned by food search
+app.config['SEARCH_RESULTS_LIMIT'] = int(os.environ.get("SEARCH_RESULTS_LIMIT", 50))
+
+# Default and maximum page sizes for paginated API endpoints
+app.config['API_PAGE_SIZE'] = int(os.environ.get("API_PAGE_SIZE", 100))
+app.config['API_MAX_PAGE_SIZE'] = int(os.environ.get("API_MAX_PAGE_SIZE", 500))
+
+# Longest date range (in days) accepted by the nutrition summary API
+app.config['SUMMARY_MAX_DAYS'] = int(os.environ.get("SUMMARY_MAX_DAYS", 366))
+
+# Most items accepted by one batch nutrition facts request
+app.config['BATCH_MAX_ITEMS'] = int(os.environ.get("BATCH_MAX_ITEMS", 500))
+
+# Number of recent meals shown on the profile page
+RECENT_MEALS_LIMIT = 10
+
+def create_data_store():
+    """Create the data store selected by the DATA_STORE_BACKEND setting"""
+    backend = os.environ.get("DATA_STORE_BACKEND", "memory")
+    if backend == "memory":
+        # Serve foods from catalog images shared by every worker process
+        catalog_dir = os.environ.get("CATALOG_DIR")
+        shared_catalog = SharedFoodCatalog(catalog_dir) if catalog_dir else None
+        snapshot_path = os.environ.get("SNAPSHOT_PATH")
+        if not snapshot_path:
+            return DataStore(shared_catalog=shared_catalog)
+        # Log every change between snapshots, syncing the log in batches
+        oplog = OperationLog(f"{snapshot_path}.log",
+                             float(os.environ.get("OPLOG_SYNC_INTERVAL", 0.05)))
+        store = DataStore(snapshot_path=snapshot_path, oplog=oplog, shared_catalog=shared_catalog)
+        oplog.start()
+        atexit.register(oplog.close)
+        # Save changes periodically and once more on shutdown; writers stop
+        # in reverse order, so the final snapshot comes before the log closes
+        writer = SnapshotWriter(store, snapshot_path,
+                                float(os.environ.get("SNAPSHOT_INTERVAL", 300)))
+        writer.start()
+        atexit.register(writer.stop)
+        return store
+    if backend == "sqlite":
+        from sqlite_store import SQLiteDataStore
+        return SQLiteDataStore(os.environ.get("SQLITE_PATH", "nutritrack.db"))
+    if backend == "sqlalchemy":
+        from sql_store import SQLAlchemyDataStore
+        return SQLAlchemyDataStore(
+            os.environ["DATABASE_URL"],
+            pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+            max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10))
+        )
+    raise ValueError(f"Unknown DATA_STORE_BACKEND: {backend}")
+
 # Initialize data store
-data_store = DataStore()
+data_store = create_data_store()
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/auth')
@@ -38,7 +108,7 @@ def search():
     foods = []
     
     if query:
-        foods = data_store.search_foods(query)
+        foods = data_store.search_foods(query, app.config['SEARCH_RESULTS_LIMIT'])
     
     return render_template('search.html', foods=foods, query=query)
 
@@ -48,26 +118,11 @@ def profile():
     """User profile page with nutrition stats"""
     user_id = session['user_id']
     user = data_store.get_user(user_id)
-    meals = data_store.get_user_meals(user_id)
+    meals = data_store.get_recent_user_meals(user_id, RECENT_MEALS_LIMIT)
     
-    # Calculate daily nutrition summary
+    # Daily nutrition summary
     today = date.today().isoformat()
-    today_meals = [meal for meal in meals if meal['date'] == today]
-    
-    daily_nutrition = {
-        'calories': 0,
-        'protein': 0,
-        'carbs': 0,
-        'fat': 0,
-        'fiber': 0
-    }
-    
-    for meal in today_meals:
-        daily_nutrition['calories'] += meal['calories']
-        daily_nutrition['protein'] += meal['protein']
-        daily_nutrition['carbs'] += meal['carbs']
-        daily_nutrition['fat'] += meal['fat']
-        daily_nutrition['fiber'] += meal['fiber']
+    daily_nutrition = data_store.get_daily_totals(user_id, today)
     
     return render_template('profile.html', user=user, meals=meals, 
                          daily_nutrition=daily_nutrition, today=today)
@@ -91,19 +146,15 @@ def add_meal():
     quantity = float(request.form.get('quantity', 1))
     meal_date = request.form.get('date', date.today().isoformat())
     
-    food = data_store.get_food(food_id)
-    if food:
+    facts = data_store.calculate_nutrition_facts([(food_id, quantity)])[0]
+    if facts:
         meal_data = {
             'user_id': user_id,
             'food_id': food_id,
-            'food_name': food['name'],
+            'food_name': facts['name'],
             'quantity': quantity,
             'date': meal_date,
-            'calories': food['calories'] * quantity,
-            'protein': food['protein'] * quantity,
-            'carbs': food['carbs'] * quantity,
-            'fat': food['fat'] * quantity,
-            'fiber': food['fiber'] * quantity
+            **{nutrient: facts[nutrient] for nutrient in NUTRIENTS}
         }
         
         data_store.add_meal(meal_data)
@@ -125,5 +176,34 @@ def delete_meal(meal_id):
     
     return redirect(url_for('meal_plan'))
 
+@app.cli.command('import-foods')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True,
+              help='Foods inserted per batch.')
+def import_foods_command(csv_path, batch_size):
+    """Import foods from a CSV file into the data store"""
+    if (os.environ.get("DATA_STORE_BACKEND", "memory") == "memory" and
+            not os.environ.get("CATALOG_DIR") and not os.environ.get("SNAPSHOT_PATH")):
+        # The foods would vanish when the command exits
+        raise click.ClickException('The memory backend keeps nothing after this command '
+                                   'exits; set CATALOG_DIR or SNAPSHOT_PATH, or use the '
+                                   'sqlite or sqlalchemy backend')
+    def progress(report):
+        click.echo(f"\r{report['rows']} rows read, {report['imported']} foods imported",
+                   nl=False, err=True)
+    
+    with open(csv_path, encoding='utf-8-sig', newline='') as csv_file:
+        try:
+            report = import_foods_csv(data_store, csv_file, batch_size, progress)
+        except (ValueError, UnicodeDecodeError) as e:
+            raise click.ClickException(str(e))
+    click.echo(err=True)
+    click.echo(f"{report['imported']} foods imported from {report['rows']} rows: "
+               f"{report['duplicates']} duplicates, {report['invalid']} invalid")
+    for error in report['errors']:
+        click.echo(f"line {error['line']}: {error['error']}")
+    if 'error' in report:
+        raise click.ClickException(report['error'])
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,82 @@
+"""Memory per meal in the in-memory store, and of a meal record versus a dict
+
+    python benchmarks/meal_memory.py [--meals 200000]
+
+Meals from 100 users over the sample foods are added to a DataStore and
+the growth of traced memory is divided by their number; that includes
+the store's indexes, meal columns and rollups. The same meals are then
+built as bare Meal records and as the plain dicts the store used to hold
+(string id, ISO created_at) to compare the records alone.
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_store import DEFAULT_FOODS, DataStore
+from records import Meal
+from rollup import NUTRIENTS
+
+def meal_rows(count):
+    """Meal dicts as the app passes them to add_meal"""
+    rnd = random.Random(0)
+    user_ids = [str(uuid.uuid4()) for _ in range(100)]
+    food_ids = [str(uuid.uuid4()) for _ in DEFAULT_FOODS]
+    for i in range(count):
+        food = DEFAULT_FOODS[i % len(DEFAULT_FOODS)]
+        quantity = rnd.choice([0.5, 1.0, 1.5, 2.0])
+        yield {'user_id': user_ids[i % len(user_ids)], 'food_id': food_ids[i % len(food_ids)],
+               'food_name': food['name'], 'quantity': quantity,
+               'date': f'2024-{1 + i % 12:02d}-{1 + i % 28:02d}',
+               **{nutrient: food[nutrient] * quantity for nutrient in NUTRIENTS}}
+
+def traced_bytes(build):
+    """Traced memory still held by what build() returns"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used
+
+def add_to_store(rows):
+    store = DataStore()
+    for row in rows:
+        store.add_meal(row)
+    return store
+
+def as_records(rows):
+    return [Meal(uuid.uuid4().int, row['user_id'], row['food_id'], row['food_name'],
+                 row['quantity'], row['date'], *(row[nutrient] for nutrient in NUTRIENTS))
+            for row in rows]
+
+def as_dicts(rows):
+    return [{'id': str(uuid.uuid4()), **row, 'created_at': datetime.now().isoformat()}
+            for row in rows]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--meals', type=int, default=200000)
+    args = parser.parse_args()
+
+    count = args.meals
+    # Fresh rows each time, so what is kept owns its values; the row dicts
+    # themselves are freed before memory is measured
+    store = traced_bytes(lambda: add_to_store(list(meal_rows(count))))
+    records = traced_bytes(lambda: as_records(list(meal_rows(count))))
+    dicts = traced_bytes(lambda: as_dicts(list(meal_rows(count))))
+    print(f'store:      {store / count:6.0f} bytes per meal, indexes included')
+    print(f'Meal:       {records / count:6.0f} bytes per record, values included')
+    print(f'plain dict: {dicts / count:6.0f} bytes per dict, values included')
+
+if __name__ == '__main__':
+    main()
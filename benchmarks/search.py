@@ -0,0 +1,78 @@
+"""Food search latency of the in-memory index on a synthetic catalog
+
+    python benchmarks/search.py [--foods 500000] [--corpus zipf|uniform]
+
+The zipf corpus draws name words from a 50k-word vocabulary with Zipfian
+frequencies, like branded food catalogs where a few words (chicken,
+cheese, ...) are common and most are rare. The uniform corpus is the
+pessimistic case: every name has three of 30 common words, so each of
+them appears in one name in ten.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from food_index import FoodSearchIndex
+
+COMMON_WORDS = ['chicken', 'breast', 'brown', 'rice', 'organic', 'greek', 'yogurt', 'sweet',
+                'potato', 'almond', 'butter', 'whole', 'wheat', 'bread', 'salted', 'roasted',
+                'frozen', 'spinach', 'apple', 'juice', 'cheddar', 'cheese', 'low', 'fat', 'milk',
+                'turkey', 'smoked', 'salmon', 'fillet', 'oat']
+QUERIES = ['brocoli', 'chiken brest', 'greek yog', 'swet potato', 'organ', 'chedar chese',
+           'smoked salmon fillet', 'oat', 'b', 'ch', 'ana', 'eek']
+
+def random_word(rnd):
+    return ''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(4, 9)))
+
+def food_names(corpus, count, rnd):
+    """Names of a synthetic catalog: a brand word followed by food words"""
+    brands = [random_word(rnd) for _ in range(20000)]
+    if corpus == 'uniform':
+        return [f"{rnd.choice(brands).title()} {' '.join(rnd.sample(COMMON_WORDS, 3))}"
+                for _ in range(count)]
+    vocabulary = COMMON_WORDS + [random_word(rnd) for _ in range(50000)]
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, len(vocabulary) + 1):
+        total += 1 / rank
+        cum_weights.append(total)
+    return [f"{rnd.choice(brands).title()} "
+            f"{' '.join(rnd.choices(vocabulary, cum_weights=cum_weights, k=rnd.randint(2, 4)))}"
+            for _ in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--foods', type=int, default=500000)
+    parser.add_argument('--corpus', choices=('zipf', 'uniform'), default='zipf')
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    names = food_names(args.corpus, args.foods, rnd)
+    index = FoodSearchIndex()
+    started = time.perf_counter()
+    index.add_many((str(position), name, position) for position, name in enumerate(names))
+    print(f'indexed {args.foods} foods in {time.perf_counter() - started:.1f} s')
+
+    queries = QUERIES + [names[7].split()[0][:5], f'{names[9].split()[0]} {names[9].split()[1]}']
+    latencies = {query: [] for query in queries}
+    for _ in range(args.rounds):
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query, args.limit)
+            latencies[query].append((time.perf_counter() - started) * 1000)
+    overall = sorted(latency for values in latencies.values() for latency in values)
+    print(f'top-{args.limit}: p50 {overall[len(overall) // 2]:.1f} ms, '
+          f'p99 {overall[int(len(overall) * 0.99)]:.1f} ms, max {overall[-1]:.1f} ms')
+    for query, values in latencies.items():
+        values.sort()
+        print(f'  {query!r:24} median {values[len(values) // 2]:.1f} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Per-call cost of common store operations, in-memory versus SQLite
+
+    python benchmarks/stores.py [--meals 2000] [--database-url URL]
+
+One user logs --meals meals spread over a month, then each operation is
+timed on its own, single-threaded. The SQLite database is a temporary
+file; pass --database-url to time the SQLAlchemy store as well.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_store import DataStore
+from rollup import NUTRIENTS
+from sqlite_store import SQLiteDataStore
+
+DAYS = 30
+
+def per_call(function, calls):
+    """Mean seconds per call of function(i) over calls calls"""
+    started = time.perf_counter()
+    for i in range(calls):
+        function(i)
+    return (time.perf_counter() - started) / calls
+
+def measure(store, meal_count):
+    rnd = random.Random(1)
+    user_id = store.create_user('bench', 'bench@example.com', 'pw')
+    foods = store.get_all_foods()
+    dates = [(date(2024, 1, 1) + timedelta(days=day)).isoformat() for day in range(DAYS)]
+
+    def add_meal(i):
+        food = foods[i % len(foods)]
+        store.add_meal({'user_id': user_id, 'food_id': food['id'], 'food_name': food['name'],
+                        'quantity': 1, 'date': rnd.choice(dates),
+                        **{nutrient: food[nutrient] for nutrient in NUTRIENTS}})
+
+    return {
+        'add_meal': per_call(add_meal, meal_count),
+        'get_user_meals_by_date': per_call(
+            lambda i: store.get_user_meals_by_date(user_id, dates[i % DAYS]), 500),
+        'get_food': per_call(lambda i: store.get_food(foods[i % len(foods)]['id']), 5000),
+        'get_user_by_username': per_call(lambda i: store.get_user_by_username('bench'), 5000),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--meals', type=int, default=2000)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {'memory': measure(DataStore(), args.meals),
+                   'sqlite': measure(SQLiteDataStore(os.path.join(directory, 'bench.db')),
+                                     args.meals)}
+        if args.database_url:
+            from sql_store import SQLAlchemyDataStore
+            results['sqlalchemy'] = measure(SQLAlchemyDataStore(args.database_url), args.meals)
+
+    print(f"{'operation':24}" + ''.join(f'{name:>12}' for name in results))
+    for operation in results['memory']:
+        print(f'{operation:24}' + ''.join(f'{timings[operation] * 1e6:10.1f}us'
+                                          for timings in results.values()))
+    print(f'({args.meals} meals for one user, ~{args.meals // DAYS} per date)')
+
+if __name__ == '__main__':
+    main()
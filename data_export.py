@@ -0,0 +1,54 @@
+import csv
+import io
+import json
+
+from rollup import NUTRIENTS
+
+MEAL_EXPORT_COLUMNS = (('id', 'user_id', 'food_id', 'food_name', 'quantity', 'date') +
+                       NUTRIENTS + ('created_at',))
+# Password hashes are never exported
+USER_EXPORT_COLUMNS = ('id', 'username', 'email', 'is_admin', 'created_at')
+
+# Records serialized into each chunk of an export
+EXPORT_CHUNK_ROWS = 1000
+
+# Text starting with one of these is read as a formula by spreadsheet apps
+CSV_FORMULA_PREFIXES = frozenset('=+-@\t\r')
+
+def _chunks(records):
+    """Group records into lists of up to EXPORT_CHUNK_ROWS"""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == EXPORT_CHUNK_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _csv_row(record, columns):
+    """The record's column values, with formula-like text prefixed by an apostrophe"""
+    return ["'" + value if type(value) is str and value[:1] in CSV_FORMULA_PREFIXES else value
+            for value in map(record.__getitem__, columns)]
+
+def csv_chunks(records, columns):
+    """Serialize records lazily as CSV text: a header row, then chunks of rows
+
+    User-supplied text such as food names and usernames is escaped so that
+    opening the export in a spreadsheet cannot run a formula from it.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for chunk in _chunks(records):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(_csv_row(record, columns) for record in chunk)
+        yield buffer.getvalue()
+
+def ndjson_chunks(records, columns):
+    """Serialize records lazily as newline-delimited JSON, in chunks of lines"""
+    for chunk in _chunks(records):
+        yield ''.join(json.dumps({column: record[column] for column in columns}) + '\n'
+                      for record in chunk)
@@ -1,202 +1,1045 @@
+import gc
+import math
 import uuid
-from datetime import datetime, date
+from array import array
+from functools import wraps
+from itertools import islice
+from operator import attrgetter
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
+from food_catalog import CatalogColumn, CatalogMapping
+from food_index import FoodSearchIndex
+from meal_columns import MealColumns
+from nutrient_matrix import NutrientMatrix
+from records import User, Food, Meal, parse_uuid
+from rollup import NutritionRollup, NUTRIENTS
+from rwlock import ReadWriteLock
+from snapshot import read_snapshot, write_snapshot
 
-class DataStore:
-    """In-memory data storage for the nutrition tracking application"""
+# Seed catalog loaded into a fresh store (values per 100g serving)
+DEFAULT_FOODS = [
+    {'name': 'Apple', 'calories': 52, 'protein': 0.3, 'carbs': 14, 'fat': 0.2, 'fiber': 2.4},
+    {'name': 'Banana', 'calories': 89, 'protein': 1.1, 'carbs': 23, 'fat': 0.3, 'fiber': 2.6},
+    {'name': 'Chicken Breast', 'calories': 165, 'protein': 31, 'carbs': 0, 'fat': 3.6, 'fiber': 0},
+    {'name': 'Salmon', 'calories': 208, 'protein': 22, 'carbs': 0, 'fat': 12, 'fiber': 0},
+    {'name': 'Brown Rice', 'calories': 111, 'protein': 2.6, 'carbs': 23, 'fat': 0.9, 'fiber': 1.8},
+    {'name': 'Broccoli', 'calories': 34, 'protein': 2.8, 'carbs': 7, 'fat': 0.4, 'fiber': 2.6},
+    {'name': 'Eggs', 'calories': 155, 'protein': 13, 'carbs': 1.1, 'fat': 11, 'fiber': 0},
+    {'name': 'Greek Yogurt', 'calories': 59, 'protein': 10, 'carbs': 3.6, 'fat': 0.4, 'fiber': 0},
+    {'name': 'Quinoa', 'calories': 120, 'protein': 4.4, 'carbs': 22, 'fat': 1.9, 'fiber': 2.8},
+    {'name': 'Spinach', 'calories': 23, 'protein': 2.9, 'carbs': 3.6, 'fat': 0.4, 'fiber': 2.2},
+    {'name': 'Sweet Potato', 'calories': 86, 'protein': 1.6, 'carbs': 20, 'fat': 0.1, 'fiber': 3},
+    {'name': 'Almonds', 'calories': 576, 'protein': 21, 'carbs': 22, 'fat': 49, 'fiber': 12},
+    {'name': 'Avocado', 'calories': 160, 'protein': 2, 'carbs': 9, 'fat': 15, 'fiber': 7},
+    {'name': 'Oatmeal', 'calories': 68, 'protein': 2.4, 'carbs': 12, 'fat': 1.4, 'fiber': 1.7},
+    {'name': 'Turkey', 'calories': 135, 'protein': 25, 'carbs': 0, 'fat': 3.2, 'fiber': 0}
+]
+
+# Meal columns stored as doubles in snapshots
+_SNAPSHOT_MEAL_COLUMNS = ('quantity',) + NUTRIENTS + ('created',)
+
+# Default admin account created with every fresh store
+DEFAULT_ADMIN_USERNAME = 'admin'
+DEFAULT_ADMIN_EMAIL = 'admin@nutritrack.com'
+DEFAULT_ADMIN_PASSWORD = 'admin123'
+
+def _reads(method):
+    """Run a DataStore method under the store's shared read lock"""
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        acquired = self._lock.acquire_read()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._lock.release_read(acquired)
+    return locked
+
+def _writes(method):
+    """Run a DataStore method under the store's exclusive write lock"""
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        self._check_writable()
+        acquired = self._lock.acquire_write()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._lock.release_write(acquired)
+    return locked
+
+def _reads_catalog(method):
+    """Like _reads, after picking up food catalog changes made by other processes"""
+    method = _reads(method)
+    @wraps(method)
+    def synced(self, *args, **kwargs):
+        self._sync_catalog()
+        return method(self, *args, **kwargs)
+    return synced
+
+def _user_fields(user):
+    """Constructor arguments of a User record"""
+    return (user.id, user.username, user.email, user.password_hash, user.is_admin, user.created)
+
+def _food_fields(food):
+    """Constructor arguments of a Food record"""
+    return (food.id, food.name, food.calories, food.protein, food.carbs, food.fat, food.fiber,
+            food.created)
+
+def _meal_fields(meal):
+    """Constructor arguments of a Meal record, without its surrogate id"""
+    return (meal.uuid_int, meal.user_id, meal.food_id, meal.food_name, meal.quantity, meal.date,
+            meal.calories, meal.protein, meal.carbs, meal.fat, meal.fiber, meal.created)
+
+class _UserMealLog:
+    """A single user's meals kept sorted by date (then insertion order)
+    
+    Meals are keyed by (date, surrogate id); surrogate ids only grow, so
+    they double as the insertion order.
+    """
     
     def __init__(self):
-        self.users = {}
-        self.foods = {}
-        self.meals = {}
+        self._keys = []
+        self._meals = []
+    
+    @classmethod
+    def from_sorted(cls, meals):
+        """Build a log from meals already in (date, surrogate id) order"""
+        log = cls()
+        log._meals = meals
+        log._keys = [(meal.date, meal.sid) for meal in meals]
+        return log
+    
+    def __len__(self):
+        return len(self._meals)
+    
+    def __iter__(self):
+        return iter(self._meals)
+    
+    def add(self, meal):
+        """Insert a meal at its date position"""
+        key = (meal.date, meal.sid)
+        index = bisect_right(self._keys, key)
+        self._keys.insert(index, key)
+        self._meals.insert(index, meal)
+    
+    def remove(self, meal):
+        """Remove a meal, returning False if it is not in the log"""
+        key = (meal.date, meal.sid)
+        index = bisect_left(self._keys, key)
+        if index == len(self._keys) or self._keys[index] != key:
+            return False
+        del self._keys[index]
+        del self._meals[index]
+        return True
+    
+    def between(self, start_date=None, end_date=None):
+        """Meals with start_date <= date <= end_date, oldest first"""
+        lo = 0 if start_date is None else bisect_left(self._keys, (start_date,))
+        hi = (len(self._keys) if end_date is None
+              else bisect_right(self._keys, (end_date, math.inf)))
+        return self._meals[lo:hi]
+    
+    def latest(self, limit=None):
+        """Most recent meals first, optionally capped at limit"""
+        if limit is None:
+            return self._meals[::-1]
+        if limit <= 0:
+            return []
+        return self._meals[:-limit - 1:-1]
+
+class DataStore:
+    """In-memory data storage for the nutrition tracking application
+    
+    Pass snapshot_path to restore the store from a snapshot written by
+    save_snapshot instead of seeding it, when that file exists. Pass an
+    OperationLog as oplog to record every change in it: on startup the
+    log's changes since the snapshot are replayed, and saving a snapshot
+    to snapshot_path compacts the log.
+    
+    Pass a SharedFoodCatalog as shared_catalog to serve foods from catalog
+    images shared by every process instead of private copies: food edits
+    publish a new generation, which other processes pick up on their next
+    read. The shared catalog is then the only record of the foods;
+    snapshots and the operation log keep users and meals.
+    
+    The store is safe to share between threads: public reads hold a
+    shared lock and changes an exclusive one, so readers never see an
+    index halfway through an update and changes reach the operation log
+    in the order they were applied. Snapshots, iter_users, iter_foods and
+    iter_meals read without the lock; they only take atomic copies of containers
+    whose records are replaced, never modified.
+    """
+    
+    def __init__(self, snapshot_path=None, oplog=None, shared_catalog=None):
+        self._clear()
+        # Bumped on every change, so snapshots are only written when needed
+        self._revision = 0
         self.user_counter = 0
-        self.meal_counter = 0
+        self._lock = ReadWriteLock()
+        self._snapshot_path = snapshot_path
+        self._oplog = None
+        self._shared_catalog = shared_catalog
+        if shared_catalog is not None:
+            # The first process to start seeds the shared catalog
+            image = shared_catalog.current()
+            if image is None:
+                image, _ = shared_catalog.update(self._seed_catalog)
+            self._attach_catalog(image)
         
-        # Initialize with sample food data
-        self._initialize_food_database()
+        state = read_snapshot(snapshot_path) if snapshot_path else None
+        if state is not None:
+            self._restore_snapshot(state)
+        replayed = 0
+        if oplog is not None:
+            replayed = oplog.replay(self._apply_operation,
+                                    state['oplog_seq'] if state is not None else 0)
+            oplog.catch_up = self._catch_up
+            self._oplog = oplog
+        if state is not None or replayed:
+            return
+        
+        # Initialize with sample food data; with an operation log the seed
+        # data is logged like any other change
+        if shared_catalog is None:
+            self._initialize_food_database()
         
         # Create default admin user
         self._create_admin_user()
     
+    def _clear(self):
+        """Empty the store and all of its indexes"""
+        self.users = {}
+        # Users by integer surrogate id, in registration order (None once deleted)
+        self._users_by_sid = []
+        self.foods = {}
+        # Meals by integer surrogate id (None once deleted); surrogate ids
+        # are the meals' rows in the columnar log
+        self.meals = []
+        # External meal UUID (as a 128-bit int) -> surrogate id
+        self._meal_sids = {}
+        # Deleted surrogate id -> a lower id to continue from when walking
+        # back for recent meals; every id in between is deleted as well.
+        # Kept for the top of each run of deleted ids: a missing id
+        # continues from the id below it
+        self._meal_skips = {}
+        # Food ids by catalog position (None where deleted), used as the
+        # keyset for paging through the catalog
+        self._catalog = []
+        self._food_positions = {}
+        # Catalog version bumped on every food change, and per-food
+        # (revision, modified) pairs, used for HTTP cache validation
+        self._catalog_version = 0
+        self._catalog_modified = datetime.now(timezone.utc)
+        self._food_revisions = {}
+        # Token index over food names used by search_foods
+        self._food_index = FoodSearchIndex()
+        # Foods x nutrients matrix for batch nutrition calculations
+        self._nutrients = NutrientMatrix()
+        # Case-normalized username/email -> user_id
+        self._user_ids_by_username = {}
+        self._user_ids_by_email = {}
+        # Per-user meal logs kept sorted by date: user_id -> _UserMealLog
+        self._meals_by_user = {}
+        # Running nutrient totals per user in day/month/year buckets
+        self._rollup = NutritionRollup()
+        # Columnar copy of all meals for analytics scans
+        self._meal_columns = MealColumns()
+    
     def _initialize_food_database(self):
         """Initialize the food database with common foods"""
-        foods_data = [
-            {'name': 'Apple', 'calories': 52, 'protein': 0.3, 'carbs': 14, 'fat': 0.2, 'fiber': 2.4},
-            {'name': 'Banana', 'calories': 89, 'protein': 1.1, 'carbs': 23, 'fat': 0.3, 'fiber': 2.6},
-            {'name': 'Chicken Breast', 'calories': 165, 'protein': 31, 'carbs': 0, 'fat': 3.6, 'fiber': 0},
-            {'name': 'Salmon', 'calories': 208, 'protein': 22, 'carbs': 0, 'fat': 12, 'fiber': 0},
-            {'name': 'Brown Rice', 'calories': 111, 'protein': 2.6, 'carbs': 23, 'fat': 0.9, 'fiber': 1.8},
-            {'name': 'Broccoli', 'calories': 34, 'protein': 2.8, 'carbs': 7, 'fat': 0.4, 'fiber': 2.6},
-            {'name': 'Eggs', 'calories': 155, 'protein': 13, 'carbs': 1.1, 'fat': 11, 'fiber': 0},
-            {'name': 'Greek Yogurt', 'calories': 59, 'protein': 10, 'carbs': 3.6, 'fat': 0.4, 'fiber': 0},
-            {'name': 'Quinoa', 'calories': 120, 'protein': 4.4, 'carbs': 22, 'fat': 1.9, 'fiber': 2.8},
-            {'name': 'Spinach', 'calories': 23, 'protein': 2.9, 'carbs': 3.6, 'fat': 0.4, 'fiber': 2.2},
-            {'name': 'Sweet Potato', 'calories': 86, 'protein': 1.6, 'carbs': 20, 'fat': 0.1, 'fiber': 3},
-            {'name': 'Almonds', 'calories': 576, 'protein': 21, 'carbs': 22, 'fat': 49, 'fiber': 12},
-            {'name': 'Avocado', 'calories': 160, 'protein': 2, 'carbs': 9, 'fat': 15, 'fiber': 7},
-            {'name': 'Oatmeal', 'calories': 68, 'protein': 2.4, 'carbs': 12, 'fat': 1.4, 'fiber': 1.7},
-            {'name': 'Turkey', 'calories': 135, 'protein': 25, 'carbs': 0, 'fat': 3.2, 'fiber': 0}
-        ]
-        
-        for food_data in foods_data:
-            food_id = str(uuid.uuid4())
-            food_data['id'] = food_id
-            food_data['created_at'] = datetime.now().isoformat()
-            self.foods[food_id] = food_data
+        self._insert_foods([Food(str(uuid.uuid4()), **food) for food in DEFAULT_FOODS])
+    
+    def _seed_catalog(self, image, slots):
+        """Shared catalog edit adding the sample foods to an empty catalog"""
+        if slots:
+            return False
+        slots.extend(_food_fields(Food(str(uuid.uuid4()), **food)) for food in DEFAULT_FOODS)
+        return True
+    
+    def _attach_catalog(self, image):
+        """Serve foods from a shared catalog image, replacing the private catalog"""
+        self.foods = CatalogMapping(image, image.food)
+        self._catalog = CatalogColumn(image, image.food_id)
+        self._food_positions = CatalogMapping(image, lambda position: position)
+        # Images carry no per-food history, so every food takes the
+        # generation as its revision
+        self._food_revisions = CatalogMapping(image, lambda position: (image.generation,
+                                                                       image.modified))
+        self._catalog_version = image.generation
+        self._catalog_modified = image.modified
+        self._food_index = image.search_index()
+        self._nutrients = NutrientMatrix.over(self._food_positions, CatalogColumn(image, image.name),
+                                              image.nutrient_rows())
+    
+    def _sync_catalog(self):
+        """Switch to the shared catalog's latest generation if another process published one
+        
+        A thread already holding the read lock keeps the generation it
+        started reading, as switching would need the write lock.
+        """
+        if (self._shared_catalog is not None and not self._lock.reading() and
+                self._shared_catalog.generation() != self._catalog_version):
+            with self._lock.write():
+                image = self._shared_catalog.current()
+                if image.generation != self._catalog_version:
+                    self._attach_catalog(image)
+    
+    def _publish_catalog(self, edit):
+        """Apply an edit to the shared catalog and switch to the generation it published
+        
+        The image is written and mapped without the store lock, so reads and
+        meal writes carry on meanwhile; only switching to it takes the lock.
+        """
+        image, changed = self._shared_catalog.update(edit)
+        with self._lock.write():
+            if changed:
+                self._revision += 1
+            # Another thread may have switched to a later generation meanwhile
+            if image is not None and image.generation > self._catalog_version:
+                self._attach_catalog(image)
+        return changed
+    
+    def _insert_foods(self, foods, index=True):
+        """Store new foods at the end of the catalog and index their names
+        
+        With index=False the names are left for the caller to index.
+        """
+        food_ids = [food.id for food in foods]
+        start = len(self._catalog)
+        positions = range(start, start + len(foods))
+        self.foods.update(zip(food_ids, foods))
+        self._catalog.extend(food_ids)
+        self._food_positions.update(zip(food_ids, positions))
+        if index:
+            self._food_index.add_many(zip(food_ids, [food.name for food in foods], positions))
+        self._nutrients.extend(foods)
+        self._touch_foods(food_ids)
+        self._log('foods', [_food_fields(food) for food in foods])
+    
+    def _replace_food(self, food):
+        """Swap in a changed food record"""
+        # A new record rather than an update, so readers never see a
+        # half-updated food
+        self.foods[food.id] = food
+        self._food_index.update(food.id, food.name)
+        self._nutrients.set(food)
+        self._touch_foods([food.id])
+        self._log('food', _food_fields(food))
+    
+    def _touch_foods(self, food_ids, deleted=False):
+        """Record changed foods in the catalog version and their revisions"""
+        now = datetime.now(timezone.utc)
+        self._revision += 1
+        self._catalog_version += 1
+        self._catalog_modified = now
+        revisions = self._food_revisions
+        for food_id in food_ids:
+            if deleted:
+                revisions.pop(food_id, None)
+            else:
+                revisions[food_id] = (revisions.get(food_id, (0, now))[0] + 1, now)
     
     def _create_admin_user(self):
         """Create default admin user"""
-        admin_id = str(uuid.uuid4())
-        admin_data = {
-            'id': admin_id,
-            'username': 'admin',
-            'email': 'admin@nutritrack.com',
-            'password_hash': generate_password_hash('admin123'),
-            'is_admin': True,
-            'created_at': datetime.now().isoformat()
-        }
-        self.users[admin_id] = admin_data
+        self._insert_user(User(str(uuid.uuid4()), DEFAULT_ADMIN_USERNAME, DEFAULT_ADMIN_EMAIL,
+                               generate_password_hash(DEFAULT_ADMIN_PASSWORD), is_admin=True))
+    
+    @staticmethod
+    def _normalize(value):
+        """Normalize a username or email for case-insensitive lookups"""
+        return (value or '').lower()
+    
+    def _insert_user(self, user):
+        """Store a user and index its username and email"""
+        self._revision += 1
+        user.sid = len(self._users_by_sid)
+        self._users_by_sid.append(user)
+        self.users[user.id] = user
+        self._user_ids_by_username[self._normalize(user.username)] = user.id
+        self._user_ids_by_email[self._normalize(user.email)] = user.id
+        self._log('user', _user_fields(user))
     
     # User management methods
     def create_user(self, username, email, password):
         """Create a new user"""
-        # Check if username or email already exists
-        for user in self.users.values():
-            if user['username'] == username or user['email'] == email:
+        self._check_writable()
+        # Hashing is deliberately slow, so it happens before taking the lock
+        password_hash = generate_password_hash(password)
+        with self._lock.write():
+            # Check if username or email already exists
+            if (self._normalize(username) in self._user_ids_by_username or
+                    self._normalize(email) in self._user_ids_by_email):
                 return None
-        
-        user_id = str(uuid.uuid4())
-        user_data = {
-            'id': user_id,
-            'username': username,
-            'email': email,
-            'password_hash': generate_password_hash(password),
-            'is_admin': False,
-            'created_at': datetime.now().isoformat()
-        }
-        self.users[user_id] = user_data
-        return user_id
+            
+            user_id = str(uuid.uuid4())
+            self._insert_user(User(user_id, username, email, password_hash))
+            return user_id
     
+    @_reads
     def get_user(self, user_id):
         """Get user by ID"""
         return self.users.get(user_id)
     
+    @_reads
     def get_user_by_username(self, username):
         """Get user by username"""
-        for user in self.users.values():
-            if user['username'] == username:
-                return user
-        return None
+        user_id = self._user_ids_by_username.get(self._normalize(username))
+        return self.users.get(user_id) if user_id else None
     
+    @_reads
     def get_all_users(self):
         """Get all users"""
         return list(self.users.values())
     
+    def iter_users(self):
+        """Iterate over all users in registration order without copying them"""
+        # Walk surrogate ids, like iter_meals; users deleted after iteration
+        # began may still be yielded
+        users = self._users_by_sid
+        sid = 0
+        while sid < len(users):
+            user = users[sid]
+            sid += 1
+            if user is not None:
+                yield user
+    
+    @_reads
+    def get_recent_users(self, limit):
+        """Get the most recently registered users, newest first"""
+        # Users are kept in registration order, so the newest are at the end
+        return list(islice(reversed(self.users.values()), limit))
+    
     def verify_password(self, user, password):
         """Verify user password"""
         return check_password_hash(user['password_hash'], password)
     
+    @_writes
     def delete_user(self, user_id):
         """Delete a user"""
         if user_id in self.users:
-            del self.users[user_id]
+            self._revision += 1
+            user = self.users.pop(user_id)
+            self._users_by_sid[user.sid] = None
+            self._user_ids_by_username.pop(self._normalize(user.username), None)
+            self._user_ids_by_email.pop(self._normalize(user.email), None)
             # Also delete user's meals
-            meals_to_delete = [meal_id for meal_id, meal in self.meals.items() 
-                             if meal['user_id'] == user_id]
-            for meal_id in meals_to_delete:
-                del self.meals[meal_id]
+            self._rollup.drop_user(user_id)
+            for meal in self._meals_by_user.pop(user_id, ()):
+                self._clear_meal_slot(meal)
+                self._meal_columns.remove(meal.sid)
+            self._log('delete_user', user_id)
             return True
         return False
     
     # Food management methods
+    @_reads_catalog
     def get_all_foods(self):
         """Get all foods"""
         return list(self.foods.values())
     
+    def iter_foods(self):
+        """Iterate over all foods in catalog order without copying the catalog"""
+        self._sync_catalog()
+        # Walk catalog slots by position so foods added or deleted while a
+        # consumer is iterating do not invalidate the iterator; a shared
+        # catalog is walked in the generation current when iteration began
+        catalog, foods = self._catalog, self.foods
+        position = 0
+        while position < len(catalog):
+            food_id = catalog[position]
+            position += 1
+            if food_id is not None:
+                food = foods.get(food_id)
+                if food is not None:
+                    yield food
+    
+    @_reads_catalog
     def get_food(self, food_id):
         """Get food by ID"""
         return self.foods.get(food_id)
     
-    def search_foods(self, query):
-        """Search foods by name"""
-        query = query.lower()
-        results = []
-        for food in self.foods.values():
-            if query in food['name'].lower():
-                results.append(food)
-        return results
+    @_reads_catalog
+    def get_catalog_version(self):
+        """Get the food catalog's (version, last modified UTC datetime)"""
+        return self._catalog_version, self._catalog_modified
+    
+    @_reads_catalog
+    def get_food_revision(self, food_id):
+        """Get a food's (revision, last modified UTC datetime), or None if missing"""
+        return self._food_revisions.get(food_id)
+    
+    @_reads_catalog
+    def get_foods_page(self, limit, after=None):
+        """Get up to limit foods in catalog order following the cursor position
+        
+        Returns the foods and the cursor for the next page (None on the last page).
+        """
+        foods = []
+        position = 0 if after is None else after + 1
+        while position < len(self._catalog) and len(foods) < limit:
+            food_id = self._catalog[position]
+            if food_id is not None:
+                foods.append(self.foods[food_id])
+            position += 1
+        # Skip deleted slots to tell whether another page exists
+        while position < len(self._catalog) and self._catalog[position] is None:
+            position += 1
+        if not foods or position >= len(self._catalog):
+            return foods, None
+        return foods, self._food_positions[foods[-1].id]
+    
+    @_reads_catalog
+    def search_foods(self, query, limit=None, offset=0):
+        """Search foods by name, best matches first (tolerates misspellings)"""
+        end = None if limit is None else offset + limit
+        food_ids = self._food_index.search(query, end)
+        if food_ids is None:
+            return list(islice(self.foods.values(), offset, end))
+        return [self.foods[food_id] for food_id in food_ids[offset:]]
     
     def add_food(self, name, calories, protein, carbs, fat, fiber):
         """Add a new food"""
-        food_id = str(uuid.uuid4())
-        food_data = {
-            'id': food_id,
-            'name': name,
-            'calories': calories,
-            'protein': protein,
-            'carbs': carbs,
-            'fat': fat,
-            'fiber': fiber,
-            'created_at': datetime.now().isoformat()
-        }
-        self.foods[food_id] = food_data
-        return food_id
+        return self.add_foods([{'name': name, 'calories': calories, 'protein': protein,
+                                'carbs': carbs, 'fat': fat, 'fiber': fiber}])[0]
+    
+    @staticmethod
+    def _new_food(food):
+        """Food record with a fresh id for a food dict"""
+        return Food(str(uuid.uuid4()), food['name'], food['calories'], food['protein'],
+                    food['carbs'], food['fat'], food['fiber'])
+    
+    def add_foods(self, foods):
+        """Add many foods at once, returning their ids in order"""
+        self._check_writable()
+        records = [self._new_food(food) for food in foods]
+        if self._shared_catalog is not None:
+            # One new generation for the whole batch
+            def append(image, slots):
+                slots.extend(map(_food_fields, records))
+                return bool(records)
+            self._publish_catalog(append)
+        else:
+            with self._lock.write():
+                self._insert_foods(records)
+        return [food.id for food in records]
+    
+    def import_foods(self, batches):
+        """Add foods from an iterable of lists of food dicts, returning how many were added
+        
+        Batches are inserted one write lock at a time, so reads carry on
+        during a long import, and the name search index is built once at
+        the end; imported foods only turn up in searches when it is done,
+        or when it stops on an error from batches, which keeps the foods
+        inserted before it.
+        A shared catalog publishes a single generation for the whole import.
+        """
+        self._check_writable()
+        if self._shared_catalog is not None:
+            added = 0
+            def append(image, slots):
+                nonlocal added
+                for batch in batches:
+                    slots.extend(_food_fields(self._new_food(food)) for food in batch)
+                    added += len(batch)
+                return added > 0
+            self._publish_catalog(append)
+            return added
+        food_ids = []
+        try:
+            for batch in batches:
+                records = [self._new_food(food) for food in batch]
+                with self._lock.write():
+                    self._insert_foods(records, index=False)
+                food_ids += [food.id for food in records]
+        finally:
+            # Index whatever went in, even if reading the batches failed
+            with self._lock.write():
+                # Skip foods deleted while the import was running
+                self._food_index.add_many((food_id, self.foods[food_id].name,
+                                           self._food_positions[food_id])
+                                          for food_id in food_ids if food_id in self.foods)
+        return len(food_ids)
     
     def update_food(self, food_id, name, calories, protein, carbs, fat, fiber):
         """Update a food"""
-        if food_id in self.foods:
-            self.foods[food_id].update({
-                'name': name,
-                'calories': calories,
-                'protein': protein,
-                'carbs': carbs,
-                'fat': fat,
-                'fiber': fiber
-            })
-            return True
-        return False
+        self._check_writable()
+        if self._shared_catalog is not None:
+            def replace(image, slots):
+                position = image.position(food_id) if image is not None else None
+                # An edit published along with this one may have deleted it
+                if position is None or slots[position] is None:
+                    return False
+                created = slots[position][-1]
+                slots[position] = (food_id, name, calories, protein, carbs, fat, fiber, created)
+                return True
+            return self._publish_catalog(replace)
+        with self._lock.write():
+            food = self.foods.get(food_id)
+            if food is not None:
+                self._replace_food(Food(food_id, name, calories, protein, carbs, fat, fiber,
+                                        food.created))
+                return True
+            return False
     
     def delete_food(self, food_id):
         """Delete a food"""
-        if food_id in self.foods:
-            del self.foods[food_id]
-            return True
-        return False
+        self._check_writable()
+        if self._shared_catalog is not None:
+            def remove(image, slots):
+                position = image.position(food_id) if image is not None else None
+                if position is None or slots[position] is None:
+                    return False
+                slots[position] = None
+                return True
+            return self._publish_catalog(remove)
+        with self._lock.write():
+            if food_id in self.foods:
+                del self.foods[food_id]
+                self._catalog[self._food_positions.pop(food_id)] = None
+                self._food_index.remove(food_id)
+                self._nutrients.remove(food_id)
+                self._touch_foods([food_id], deleted=True)
+                self._log('delete_food', food_id)
+                return True
+            return False
+    
+    @_reads_catalog
+    def calculate_nutrition(self, items):
+        """Total the nutrients of many (food_id, quantity) items
+        
+        Raises KeyError for a food id not in the catalog.
+        """
+        return self._nutrients.totals(items)
+    
+    @_reads_catalog
+    def calculate_nutrition_facts(self, items):
+        """Nutrition facts of each (food_id, quantity) item, None for unknown foods"""
+        return self._nutrients.facts(items)
     
     # Meal management methods
+    @_writes
     def add_meal(self, meal_data):
         """Add a meal"""
-        meal_id = str(uuid.uuid4())
-        meal_data['id'] = meal_id
-        meal_data['created_at'] = datetime.now().isoformat()
-        self.meals[meal_id] = meal_data
-        return meal_id
+        meal = Meal(uuid.uuid4().int, meal_data['user_id'], meal_data['food_id'], meal_data['food_name'],
+                    meal_data['quantity'], meal_data['date'], meal_data['calories'],
+                    meal_data['protein'], meal_data['carbs'], meal_data['fat'], meal_data['fiber'])
+        self._index_meal(meal)
+        return meal.id
+    
+    def _index_meal(self, meal):
+        """Give a meal its surrogate id and add it to the columns, user log and rollup"""
+        self._revision += 1
+        meal.sid = self._meal_columns.add(meal)
+        self.meals.append(meal)
+        self._meal_sids[meal.uuid_int] = meal.sid
+        log = self._meals_by_user.get(meal.user_id)
+        if log is None:
+            log = self._meals_by_user[meal.user_id] = _UserMealLog()
+        log.add(meal)
+        self._rollup.add(meal)
+        self._log('meal', _meal_fields(meal))
     
+    def _unindex_meal(self, meal):
+        """Remove a meal from the columns, its user's log and the rollup"""
+        self._revision += 1
+        self._clear_meal_slot(meal)
+        self._meal_columns.remove(meal.sid)
+        log = self._meals_by_user.get(meal.user_id)
+        if log is not None:
+            log.remove(meal)
+            if not log:
+                del self._meals_by_user[meal.user_id]
+        self._rollup.remove(meal)
+        self._log('delete_meal', meal.uuid_int)
+    
+    def _clear_meal_slot(self, meal):
+        """Drop a meal from the surrogate id lookups, leaving a skip for its slot"""
+        sid = meal.sid
+        before = self._live_meal_before(sid)
+        self.meals[sid] = None
+        # The slot is now the top of its run of deleted ids: the skip moves
+        # up from the slot below, and is left out where the id below is live
+        self._meal_skips.pop(sid - 1, None)
+        if before != sid - 1:
+            self._meal_skips[sid] = before
+        del self._meal_sids[meal.uuid_int]
+    
+    @_reads
     def get_user_meals(self, user_id):
-        """Get all meals for a user"""
-        user_meals = []
-        for meal in self.meals.values():
-            if meal['user_id'] == user_id:
-                user_meals.append(meal)
-        return sorted(user_meals, key=lambda x: x['date'], reverse=True)
+        """Get all meals for a user, most recent date first"""
+        log = self._meals_by_user.get(user_id)
+        return log.latest() if log else []
+    
+    @_reads
+    def get_recent_user_meals(self, user_id, limit):
+        """Get a user's latest meals, most recent date first"""
+        log = self._meals_by_user.get(user_id)
+        return log.latest(limit) if log else []
     
+    @_reads
     def get_user_meals_by_date(self, user_id, meal_date):
         """Get meals for a user on a specific date"""
-        user_meals = []
-        for meal in self.meals.values():
-            if meal['user_id'] == user_id and meal['date'] == meal_date:
-                user_meals.append(meal)
-        return user_meals
+        return self.get_user_meals_between(user_id, meal_date, meal_date)
     
+    @_reads
+    def get_user_meals_between(self, user_id, start_date=None, end_date=None):
+        """Get a user's meals between two dates (inclusive), oldest first"""
+        log = self._meals_by_user.get(user_id)
+        return log.between(start_date, end_date) if log else []
+    
+    @_reads
+    def get_daily_totals(self, user_id, meal_date):
+        """Get a user's summed nutrients for one date"""
+        return self._rollup.day_totals(user_id, meal_date)
+    
+    @_reads
+    def get_nutrition_summary(self, user_id, start_date, end_date):
+        """Get a user's nutrient totals and daily averages between two dates (inclusive)"""
+        return self._rollup.summary(user_id, start_date, end_date)
+    
+    @_reads
+    def get_nutrition_series(self, user_id, start_date, end_date, granularity):
+        """Get nutrition summaries per day, week or month between two dates"""
+        return self._rollup.series(user_id, start_date, end_date, granularity)
+    
+    @_writes
     def delete_meal(self, meal_id, user_id=None):
         """Delete a meal"""
-        if meal_id in self.meals:
-            meal = self.meals[meal_id]
-            if user_id is None or meal['user_id'] == user_id:
-                del self.meals[meal_id]
+        sid = self._meal_sids.get(parse_uuid(meal_id))
+        if sid is not None:
+            meal = self.meals[sid]
+            if user_id is None or meal.user_id == user_id:
+                self._unindex_meal(meal)
                 return True
         return False
     
+    @_reads
     def get_all_meals(self):
         """Get all meals (admin function)"""
-        return list(self.meals.values())
+        return [meal for meal in self.meals if meal is not None]
+    
+    @_reads
+    def get_recent_meals(self, limit):
+        """Get the most recently logged meals, newest first"""
+        # Surrogate ids follow logging order, so walk back from the end
+        recent = []
+        sid = self._live_meal_before(len(self.meals))
+        while sid >= 0 and len(recent) < limit:
+            recent.append(self.meals[sid])
+            sid = self._live_meal_before(sid)
+        return recent
+    
+    def _live_meal_before(self, sid):
+        """The highest surrogate id below sid whose meal is not deleted, or -1
+        
+        Runs of deleted meals are crossed through _meal_skips. Walks start
+        from a live meal, so they enter a run at its top; that id is pointed
+        at the end of the run so the next walk takes one step (path
+        compression, as in union-find), and the skips crossed on the way
+        are dropped. Readers may do this concurrently: deleted ids stay
+        deleted, so any skip left behind is valid, and a missing one only
+        means stepping down an id at a time.
+        """
+        sid -= 1
+        skipped = []
+        while sid >= 0 and self.meals[sid] is None:
+            skipped.append(sid)
+            sid = self._meal_skips.get(sid, sid - 1)
+        if skipped:
+            top = skipped[0]
+            for deleted in skipped[1:]:
+                self._meal_skips.pop(deleted, None)
+            if sid == top - 1:
+                self._meal_skips.pop(top, None)
+            else:
+                self._meal_skips[top] = sid
+        return sid
+    
+    def iter_meals(self, start_date=None, end_date=None, user_id=None):
+        """Iterate over meals in the order they were logged without copying the meal log
+        
+        Optionally only one user's meals, or those between two dates (inclusive).
+        """
+        if user_id is not None:
+            with self._lock.read():
+                log = self._meals_by_user.get(user_id)
+                meals = log.between(start_date, end_date) if log else []
+            yield from sorted(meals, key=attrgetter('sid'))
+            return
+        # Walk surrogate ids, as iter_foods walks catalog positions; meals
+        # deleted after iteration began may still be yielded
+        meals = self.meals
+        sid = 0
+        while sid < len(meals):
+            meal = meals[sid]
+            sid += 1
+            if (meal is not None and (start_date is None or meal.date >= start_date) and
+                    (end_date is None or meal.date <= end_date)):
+                yield meal
+    
+    # Meal analytics (admin functions)
+    @_reads_catalog
+    def get_counts(self):
+        """Get the number of users, foods and meals"""
+        return {'users': len(self.users), 'foods': len(self.foods), 'meals': len(self._meal_sids)}
+    
+    @_reads
+    def get_meal_stats(self):
+        """Get the meal count, users with meals and nutrient totals across all meals"""
+        totals = self._meal_columns.totals()
+        return {
+            'meals': totals['meals'],
+            'users': len(self._meals_by_user),
+            'totals': {nutrient: totals[nutrient] for nutrient in NUTRIENTS}
+        }
+    
+    @_reads
+    def get_meal_trend(self, start_date, end_date):
+        """Get meal counts and nutrient totals per logged date across all users"""
+        groups = self._meal_columns.group_by('date', start_date, end_date)
+        return [{'date': meal_date, 'meals': group['meals'],
+                 **{nutrient: group[nutrient] for nutrient in NUTRIENTS}}
+                for meal_date, group in sorted(groups.items())]
+    
+    @_reads
+    def get_popular_foods(self, limit):
+        """Get the most logged foods with their meal counts and total quantity"""
+        groups = self._meal_columns.group_by('food_id')
+        ranked = sorted(groups.items(), key=lambda item: (-item[1]['meals'], item[0]))
+        return [{'food_id': food_id, 'meals': group['meals'], 'quantity': group['quantity']}
+                for food_id, group in ranked[:limit]]
+    
+    @_reads
+    def get_most_active_users(self, limit):
+        """Get the users with the most meals, with their meal counts and calories"""
+        groups = self._meal_columns.group_by('user_id')
+        ranked = sorted(groups.items(), key=lambda item: (-item[1]['meals'], item[0]))
+        return [{'user_id': user_id, 'meals': group['meals'], 'calories': group['calories']}
+                for user_id, group in ranked[:limit]]
+    
+    # Operation log
+    def _log(self, op, args):
+        """Record a change in the operation log, if the store has one"""
+        if self._oplog is not None:
+            self._oplog.append(op, args)
+    
+    def _check_writable(self):
+        """Raise RuntimeError if another process writes this store's operation log"""
+        if self._oplog is not None:
+            self._oplog.check_writable()
+    
+    def _catch_up(self):
+        """Bring a forked copy of the store up to date with its snapshot and operation log
+        
+        Called by the operation log in a process taking it over from one
+        that has exited, whose changes this copy has not seen. If that
+        process saved a snapshot since, the log no longer holds all of
+        them, so the store is rebuilt from the snapshot first.
+        """
+        oplog, self._oplog = self._oplog, None
+        try:
+            after = oplog.get_seq()
+            state = read_snapshot(self._snapshot_path) if self._snapshot_path else None
+            if state is not None and state['oplog_seq'] > after:
+                self._clear()
+                if self._shared_catalog is not None:
+                    self._attach_catalog(self._shared_catalog.current())
+                self._restore_snapshot(state)
+                after = state['oplog_seq']
+            oplog.replay(self._apply_operation, after)
+            self._revision += 1
+        finally:
+            self._oplog = oplog
+    
+    def _apply_operation(self, op, args):
+        """Replay one logged change; changes already in the store are skipped"""
+        if op in ('food', 'foods', 'delete_food') and self._shared_catalog is not None:
+            # The shared catalog keeps its own generations
+            return
+        if op == 'user':
+            if args[0] not in self.users:
+                self._insert_user(User(*args))
+        elif op == 'delete_user':
+            self.delete_user(args)
+        elif op == 'food':
+            food = Food(*args)
+            if food.id in self.foods:
+                self._replace_food(food)
+            else:
+                self._insert_foods([food])
+        elif op == 'foods':
+            self._insert_foods([Food(*fields) for fields in args if fields[0] not in self.foods])
+        elif op == 'delete_food':
+            self.delete_food(args)
+        elif op == 'meal':
+            if args[0] not in self._meal_sids:
+                self._index_meal(Meal(*args))
+        elif op == 'delete_meal':
+            sid = self._meal_sids.get(args)
+            if sid is not None:
+                self._unindex_meal(self.meals[sid])
+        else:
+            raise ValueError(f'Unknown operation in log: {op}')
+    
+    # Snapshots
+    def get_revision(self):
+        """Get a counter that moves on every change to the store"""
+        return self._revision
+    
+    def save_snapshot(self, path):
+        """Write the store's users, foods and meals to a snapshot file atomically
+        
+        Saving to the store's own snapshot path also drops the operation
+        log records the snapshot now covers.
+        """
+        state = self._snapshot_state()
+        write_snapshot(path, state)
+        if self._oplog is not None and path == self._snapshot_path:
+            self._oplog.compact(state['oplog_seq'])
+    
+    def _snapshot_state(self):
+        """Capture users, foods and meals; indexes are rebuilt on restore
+        
+        Runs alongside request handling without blocking it: every shared
+        container is copied in a single step and records are replaced
+        rather than modified, so each part of the snapshot is consistent.
+        Changes logged after oplog_seq may or may not be captured; replaying
+        them on restore is idempotent.
+        """
+        # Read before capturing: every change up to it is already applied
+        oplog_seq = self._oplog.get_seq() if self._oplog is not None else 0
+        users = [_user_fields(user) for user in list(self.users.values())]
+        # A shared catalog keeps its foods in its own images
+        catalog = food_revisions = None
+        if self._shared_catalog is None:
+            catalog = []
+            for food_id in self._catalog[:]:
+                food = self.foods.get(food_id) if food_id is not None else None
+                catalog.append(None if food is None else _food_fields(food))
+            food_revisions = dict(self._food_revisions)
+        
+        # Meals are stored as columns grouped by user in log order, so the
+        # per-user logs and rollups rebuild on restore without sorting.
+        # Repeated id, name and date strings are pickled once each.
+        user_ids = {user[0] for user in users}
+        meal_users = []
+        uuid_high = array('Q')
+        uuid_low = array('Q')
+        food_ids = []
+        food_names = []
+        dates = []
+        values = {column: array('d') for column in _SNAPSHOT_MEAL_COLUMNS}
+        quantity, calories, protein, carbs, fat, fiber, created = (
+            values[column] for column in _SNAPSHOT_MEAL_COLUMNS)
+        for user_id, log in list(self._meals_by_user.items()):
+            if user_id not in user_ids:
+                continue
+            meals = list(log)
+            meal_users.append((user_id, len(meals)))
+            for meal in meals:
+                uuid_high.append(meal.uuid_int >> 64)
+                uuid_low.append(meal.uuid_int & 0xFFFFFFFFFFFFFFFF)
+                food_ids.append(meal.food_id)
+                food_names.append(meal.food_name)
+                dates.append(meal.date)
+                quantity.append(meal.quantity)
+                calories.append(meal.calories)
+                protein.append(meal.protein)
+                carbs.append(meal.carbs)
+                fat.append(meal.fat)
+                fiber.append(meal.fiber)
+                created.append(meal.created)
+        
+        return {
+            'oplog_seq': oplog_seq,
+            'users': users,
+            'catalog': catalog,
+            'catalog_version': self._catalog_version,
+            'catalog_modified': self._catalog_modified,
+            'food_revisions': food_revisions,
+            'meal_users': meal_users,
+            'meal_uuid_high': uuid_high,
+            'meal_uuid_low': uuid_low,
+            'meal_food_ids': food_ids,
+            'meal_food_names': food_names,
+            'meal_dates': dates,
+            'meal_values': values
+        }
+    
+    def _restore_snapshot(self, state):
+        """Rebuild the store and all of its indexes from a snapshot"""
+        # A restore allocates millions of records and none of them are
+        # garbage, so the cyclic collector would only rescan them over and
+        # over as they pile up
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            self._restore_records(state)
+        finally:
+            if collecting:
+                gc.enable()
+    
+    def _restore_records(self, state):
+        """_restore_snapshot with the garbage collector paused"""
+        for user in state['users']:
+            self._insert_user(User(*user))
+        # A shared catalog keeps its own generations, and snapshots taken
+        # with one hold no catalog
+        if self._shared_catalog is None and state['catalog'] is not None:
+            # Insert each run of foods between deleted slots in one go
+            foods = []
+            for food in state['catalog']:
+                if food is None:
+                    self._insert_foods(foods)
+                    foods = []
+                    self._catalog.append(None)
+                else:
+                    foods.append(Food(*food))
+            self._insert_foods(foods)
+            self._catalog_version = state['catalog_version']
+            self._catalog_modified = state['catalog_modified']
+            self._food_revisions = state['food_revisions']
+        
+        values = state['meal_values']
+        columns = [values[column].tolist() for column in _SNAPSHOT_MEAL_COLUMNS]
+        nutrient_columns = columns[1:1 + len(NUTRIENTS)]
+        dates = state['meal_dates']
+        rows = zip(state['meal_uuid_high'].tolist(), state['meal_uuid_low'].tolist(),
+                   state['meal_food_ids'], state['meal_food_names'], dates, *columns)
+        meals = []
+        logs = []
+        for user_id, count in state['meal_users']:
+            start = len(meals)
+            user_meals = [
+                Meal((high << 64) | low, user_id, food_id, food_name, quantity, meal_date,
+                     calories, protein, carbs, fat, fiber, created)
+                for high, low, food_id, food_name, meal_date, quantity, calories, protein,
+                    carbs, fat, fiber, created
+                in islice(rows, count)
+            ]
+            meals.extend(user_meals)
+            logs.append((user_id, user_meals))
+            # A user's meals are in date order
+            self._rollup.add_sorted(user_id, dates[start:start + count],
+                                    [column[start:start + count] for column in nutrient_columns])
+        
+        # Surrogate ids follow logging order, which get_recent_meals and
+        # iter_meals rely on, so number the rows by creation time
+        order = sorted(range(len(meals)), key=columns[-1].__getitem__)
+        self.meals = list(map(meals.__getitem__, order))
+        for sid, meal in enumerate(self.meals):
+            meal.sid = sid
+        self._meal_sids = {meal.uuid_int: meal.sid for meal in self.meals}
+        for user_id, user_meals in logs:
+            # Meals logged at once from several threads may have been
+            # created out of surrogate id order; the list is nearly sorted
+            user_meals.sort(key=attrgetter('date', 'sid'))
+            self._meals_by_user[user_id] = _UserMealLog.from_sorted(user_meals)
+        user_ids = [user_id for user_id, count in state['meal_users'] for _ in range(count)]
+        self._meal_columns.extend({
+            **{column: list(map(column_values.__getitem__, order))
+               for column, column_values in zip(_SNAPSHOT_MEAL_COLUMNS, columns)},
+            'user_id': list(map(user_ids.__getitem__, order)),
+            'food_id': list(map(state['meal_food_ids'].__getitem__, order)),
+            'date': list(map(dates.__getitem__, order))
+        })
@@ -0,0 +1,569 @@
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Shared catalogs need POSIX file locks
+    fcntl = None
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; nutrient rows are then read as lists
+    numpy = None
+
+from food_index import FoodSearchIndex, tokenize, trigrams
+from records import Food
+from rollup import NUTRIENTS
+
+CATALOG_MAGIC = b'NTFC'
+# Bumped whenever the image layout changes
+CATALOG_FORMAT = 2
+
+# Sections of an image in file order, with their array typecodes ('B' for
+# UTF-8 string data). String tables and lists are an offsets section with
+# one more entry than items, followed by the concatenated items.
+_SECTIONS = (
+    # Per slot: the nutrients, then the creation time
+    ('values', 'd'),
+    ('id_offsets', 'Q'), ('ids', 'B'),
+    ('name_offsets', 'Q'), ('names', 'B'),
+    # Live slots ordered by food id, for binary search
+    ('id_order', 'I'),
+    # Name index: sorted name tokens, the slots whose name has each token
+    # (and whose name starts with it), sorted trigrams and the tokens
+    # containing each trigram
+    ('token_offsets', 'Q'), ('tokens', 'B'),
+    ('posting_offsets', 'Q'), ('postings', 'I'),
+    ('leading_offsets', 'Q'), ('leading', 'I'),
+    ('gram_offsets', 'Q'), ('grams', 'B'),
+    ('gram_token_offsets', 'Q'), ('gram_tokens', 'I'),
+)
+# Offsets section of each string or list table
+_TABLE_OFFSETS = {
+    'ids': 'id_offsets', 'names': 'name_offsets', 'tokens': 'token_offsets',
+    'postings': 'posting_offsets', 'leading': 'leading_offsets',
+    'grams': 'gram_offsets', 'gram_tokens': 'gram_token_offsets'
+}
+# magic, format, slots, live foods, generation, modified; then the offset
+# and size of each section
+_HEADER = struct.Struct('<4sIQQQd' + 'QQ' * len(_SECTIONS))
+# Doubles stored per slot: the nutrients, then the creation time
+_SLOT_VALUES = len(NUTRIENTS) + 1
+_COUNTER = struct.Struct('<Q')
+
+def _aligned(offset):
+    return (offset + 7) & ~7
+
+def _string_table(strings):
+    """Offsets and data sections for a list of encoded strings"""
+    offsets = array('Q', [0])
+    for string in strings:
+        offsets.append(offsets[-1] + len(string))
+    return offsets, b''.join(strings)
+
+def _list_table(lists):
+    """Offsets and data sections for a list of integer lists"""
+    offsets = array('Q', [0])
+    values = array('I')
+    for items in lists:
+        values.extend(items)
+        offsets.append(len(values))
+    return offsets, values
+
+def _name_index(names):
+    """Name index sections for the names of the live slots, by position"""
+    postings = {}
+    leading = {}
+    for position, name in names:
+        tokens = tuple(dict.fromkeys(tokenize(name)))
+        for token in tokens:
+            postings.setdefault(token, []).append(position)
+        if tokens:
+            leading.setdefault(tokens[0], []).append(position)
+    vocabulary = sorted(postings)
+    gram_tokens = {}
+    for token_number, token in enumerate(vocabulary):
+        for gram in trigrams(token):
+            gram_tokens.setdefault(gram, []).append(token_number)
+    grams = sorted(gram_tokens)
+
+    sections = {}
+    sections['token_offsets'], sections['tokens'] = _string_table(
+        [token.encode() for token in vocabulary])
+    sections['posting_offsets'], sections['postings'] = _list_table(
+        postings[token] for token in vocabulary)
+    sections['leading_offsets'], sections['leading'] = _list_table(
+        leading.get(token, ()) for token in vocabulary)
+    sections['gram_offsets'], sections['grams'] = _string_table(
+        [gram.encode() for gram in grams])
+    sections['gram_token_offsets'], sections['gram_tokens'] = _list_table(
+        gram_tokens[gram] for gram in grams)
+    return sections
+
+def write_catalog(path, slots, generation=0):
+    """Atomically write catalog slots as a binary catalog image
+
+    slots are Food constructor argument tuples in catalog order, or None
+    for deleted positions, which are kept so positions stay stable.
+    """
+    values = array('d')
+    ids = []
+    names = []
+    live = []
+    empty = [0.0] * _SLOT_VALUES
+    for position, slot in enumerate(slots):
+        if slot is None:
+            values.extend(empty)
+            ids.append(b'')
+            names.append(b'')
+        else:
+            values.extend(slot[2:])
+            ids.append(slot[0].encode())
+            names.append(slot[1].encode())
+            live.append(position)
+
+    sections = {'values': values}
+    sections['id_offsets'], sections['ids'] = _string_table(ids)
+    sections['name_offsets'], sections['names'] = _string_table(names)
+    # Encoded ids sort in the same order as the strings
+    sections['id_order'] = array('I', sorted(live, key=ids.__getitem__))
+    sections.update(_name_index((position, slots[position][1]) for position in live))
+    if sys.byteorder != 'little':
+        for section in sections.values():
+            if isinstance(section, array):
+                section.byteswap()
+
+    layout = []
+    offset = _aligned(_HEADER.size)
+    for name, _ in _SECTIONS:
+        size = len(sections[name]) * getattr(sections[name], 'itemsize', 1)
+        layout += [offset, size]
+        offset = _aligned(offset + size)
+    header = _HEADER.pack(CATALOG_MAGIC, CATALOG_FORMAT, len(ids), len(live), generation,
+                          datetime.now(timezone.utc).timestamp(), *layout)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.catalog-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as image_file:
+            image_file.write(header)
+            for (name, _), section_offset in zip(_SECTIONS, layout[::2]):
+                image_file.write(b'\0' * (section_offset - image_file.tell()))
+                image_file.write(sections[name])
+            image_file.flush()
+            os.fsync(image_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+class _StringTable(Sequence):
+    """Strings of a mapped string table, decoded on access"""
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def raw(self, index):
+        """Encoded string at index"""
+        return self._data[self._offsets[index]:self._offsets[index + 1]].tobytes()
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return str(self._data[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+class _ListTable(Sequence):
+    """Integer lists of a mapped list table, as memoryview slices"""
+
+    def __init__(self, offsets, values):
+        self._offsets = offsets
+        self._values = values
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._values[self._offsets[index]:self._offsets[index + 1]]
+
+class _TableMapping(Mapping):
+    """Read-only mapping of a sorted string table's strings to value(index)"""
+
+    def __init__(self, keys, value):
+        self._keys = keys
+        self._value = value
+
+    def __getitem__(self, key):
+        index = bisect_left(self._keys, key)
+        if index == len(self._keys) or self._keys[index] != key:
+            raise KeyError(key)
+        return self._value(index)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+class _TrigramCounts:
+    """Trigram count of any token, computed on lookup"""
+
+    def __getitem__(self, token):
+        return len(trigrams(token))
+
+class CatalogSearchIndex(FoodSearchIndex):
+    """FoodSearchIndex reading a catalog image's name index in place
+
+    Matching and ranking are FoodSearchIndex's own; only its containers are
+    replaced by views of the mapped sections, so a search touches just the
+    pages of the tokens, postings and trigrams it looks up. Read-only: the
+    image is rewritten rather than the index updated.
+    """
+
+    def __init__(self, image, similarity_threshold=FoodSearchIndex.SIMILARITY_THRESHOLD):
+        self.similarity_threshold = similarity_threshold
+        tokens = image.table('tokens')
+        grams = image.table('grams')
+        postings = image.lists('postings')
+        leading = image.lists('leading')
+        gram_tokens = image.lists('gram_tokens')
+        self._image = image
+        self._vocabulary = tokens
+        self._postings = _TableMapping(tokens, postings.__getitem__)
+        self._leading_postings = _TableMapping(tokens, leading.__getitem__)
+        self._trigram_postings = _TableMapping(
+            grams, lambda index: map(tokens.__getitem__, gram_tokens[index]))
+        self._trigram_counts = _TrigramCounts()
+        self._food_ids = CatalogColumn(image, image.food_id)
+
+    def __len__(self):
+        return len(self._image)
+
+    def _ordered(self, token, leading=False):
+        # Mapped postings are stored in position order
+        return (self._leading_postings if leading else self._postings).get(token, ())
+
+    def _probe(self, tokens):
+        # Mapped postings are sorted, so membership is a binary search
+        postings = [self._postings.get(token, ()) for token in tokens]
+
+        def probe(position):
+            for token_postings in postings:
+                index = bisect_left(token_postings, position)
+                if index < len(token_postings) and token_postings[index] == position:
+                    return True
+            return False
+        return probe
+
+class FoodCatalogImage:
+    """Read-only food catalog memory-mapped from a file written by write_catalog
+
+    Slot values are fixed-width doubles, ids and names live in string
+    tables and the name index is stored alongside, so opening an image
+    reads only its header: foods are decoded one at a time on access,
+    resident memory grows with the pages actually touched, and processes
+    mapping the same file share those pages.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as image_file:
+            self._map = mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(CATALOG_MAGIC)] != CATALOG_MAGIC:
+            raise ValueError(f'Not a food catalog image: {path}')
+        header = _HEADER.unpack_from(self._map)
+        _, image_format, slots, live, self.generation, modified = header[:6]
+        if image_format != CATALOG_FORMAT:
+            raise ValueError(f'Unsupported food catalog image format {image_format}: {path}')
+        if sys.byteorder != 'little':
+            raise ValueError('Food catalog images can only be read on little-endian hosts')
+        self.modified = datetime.fromtimestamp(modified, timezone.utc)
+        self._slots = slots
+        self._live = live
+
+        view = memoryview(self._map)
+        self._sections = {}
+        self._offsets = {}
+        for (name, typecode), offset, size in zip(_SECTIONS, header[6::2], header[7::2]):
+            self._sections[name] = view[offset:offset + size].cast(typecode)
+            self._offsets[name] = offset
+        self._values = self._sections['values']
+        self._ids = self.table('ids')
+        self._names = self.table('names')
+        self._order = self._sections['id_order']
+
+    def table(self, name):
+        """String table section by name"""
+        return _StringTable(self._sections[_TABLE_OFFSETS[name]], self._sections[name])
+
+    def lists(self, name):
+        """List table section by name"""
+        return _ListTable(self._sections[_TABLE_OFFSETS[name]], self._sections[name])
+
+    def __len__(self):
+        return self._live
+
+    @property
+    def slot_count(self):
+        """Number of catalog positions, deleted ones included"""
+        return self._slots
+
+    def food_id(self, position):
+        """Id of the food at a catalog position, or None where it was deleted"""
+        return self._ids[position] or None
+
+    def name(self, position):
+        return self._names[position]
+
+    def food(self, position):
+        """Food record at a catalog position, or None where it was deleted"""
+        food_id = self.food_id(position)
+        if food_id is None:
+            return None
+        base = position * _SLOT_VALUES
+        return Food(food_id, self.name(position), *self._values[base:base + _SLOT_VALUES].tolist())
+
+    def position(self, food_id):
+        """Catalog position of a food id, or None if it is not in the catalog"""
+        try:
+            key = food_id.encode()
+        except AttributeError:
+            return None
+        lo, hi = 0, self._live
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if self._ids.raw(self._order[middle]) < key:
+                lo = middle + 1
+            else:
+                hi = middle
+        if lo < self._live and self._ids.raw(self._order[lo]) == key:
+            return self._order[lo]
+        return None
+
+    def live_positions(self):
+        """Positions of the catalog's foods in catalog order"""
+        offsets = self._sections['id_offsets']
+        return (position for position in range(self._slots)
+                if offsets[position + 1] > offsets[position])
+
+    def search_index(self):
+        """Search index over the image's stored name index"""
+        return CatalogSearchIndex(self)
+
+    def slots(self):
+        """The catalog as write_catalog slots, for writing an edited copy"""
+        values = self._values.tolist()
+        slots = []
+        for position in range(self._slots):
+            food_id = self.food_id(position)
+            if food_id is None:
+                slots.append(None)
+            else:
+                base = position * _SLOT_VALUES
+                slots.append((food_id, self.name(position), *values[base:base + _SLOT_VALUES]))
+        return slots
+
+    def nutrient_rows(self):
+        """Per-slot nutrient values in NUTRIENTS order, without copying
+
+        A read-only NumPy view when NumPy is available, otherwise a
+        sequence of per-slot lists.
+        """
+        if numpy is None:
+            return _NutrientRows(self._values)
+        values = numpy.frombuffer(self._map, dtype=numpy.float64, count=self._slots * _SLOT_VALUES,
+                                  offset=self._offsets['values'])
+        return values.reshape(self._slots, _SLOT_VALUES)[:, :len(NUTRIENTS)]
+
+class _NutrientRows(Sequence):
+    """Nutrient values of each slot as lists, read from the mapped doubles"""
+
+    def __init__(self, values):
+        self._values = values
+
+    def __len__(self):
+        return len(self._values) // _SLOT_VALUES
+
+    def __getitem__(self, position):
+        base = position * _SLOT_VALUES
+        return self._values[base:base + len(NUTRIENTS)].tolist()
+
+class CatalogColumn(Sequence):
+    """Read-only sequence of value(position) over a catalog image's positions"""
+
+    def __init__(self, image, value):
+        self._image = image
+        self._value = value
+
+    def __len__(self):
+        return self._image.slot_count
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self._value(index) for index in range(len(self))[position]]
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return self._value(position)
+
+class CatalogMapping(Mapping):
+    """Read-only mapping of a catalog image's food ids to value(position)"""
+
+    def __init__(self, image, value):
+        self._image = image
+        self._value = value
+
+    def __getitem__(self, food_id):
+        position = self._image.position(food_id)
+        if position is None:
+            raise KeyError(food_id)
+        return self._value(position)
+
+    def __contains__(self, food_id):
+        return self._image.position(food_id) is not None
+
+    def __iter__(self):
+        return map(self._image.food_id, self._image.live_positions())
+
+    def __len__(self):
+        return len(self._image)
+
+    def values(self):
+        """Values in catalog order, without looking each food id up"""
+        return map(self._value, self._image.live_positions())
+
+class _PendingEdit:
+    """An edit waiting in SharedFoodCatalog.update, and its outcome once published"""
+
+    __slots__ = ('edit', 'done', 'changed', 'error', 'image')
+
+    def __init__(self, edit):
+        self.edit = edit
+        self.done = False
+        self.changed = False
+        self.error = None
+        self.image = None
+
+class SharedFoodCatalog:
+    """Food catalog images shared by every process through a directory
+
+    Edits publish a new generation, catalog-<generation>.bin, and bump a
+    counter in a small memory-mapped file, so other processes see the
+    change on their next read and remap. Publishing happens under an
+    exclusive file lock and always edits the latest generation. Keep the
+    directory on tmpfs (such as /dev/shm) so images live in shared memory.
+    """
+
+    def __init__(self, directory):
+        if fcntl is None:
+            raise RuntimeError('Shared food catalogs need POSIX file locks (fcntl)')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock_path = os.path.join(directory, 'lock')
+        fd = os.open(os.path.join(directory, 'generation'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < _COUNTER.size:
+                os.ftruncate(fd, _COUNTER.size)
+            self._counter = mmap.mmap(fd, _COUNTER.size)
+        finally:
+            os.close(fd)
+        self._image = None
+        # Edits waiting for the next generation, and the lock held by the
+        # thread publishing one
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+
+    def _path(self, generation):
+        return os.path.join(self.directory, f'catalog-{generation}.bin')
+
+    def generation(self):
+        """Current generation, 0 before anything was published"""
+        return _COUNTER.unpack_from(self._counter)[0]
+
+    def current(self):
+        """Image of the current generation, or None before the first publish"""
+        while True:
+            generation = self.generation()
+            if generation == 0:
+                return None
+            if self._image is not None and self._image.generation == generation:
+                return self._image
+            try:
+                self._image = FoodCatalogImage(self._path(generation))
+                return self._image
+            except FileNotFoundError:
+                # Superseded and removed meanwhile; read the counter again
+                continue
+
+    def update(self, edit):
+        """Publish edit(image, slots) applied to the latest generation
+
+        image is the latest generation's image (None if there is none) and
+        slots its write_catalog slots, which edit changes in place; edit
+        returns whether it changed anything. Returns the current image and
+        that flag.
+
+        Edits made by other threads while a generation is being written
+        are published together as the next one, so a burst of edits writes
+        the image once rather than once per edit. Edits of one batch get
+        the same image but see each other's changes to slots. An edit that
+        raises has its error raised to its caller and any slots it appended
+        dropped, so it must not replace slots before raising.
+        """
+        request = _PendingEdit(edit)
+        with self._pending_lock:
+            self._pending.append(request)
+        with self._publish_lock:
+            if not request.done:
+                with self._pending_lock:
+                    batch, self._pending = self._pending, []
+                self._publish(batch)
+        if request.error is not None:
+            raise request.error
+        return request.image, request.changed
+
+    def _publish(self, batch):
+        """Apply a batch of pending edits and publish them as one generation"""
+        image = failure = None
+        try:
+            with open(self._lock_path, 'a') as lock_file:
+                # Released when the lock file is closed
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                image = self.current()
+                slots = image.slots() if image is not None else []
+                for request in batch:
+                    size = len(slots)
+                    try:
+                        request.changed = bool(request.edit(image, slots))
+                    except Exception as error:
+                        request.error = error
+                        del slots[size:]
+                if any(request.changed for request in batch):
+                    generation = self.generation() + 1
+                    write_catalog(self._path(generation), slots, generation)
+                    _COUNTER.pack_into(self._counter, 0, generation)
+                    self._counter.flush()
+                    if image is not None:
+                        # Processes still mapping the old image keep it until they remap
+                        os.unlink(self._path(image.generation))
+                    image = self.current()
+        except Exception as error:
+            failure = error
+        finally:
+            for request in batch:
+                request.image = image
+                if request.error is None:
+                    request.error = failure
+                request.done = True
@@ -0,0 +1,94 @@
+import csv
+import math
+
+from rollup import NUTRIENTS
+
+# Foods handed to the store at a time
+IMPORT_BATCH_SIZE = 1000
+# Invalid rows listed in the report; further ones are only counted
+MAX_REPORTED_ERRORS = 100
+
+def normalize_food_name(name):
+    """Name used to spot duplicate foods: case-folded with whitespace collapsed"""
+    return ' '.join(name.casefold().split())
+
+def parse_food_row(row):
+    """Food dict for a CSV row, or raise ValueError saying what is wrong with it
+
+    Nutrient cells left empty count as 0, like in the admin food form.
+    """
+    name = ' '.join((row.get('name') or '').split())
+    if not name:
+        raise ValueError('Missing name')
+    food = {'name': name}
+    for nutrient in NUTRIENTS:
+        cell = (row.get(nutrient) or '').strip()
+        try:
+            value = float(cell) if cell else 0.0
+        except ValueError:
+            raise ValueError(f'Invalid {nutrient}: {cell!r}') from None
+        if not math.isfinite(value) or value < 0:
+            raise ValueError(f'Invalid {nutrient}: {cell!r}')
+        food[nutrient] = value
+    return food
+
+def _food_batches(reader, known_names, report, batch_size, progress):
+    """Yield lists of valid, not yet known foods from a CSV reader, updating the report"""
+    batch = []
+    try:
+        for row in reader:
+            report['rows'] += 1
+            try:
+                food = parse_food_row(row)
+            except ValueError as e:
+                report['invalid'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({'line': reader.line_num, 'error': str(e)})
+                continue
+            key = normalize_food_name(food['name'])
+            if key in known_names:
+                report['duplicates'] += 1
+                continue
+            known_names.add(key)
+            batch.append(food)
+            if len(batch) >= batch_size:
+                yield batch
+                report['imported'] += len(batch)
+                batch = []
+                if progress is not None:
+                    progress(report)
+    except (csv.Error, UnicodeDecodeError) as e:
+        # Keep the rows read so far, like the batches already stored
+        report['error'] = f'Stopped after line {reader.line_num}: {e}'
+    if batch:
+        yield batch
+        report['imported'] += len(batch)
+        if progress is not None:
+            progress(report)
+
+def import_foods_csv(data_store, csv_file, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """Import foods from a CSV text stream into the store, returning a report
+
+    The file needs a header with a name column and the nutrient columns
+    (calories, protein, carbs, fat, fiber), per serving. Rows are read one
+    at a time and handed to the store's import_foods in batches, so memory
+    stays bounded whatever the file size. Invalid rows and foods whose
+    normalized name is already in the catalog (or earlier in the file)
+    are skipped. progress, if given, is called with the report after each
+    batch. Raises ValueError if required columns are missing.
+
+    The report counts the rows read, foods imported, duplicates and
+    invalid rows, and lists the first invalid rows with their line numbers.
+    If the file cannot be read to the end (bad encoding or CSV quoting),
+    the import stops there with an error entry saying where; the foods
+    before it are kept and counted as imported.
+    """
+    reader = csv.DictReader(csv_file)
+    missing = [column for column in ('name',) + NUTRIENTS
+               if column not in (reader.fieldnames or ())]
+    if missing:
+        raise ValueError(f"Missing CSV columns: {', '.join(missing)}")
+    report = {'rows': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0, 'errors': []}
+    known_names = {normalize_food_name(food['name']) for food in data_store.iter_foods()}
+    data_store.import_foods(_food_batches(reader, known_names, report, batch_size, progress))
+    return report
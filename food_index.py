@@ -0,0 +1,488 @@
+import heapq
+import math
+import re
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import chain
+from operator import itemgetter
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+def tokenize(text):
+    """Split a food name or query into lower-case word tokens"""
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+def trigrams(token):
+    """Padded character trigrams of a token (pg_trgm style)"""
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _smallest(values, limit):
+    """The smallest values in ascending order, optionally capped at limit"""
+    if limit is None:
+        return sorted(values)
+    return heapq.nsmallest(limit, values)
+
+class FoodSearchIndex:
+    """Inverted token index over food names with prefix and fuzzy lookups
+
+    Each food gets an integer position in catalog order; postings are sets
+    of positions so matching and ordering run as set and integer operations.
+    Trigrams map to vocabulary tokens, letting misspelled query words be
+    matched by similarity without touching every food.
+    """
+
+    # Minimum trigram similarity for a fuzzy token match
+    SIMILARITY_THRESHOLD = 0.3
+    # Score of a token containing the query word other than at its start,
+    # ranking it after prefix matches and ahead of most misspellings
+    SUBSTRING_SCORE = 0.9
+    # Query words shorter than this only match as prefixes
+    MIN_FUZZY_LENGTH = 3
+    # Most combinations of per-word score levels ranked one by one
+    MAX_SCORE_COMBINATIONS = 256
+    # Most misspelling matches kept per query word, the most similar first
+    MAX_FUZZY_TOKENS = 16
+    # Postings are walked in position order for the first matches, instead
+    # of being intersected whole, when this many times more matches than
+    # requested are expected; a walk probing more than this fraction of the
+    # postings falls back to intersecting them, which costs about as much
+    ORDERED_SCAN_FACTOR = 20
+    ORDERED_SCAN_SHARE = 0.1
+
+    def __init__(self, similarity_threshold=SIMILARITY_THRESHOLD):
+        self.similarity_threshold = similarity_threshold
+        self._postings = {}
+        # Sorted copies of postings walked in position order, made on demand
+        self._ordered_postings = {}
+        self._ordered_leading = {}
+        self._leading_postings = {}
+        self._vocabulary = []
+        self._trigram_postings = {}
+        self._trigram_counts = {}
+        self._positions = {}
+        self._food_ids = {}
+        self._tokens = {}
+        self._next_position = 0
+
+    def __len__(self):
+        return len(self._positions)
+
+    def add(self, food_id, name, position=None):
+        """Index a food under each token of its name"""
+        for token in self._index(food_id, name, position):
+            insort(self._vocabulary, token)
+            self._add_trigrams(token)
+
+    def add_many(self, foods):
+        """Index many (food_id, name, position) foods at once
+
+        New vocabulary tokens are sorted into the vocabulary in one go
+        rather than inserted one at a time.
+        """
+        new_tokens = []
+        for food_id, name, position in foods:
+            new_tokens += self._index(food_id, name, position)
+        if len(new_tokens) < 64:
+            # Cheaper than re-sorting for a handful of tokens
+            for token in new_tokens:
+                insort(self._vocabulary, token)
+        else:
+            self._vocabulary = sorted(self._vocabulary + new_tokens)
+        for token in new_tokens:
+            self._add_trigrams(token)
+
+    def _index(self, food_id, name, position):
+        """Add a food's postings, returning the tokens new to the vocabulary"""
+        if position is None:
+            position = self._next_position
+            self._next_position += 1
+        tokens = tuple(dict.fromkeys(tokenize(name)))
+        self._positions[food_id] = position
+        self._food_ids[position] = food_id
+        self._tokens[position] = tokens
+        new_tokens = []
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                new_tokens.append(token)
+            postings.add(position)
+            self._ordered_postings.pop(token, None)
+        if tokens:
+            self._leading_postings.setdefault(tokens[0], set()).add(position)
+            self._ordered_leading.pop(tokens[0], None)
+        return new_tokens
+
+    def _add_trigrams(self, token):
+        """Register a new vocabulary token's trigrams"""
+        grams = trigrams(token)
+        self._trigram_counts[token] = len(grams)
+        for gram in grams:
+            self._trigram_postings.setdefault(gram, set()).add(token)
+
+    def _remove_token(self, token):
+        """Forget a vocabulary token no food uses any more"""
+        del self._vocabulary[bisect_left(self._vocabulary, token)]
+        del self._trigram_counts[token]
+        for gram in trigrams(token):
+            tokens = self._trigram_postings[gram]
+            tokens.discard(token)
+            if not tokens:
+                del self._trigram_postings[gram]
+
+    def remove(self, food_id):
+        """Drop a food from the index, returning its catalog position"""
+        position = self._positions.pop(food_id, None)
+        if position is None:
+            return None
+        del self._food_ids[position]
+        tokens = self._tokens.pop(position)
+        for token in tokens:
+            postings = self._postings[token]
+            postings.discard(position)
+            self._ordered_postings.pop(token, None)
+            if not postings:
+                del self._postings[token]
+                self._remove_token(token)
+        if tokens:
+            leading = self._leading_postings[tokens[0]]
+            leading.discard(position)
+            self._ordered_leading.pop(tokens[0], None)
+            if not leading:
+                del self._leading_postings[tokens[0]]
+        return position
+
+    def update(self, food_id, name):
+        """Re-index a food whose name changed, keeping its result position
+
+        Foods not in the index yet (such as those of an import still in
+        progress) are left for whoever adds them.
+        """
+        position = self.remove(food_id)
+        if position is not None:
+            self.add(food_id, name, position)
+
+    def _token_scores(self, query_token):
+        """Vocabulary tokens matching a query word, scored in (0, 1]
+
+        Tokens starting with the query word score 1.0, tokens containing it
+        elsewhere ("ana" in banana) SUBSTRING_SCORE and others their trigram
+        (Jaccard) similarity when it reaches the threshold, keeping only the
+        MAX_FUZZY_TOKENS most similar. Words shorter than a trigram only
+        match as prefixes.
+        """
+        # Tokens starting with the word sort between it and the word followed
+        # by the highest code point
+        start = bisect_left(self._vocabulary, query_token)
+        end = bisect_left(self._vocabulary, query_token + '\U0010ffff', start)
+        scores = dict.fromkeys(map(self._vocabulary.__getitem__, range(start, end)), 1.0)
+
+        if len(query_token) < self.MIN_FUZZY_LENGTH:
+            return scores
+        grams = trigrams(query_token)
+        # Every token starting with the same letter shares the leading
+        # trigram, which alone does not make one similar enough (unless
+        # the threshold is very low), so it is only counted for tokens
+        # sharing others
+        first = f'  {query_token[0]}'
+        if 1 / (len(grams) + 1) >= self.similarity_threshold:
+            first = None
+        shared = Counter(chain.from_iterable(self._trigram_postings.get(gram, ())
+                                             for gram in grams if gram != first))
+        # A similar enough token shares at least threshold times the word's
+        # trigrams (it has at least as many as it shares), and one containing
+        # the word shares all of its unpadded ones; tokens sharing fewer than
+        # either are skipped unscored
+        inner = {query_token[i:i + 3] for i in range(len(query_token) - 2)}
+        enough = min(math.ceil(self.similarity_threshold * len(grams) - 1e-9), len(inner))
+        similar = {}
+        for token, count in shared.items():
+            if first is not None:
+                count += token[0] == query_token[0]
+            if count < enough or token in scores:
+                continue
+            similarity = count / (len(grams) + self._trigram_counts[token] - count)
+            if query_token in token:
+                scores[token] = max(similarity, self.SUBSTRING_SCORE)
+            elif similarity >= self.similarity_threshold:
+                similar[token] = similarity
+        if len(similar) > self.MAX_FUZZY_TOKENS:
+            # Ties go to the later token, the same in every index
+            similar = dict(heapq.nlargest(self.MAX_FUZZY_TOKENS, similar.items(),
+                                          key=itemgetter(1, 0)))
+        scores.update(similar)
+        return scores
+
+    def _union(self, tokens, postings=None):
+        """Positions of foods indexed under any of the tokens"""
+        postings = self._postings if postings is None else postings
+        return set().union(*(postings.get(token, ()) for token in tokens))
+
+    def _matching(self, tokens, positions):
+        """Those of positions indexed under any of the tokens"""
+        return set().union(*(positions.intersection(self._postings.get(token, ()))
+                             for token in tokens))
+
+    def _group_size(self, tokens, postings=None):
+        """Number of postings of the tokens, counting foods under several once each"""
+        postings = self._postings if postings is None else postings
+        return sum(len(postings.get(token, ())) for token in tokens)
+
+    def _intersect(self, token_groups):
+        """Positions indexed under some token of every group
+
+        Starts from the group with the fewest postings and narrows it down,
+        so common words are probed rather than gathered.
+        """
+        token_groups = sorted(token_groups, key=self._group_size)
+        positions = self._union(token_groups[0])
+        for tokens in token_groups[1:]:
+            positions = self._matching(tokens, positions)
+        return positions
+
+    def _ordered(self, token, leading=False):
+        """A token's postings, or its leading postings, in ascending order"""
+        cache = self._ordered_leading if leading else self._ordered_postings
+        ordered = cache.get(token)
+        if ordered is None:
+            postings = self._leading_postings if leading else self._postings
+            ordered = cache[token] = sorted(postings.get(token, ()))
+        return ordered
+
+    def _merged(self, tokens, leading=False):
+        """Positions of the tokens' postings (or leading postings) in ascending order"""
+        if len(tokens) == 1:
+            return self._ordered(tokens[0], leading)
+        return heapq.merge(*(self._ordered(token, leading) for token in tokens))
+
+    def _probe(self, tokens):
+        """A test of whether the food at a position is indexed under any of the tokens"""
+        postings = [self._postings.get(token, ()) for token in tokens]
+        if len(postings) == 1:
+            return postings[0].__contains__
+        return lambda position: any(position in token_postings for token_postings in postings)
+
+    def _expected_matches(self, size, token_groups):
+        """Of size foods, those expected under some token of every group
+
+        Assumes words occur independently of each other.
+        """
+        foods = max(len(self), 1)
+        for tokens in token_groups:
+            size *= self._group_size(tokens) / foods
+        return size
+
+    def _first_matches(self, token_groups, limit, skip=(), excluded=()):
+        """The lowest positions indexed under some token of every group, ascending
+
+        Positions in the skip set, or indexed under a token of any excluded
+        group, are left out; at most limit are returned. When the groups
+        are common enough that many more matches than that are expected,
+        the rarest group's postings are walked in order and probed in the
+        others until limit are found, so two common words cost about limit
+        probes rather than an intersection of their whole postings.
+        """
+        token_groups = sorted(token_groups, key=self._group_size)
+        size = self._group_size(token_groups[0])
+        if limit is not None and (self._expected_matches(size, token_groups[1:]) >=
+                                  limit * self.ORDERED_SCAN_FACTOR):
+            found = self._walk_matches(self._merged(token_groups[0]), size, token_groups[1:],
+                                       limit, skip, excluded)
+            if found is not None:
+                return found
+        positions = self._intersect(token_groups)
+        positions.difference_update(skip)
+        for tokens in excluded:
+            if positions:
+                positions -= self._matching(tokens, positions)
+        return _smallest(positions, limit)
+
+    def _walk_matches(self, positions, size, token_groups, limit, skip=(), excluded=()):
+        """The first of size ascending positions matching every group, or None if that runs long
+
+        Positions must also be indexed under some token of each group, and
+        neither in skip nor under a token of an excluded group. Words that
+        rarely occur together leave few matches among many positions, so
+        the walk gives up after ORDERED_SCAN_SHARE of them.
+        """
+        found = []
+        budget = int(size * self.ORDERED_SCAN_SHARE)
+        required = [self._probe(tokens) for tokens in token_groups]
+        unwanted = [self._probe(tokens) for tokens in excluded]
+        previous = None
+        for position in positions:
+            # A food indexed under several of the group's tokens comes up once for each
+            if position == previous or position in skip:
+                continue
+            previous = position
+            for probe in required:
+                if not probe(position):
+                    break
+            else:
+                for probe in unwanted:
+                    if probe(position):
+                        break
+                else:
+                    found.append(position)
+                    if len(found) == limit:
+                        return found
+            budget -= 1
+            if budget < 0:
+                return None
+        return found
+
+    def search(self, query, limit=None):
+        """Food ids ranked by how well their names match the query
+
+        Every query word must match a word of the name, either as a prefix,
+        a substring or by trigram similarity. Foods matching every word by
+        prefix come first (those whose name starts with the query ahead of
+        the rest), followed by the others by descending score; ties keep
+        catalog order. Returns None for a query with no words so callers
+        can fall back to listing the whole catalog.
+        """
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return None
+        word_scores = [self._token_scores(query_token) for query_token in query_tokens]
+        if not all(word_scores):
+            return []
+
+        prefix_tokens = [[token for token, score in token_scores.items() if score == 1.0]
+                         for token_scores in word_scores]
+        ranked = self._first_leading(prefix_tokens, limit)
+        if limit is not None and len(ranked) >= limit:
+            return [self._food_ids[position] for position in ranked]
+        leading = set(ranked)
+        exact = self._first_matches(prefix_tokens, None if limit is None else limit - len(ranked),
+                                    skip=leading)
+        ranked += exact
+        if limit is None or len(ranked) < limit:
+            # Fuzzy matches are only gathered when prefix matches run short,
+            # so every food matching each word by prefix has been found
+            exact = leading.union(exact)
+            remaining = None if limit is None else limit - len(ranked)
+            if len(word_scores) == 1:
+                ranked += self._rank_levels(word_scores[0], exact, remaining)
+            else:
+                ranked += self._rank_fuzzy(word_scores, exact, remaining)
+        return [self._food_ids[position] for position in ranked]
+
+    def _first_leading(self, prefix_tokens, limit):
+        """The lowest positions of names starting with a prefix match of the first word
+        and matching every other word by prefix, ascending
+
+        Names start with their leading token, so the first word's leading
+        postings are a subset of its prefix matches; a short prefix such as
+        "b" fills the first tier by walking them in order, without gathering
+        every food it matches.
+        """
+        first, others = prefix_tokens[0], prefix_tokens[1:]
+        if limit is not None:
+            size = self._group_size(first, self._leading_postings)
+            if self._expected_matches(size, others) >= limit * self.ORDERED_SCAN_FACTOR:
+                # A food has one leading token, so the postings are disjoint
+                found = self._walk_matches(self._merged(first, leading=True), size, others, limit)
+                if found is not None:
+                    return found
+        leading = self._union(first, self._leading_postings)
+        for tokens in others:
+            leading = self._matching(tokens, leading)
+        return _smallest(leading, limit)
+
+    @staticmethod
+    def _score_levels(token_scores):
+        """Group a word's matching tokens by score, best score first"""
+        levels = {}
+        for token, score in token_scores.items():
+            levels.setdefault(score, []).append(token)
+        return sorted(levels.items(), reverse=True)
+
+    def _rank_levels(self, token_scores, exact, limit):
+        """Order a single word's non-prefix matches by descending score, then position
+
+        A food scores its best token, so the score levels are walked from
+        the top instead of gathering and scoring every match first.
+        """
+        ranked = []
+        for score, tokens in self._score_levels(token_scores):
+            if score == 1.0:
+                # Prefix matches, all in exact
+                continue
+            # Earlier levels were taken whole, or the limit was reached
+            ranked += self._first_matches([tokens], None if limit is None else limit - len(ranked),
+                                          skip=exact.union(ranked))
+            if limit is not None and len(ranked) >= limit:
+                break
+        return ranked
+
+    def _rank_fuzzy(self, word_scores, exact, limit):
+        """Order several words' non-prefix matches by descending total score, then position
+
+        A food's total adds up the best score level it reaches for each
+        word, so walking the combinations of levels from the highest total
+        down ranks the best matches without scoring every food that matches
+        at all. Queries with too many combinations score every match.
+        """
+        word_levels = [self._score_levels(token_scores) for token_scores in word_scores]
+        if math.prod(map(len, word_levels)) > self.MAX_SCORE_COMBINATIONS:
+            return self._rank_totals(self._intersect(word_scores) - exact, word_scores, limit)
+        ranked = []
+        group, group_total = set(), None
+        first = (0,) * len(word_levels)
+        heap = [(-self._combination_total(word_levels, first), first)]
+        seen = {first}
+        while heap:
+            negative_total, combination = heapq.heappop(heap)
+            if -negative_total != group_total:
+                # Combinations with equal totals are ranked together by position
+                ranked += _smallest(group, None if limit is None else limit - len(ranked))
+                if limit is not None and len(ranked) >= limit:
+                    return ranked
+                group, group_total = set(), -negative_total
+            if any(levels[index][0] < 1.0 for levels, index in zip(word_levels, combination)):
+                # The all-prefix combination holds exact, ranked already
+                group.update(self._combination_matches(
+                    word_levels, combination, None if limit is None else limit - len(ranked)))
+            for word, index in enumerate(combination):
+                if index + 1 < len(word_levels[word]):
+                    following = combination[:word] + (index + 1,) + combination[word + 1:]
+                    if following not in seen:
+                        seen.add(following)
+                        heapq.heappush(heap, (-self._combination_total(word_levels, following),
+                                              following))
+        return ranked + _smallest(group, None if limit is None else limit - len(ranked))
+
+    @staticmethod
+    def _combination_total(word_levels, combination):
+        """Total score of a combination of score levels, one per word"""
+        total = 0.0
+        for levels, index in zip(word_levels, combination):
+            total += levels[index][0]
+        return total
+
+    def _combination_matches(self, word_levels, combination, limit):
+        """The first foods whose best score level for each word is the combination's"""
+        # Foods reaching a higher level of a word rank under that one
+        return self._first_matches(
+            [levels[index][1] for levels, index in zip(word_levels, combination)], limit,
+            excluded=[[token for _, tokens in levels[:index] for token in tokens]
+                      for levels, index in zip(word_levels, combination) if index])
+
+    def _rank_totals(self, positions, word_scores, limit):
+        """Order matches of several words by descending total score, then position"""
+        # Each food scores its best token per word; resolving levels from the
+        # top with set operations assigns every food once per word
+        totals = dict.fromkeys(positions, 0.0)
+        for token_scores in word_scores:
+            unscored = set(positions)
+            for score, tokens in self._score_levels(token_scores):
+                level = self._matching(tokens, unscored)
+                unscored -= level
+                for position in level:
+                    totals[position] += score
+                if not unscored:
+                    break
+        return [position for _, position in
+                _smallest(((-total, position) for position, total in totals.items()), limit)]
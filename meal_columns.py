@@ -0,0 +1,182 @@
+from array import array
+from datetime import date
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; fall back to plain Python loops
+    numpy = None
+
+from rollup import NUTRIENTS
+
+# Summed columns, in the order aggregations report them
+VALUE_COLUMNS = ('quantity',) + NUTRIENTS
+
+# Grouping keys accepted by MealColumns.group_by
+GROUP_KEYS = ('user_id', 'food_id', 'date')
+
+def _date_ordinal(value):
+    """Ordinal of an ISO date string, or 0 if it is not one"""
+    try:
+        return date.fromisoformat(value).toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+class _Codes:
+    """Dense integer codes for repeated string ids"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+class MealColumns:
+    """Append-only columnar copy of the meal log for analytics scans
+
+    Every meal is a row across parallel arrays: quantity and nutrients as
+    doubles, user and food ids as integer codes, and the date as an
+    ordinal. Deleting a meal clears its live flag; aggregations skip dead
+    rows. With NumPy the scans run as masked bincounts over the columns.
+    Running sums of the value columns answer all-time totals without a scan.
+    """
+
+    def __init__(self):
+        self._values = {column: array('d') for column in VALUE_COLUMNS}
+        self._keys = {key: array('q') for key in GROUP_KEYS}
+        self._live = array('b')
+        self._codes = {'user_id': _Codes(), 'food_id': _Codes()}
+        self._live_rows = 0
+        self._sums = dict.fromkeys(VALUE_COLUMNS, 0.0)
+
+    def __len__(self):
+        return self._live_rows
+
+    def add(self, meal):
+        """Append a meal, returning its row"""
+        row = len(self._live)
+        for column in VALUE_COLUMNS:
+            value = meal[column]
+            self._values[column].append(value)
+            self._sums[column] += value
+        self._keys['user_id'].append(self._codes['user_id'].encode(meal['user_id']))
+        self._keys['food_id'].append(self._codes['food_id'].encode(meal['food_id']))
+        self._keys['date'].append(_date_ordinal(meal['date']))
+        self._live.append(1)
+        self._live_rows += 1
+        return row
+
+    def extend(self, columns):
+        """Append many meals at once from whole columns
+
+        columns maps each value column to an array('d') and user_id,
+        food_id and date to lists of strings, all of the same length.
+        """
+        size = len(columns['date'])
+        for column in VALUE_COLUMNS:
+            self._values[column].extend(columns[column])
+            self._sums[column] += sum(columns[column])
+        for key in ('user_id', 'food_id'):
+            self._keys[key].extend(map(self._codes[key].encode, columns[key]))
+        ordinals = {meal_date: _date_ordinal(meal_date) for meal_date in set(columns['date'])}
+        self._keys['date'].extend(map(ordinals.__getitem__, columns['date']))
+        self._live.frombytes(b'\x01' * size)
+        self._live_rows += size
+
+    def remove(self, row):
+        """Mark a meal's row as deleted"""
+        if self._live[row]:
+            self._live[row] = 0
+            self._live_rows -= 1
+            for column in VALUE_COLUMNS:
+                self._sums[column] -= self._values[column][row]
+            if not self._live_rows:
+                # Drop the rounding error left over from the subtractions
+                self._sums = dict.fromkeys(VALUE_COLUMNS, 0.0)
+
+    def _decode(self, key, code):
+        if key == 'date':
+            return date.fromordinal(code).isoformat() if code else None
+        return self._codes[key].values[code]
+
+    def _rows(self, start_date, end_date):
+        """Live row numbers with start_date <= date <= end_date (pure Python scans)"""
+        dates = self._keys['date']
+        low = start_date.toordinal() if start_date is not None else None
+        high = end_date.toordinal() if end_date is not None else None
+        return [row for row, live in enumerate(self._live)
+                if live and (low is None or low <= dates[row])
+                and (high is None or dates[row] <= high)]
+
+    def _mask(self, rows, start_date, end_date):
+        """NumPy mask of live rows in the date range over the first rows rows"""
+        # Columns are copied out of the arrays so appends stay possible while
+        # a scan holds views of them
+        mask = numpy.frombuffer(self._live[:rows], dtype=numpy.int8).astype(bool)
+        if start_date is not None or end_date is not None:
+            dates = numpy.frombuffer(self._keys['date'][:rows], dtype=numpy.int64)
+            if start_date is not None:
+                mask &= dates >= start_date.toordinal()
+            if end_date is not None:
+                mask &= dates <= end_date.toordinal()
+        return mask
+
+    def totals(self, start_date=None, end_date=None):
+        """Meal count and summed columns of live meals in the date range"""
+        if start_date is None and end_date is None:
+            return {'meals': self._live_rows, **self._sums}
+        if numpy is None:
+            rows = self._rows(start_date, end_date)
+            result = {'meals': len(rows)}
+            for column in VALUE_COLUMNS:
+                values = self._values[column]
+                result[column] = sum(values[row] for row in rows)
+            return result
+        size = len(self._live)
+        mask = self._mask(size, start_date, end_date)
+        result = {'meals': int(mask.sum())}
+        for column in VALUE_COLUMNS:
+            values = numpy.frombuffer(self._values[column][:size], dtype=numpy.float64)
+            result[column] = float(values[mask].sum())
+        return result
+
+    def group_by(self, key, start_date=None, end_date=None):
+        """Meal count and summed columns per user_id, food_id or date
+
+        Returns {key value: {'meals': n, column: total, ...}} for the live
+        meals in the date range; dates are reported as ISO strings.
+        """
+        if key not in GROUP_KEYS:
+            raise ValueError(f'Unknown group key: {key}')
+        if numpy is None:
+            groups = {}
+            keys = self._keys[key]
+            for row in self._rows(start_date, end_date):
+                group = groups.get(keys[row])
+                if group is None:
+                    group = groups[keys[row]] = dict.fromkeys(('meals',) + VALUE_COLUMNS, 0)
+                group['meals'] += 1
+                for column in VALUE_COLUMNS:
+                    group[column] += self._values[column][row]
+            return {self._decode(key, code): group for code, group in groups.items()}
+
+        size = len(self._live)
+        mask = self._mask(size, start_date, end_date)
+        codes = numpy.frombuffer(self._keys[key][:size], dtype=numpy.int64)[mask]
+        # Dates are sparse ordinals, so group them through their unique values
+        groups, inverse = numpy.unique(codes, return_inverse=True)
+        counts = numpy.bincount(inverse, minlength=len(groups))
+        sums = {column: numpy.bincount(
+                    inverse,
+                    weights=numpy.frombuffer(self._values[column][:size], dtype=numpy.float64)[mask],
+                    minlength=len(groups)
+                ).tolist()
+                for column in VALUE_COLUMNS}
+        return {self._decode(key, code): {'meals': count,
+                                          **{column: sums[column][index]
+                                             for column in VALUE_COLUMNS}}
+                for index, (code, count) in enumerate(zip(groups.tolist(), counts.tolist()))}
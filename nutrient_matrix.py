@@ -0,0 +1,142 @@
+try:
+    import numpy
+except ImportError:  # NumPy is optional; fall back to plain Python sums
+    numpy = None
+
+from rollup import NUTRIENTS
+
+class NutrientMatrix:
+    """Per-serving nutrients of the food catalog as a foods x nutrients matrix
+
+    Each food id maps to a row, with the food's name kept alongside. Batch
+    totals for many (food_id, quantity) items come from one dot product of
+    per-row quantities with the matrix. Rows are only appended, so a
+    deleted food leaves a zeroed row behind.
+    """
+
+    # Initial row capacity; the array doubles when full
+    INITIAL_CAPACITY = 256
+
+    def __init__(self, foods=()):
+        self._rows = {}
+        self._names = []
+        self._size = 0
+        if numpy is not None:
+            self._values = numpy.zeros((self.INITIAL_CAPACITY, len(NUTRIENTS)))
+        else:
+            self._values = []
+        for food in foods:
+            self.set(food)
+
+    @classmethod
+    def over(cls, rows, names, values):
+        """Read-only matrix over existing catalog data, without copying it
+
+        rows maps food ids to row numbers, names holds each row's food name
+        and values each row's nutrients (a NumPy array when available).
+        """
+        matrix = cls.__new__(cls)
+        matrix._rows = rows
+        matrix._names = names
+        matrix._values = values
+        matrix._size = len(values)
+        return matrix
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, food_id):
+        return food_id in self._rows
+
+    def set(self, food):
+        """Add a food's row, or overwrite it after the food changed"""
+        row = self._rows.get(food['id'])
+        values = [food[nutrient] for nutrient in NUTRIENTS]
+        if row is None:
+            row = self._rows[food['id']] = self._size
+            self._size += 1
+            self._names.append(food['name'])
+            if numpy is None:
+                self._values.append(values)
+                return
+            if row == len(self._values):
+                self._values = numpy.concatenate([self._values, numpy.zeros_like(self._values)])
+        self._names[row] = food['name']
+        self._values[row] = values
+
+    def extend(self, foods):
+        """Add rows for many foods not in the matrix yet"""
+        start = self._size
+        for row, food in enumerate(foods, start):
+            self._rows[food['id']] = row
+            self._names.append(food['name'])
+        self._size += len(foods)
+        values = [[food[nutrient] for nutrient in NUTRIENTS] for food in foods]
+        if numpy is None:
+            self._values.extend(values)
+            return
+        capacity = len(self._values)
+        while capacity < self._size:
+            capacity *= 2
+        if capacity > len(self._values):
+            grown = numpy.zeros((capacity, len(NUTRIENTS)))
+            grown[:start] = self._values[:start]
+            self._values = grown
+        if values:
+            self._values[start:self._size] = values
+
+    def remove(self, food_id):
+        """Drop a food, zeroing its row"""
+        row = self._rows.pop(food_id, None)
+        if row is not None:
+            self._names[row] = None
+            self._values[row] = [0] * len(NUTRIENTS)
+
+    def _gather(self, items):
+        """Row indices and quantities for (food_id, quantity) items
+
+        Raises KeyError naming the first food id not in the catalog.
+        """
+        rows = self._rows
+        try:
+            indices = [rows[food_id] for food_id, _ in items]
+        except KeyError:
+            missing = next(food_id for food_id, _ in items if food_id not in rows)
+            raise KeyError(missing) from None
+        return indices, [quantity for _, quantity in items]
+
+    def totals(self, items):
+        """Summed nutrients of (food_id, quantity) items as a dict"""
+        indices, quantities = self._gather(list(items))
+        if numpy is None:
+            sums = [sum(quantity * self._values[row][column]
+                        for row, quantity in zip(indices, quantities))
+                    for column in range(len(NUTRIENTS))]
+        else:
+            # Only the items' rows are gathered, so the work grows with the
+            # items rather than the catalog
+            sums = (numpy.asarray(quantities, dtype=float) @
+                    self._values[numpy.array(indices, dtype=numpy.intp)]).tolist()
+        return dict(zip(NUTRIENTS, sums))
+
+    def facts(self, items):
+        """Nutrition facts of each (food_id, quantity) item, like api_nutrition_facts
+
+        Items whose food id is not in the catalog get None.
+        """
+        items = list(items)
+        found = [(self._rows.get(food_id), quantity) for food_id, quantity in items]
+        known = [(row, quantity) for row, quantity in found if row is not None]
+        indices = [row for row, _ in known]
+        quantities = [quantity for _, quantity in known]
+        if numpy is None:
+            scaled = [[quantity * value for value in self._values[row]]
+                      for row, quantity in known]
+        else:
+            scaled = (self._values[indices] *
+                      numpy.asarray(quantities, dtype=float)[:, None]).tolist()
+        scaled = iter(scaled)
+        return [None if row is None else
+                {'name': self._names[row], 'quantity': quantity,
+                 **dict(zip(NUTRIENTS, next(scaled)))}
+                for row, quantity in found]
@@ -1,50 +1,200 @@
-from flask import Blueprint, jsonify, request, current_app
+import math
+import sys
+from datetime import date, timedelta
+from flask import (Blueprint, Response, jsonify, request, current_app, session, url_for,
+                   stream_with_context)
+from werkzeug.http import is_resource_modified, quote_etag
 from auth import login_required
+from rollup import GRANULARITIES
 
 nutrition_bp = Blueprint('nutrition', __name__)
 
+def _page_args(default_limit):
+    """Parse limit/cursor query parameters, capping limit at API_MAX_PAGE_SIZE
+
+    Returns (limit, cursor, error_response); cursor is None for the first page.
+    """
+    max_limit = current_app.config['API_MAX_PAGE_SIZE']
+    try:
+        limit = int(request.args.get('limit', default_limit))
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor is not None else None
+    except ValueError:
+        return None, None, (jsonify({'error': 'Invalid limit or cursor'}), 400)
+    if limit < 1 or (cursor is not None and cursor < 0):
+        return None, None, (jsonify({'error': 'Invalid limit or cursor'}), 400)
+    return min(limit, max_limit), cursor, None
+
+def _paginated(items, next_cursor):
+    """JSON list response advertising the next page via X-Next-Cursor and Link"""
+    response = jsonify(items)
+    if next_cursor is not None:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+        response.headers['Link'] = f'<{url_for(request.endpoint, **args)}>; rel="next"'
+    return response
+
+def _conditional(etag, last_modified, build_response):
+    """Answer with 304 if the client's cached copy is current, else build the response
+
+    The response carries a weak ETag and Last-Modified so clients can revalidate.
+    An error response from build_response is returned as is, without them.
+    """
+    if is_resource_modified(request.environ, etag=quote_etag(etag, weak=True),
+                            last_modified=last_modified):
+        response = current_app.make_response(build_response())
+        if response.status_code != 200:
+            return response
+    else:
+        response = current_app.response_class(status=304)
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    return response
+
+def _ndjson_lines(items):
+    """Serialize items lazily as newline-delimited JSON"""
+    for item in items:
+        yield current_app.json.dumps(item) + '\n'
+
 @nutrition_bp.route('/api/foods')
 def api_foods():
-    """API endpoint to get all foods"""
+    """API endpoint to page through the food catalog (or stream it as NDJSON)"""
     data_store = current_app.config['DATA_STORE']
-    foods = data_store.get_all_foods()
-    return jsonify(foods)
+    version, last_modified = data_store.get_catalog_version()
+    etag = f'catalog-{version}'
+    output_format = request.args.get('format', 'json')
+    if output_format == 'ndjson':
+        return _conditional(etag, last_modified, lambda: Response(
+            stream_with_context(_ndjson_lines(data_store.iter_foods())),
+            mimetype='application/x-ndjson'
+        ))
+    if output_format != 'json':
+        return jsonify({'error': 'Unsupported format'}), 400
+    
+    limit, cursor, error = _page_args(current_app.config['API_PAGE_SIZE'])
+    if error:
+        return error
+    return _conditional(etag, last_modified,
+                        lambda: _paginated(*data_store.get_foods_page(limit, cursor)))
 
 @nutrition_bp.route('/api/search')
 def api_search():
     """API endpoint to search foods"""
     query = request.args.get('q', '')
+    limit, cursor, error = _page_args(current_app.config['SEARCH_RESULTS_LIMIT'])
+    if error:
+        return error
+    # Search results are ranked, so the cursor is the offset of the next result
+    offset = cursor or 0
     data_store = current_app.config['DATA_STORE']
-    foods = data_store.search_foods(query)
-    return jsonify(foods)
+    foods = data_store.search_foods(query, limit + 1, offset)
+    next_cursor = offset + limit if len(foods) > limit else None
+    return _paginated(foods[:limit], next_cursor)
 
 @nutrition_bp.route('/api/food/<food_id>')
 def api_food(food_id):
     """API endpoint to get a specific food"""
     data_store = current_app.config['DATA_STORE']
-    food = data_store.get_food(food_id)
-    if food:
-        return jsonify(food)
-    else:
+    revision = data_store.get_food_revision(food_id)
+    if revision is None:
         return jsonify({'error': 'Food not found'}), 404
+    number, last_modified = revision
+
+    def build_response():
+        # The food may have been deleted since its revision was read
+        food = data_store.get_food(food_id)
+        if food is None:
+            return jsonify({'error': 'Food not found'}), 404
+        return jsonify(food)
+    return _conditional(f'{food_id}-{number}', last_modified, build_response)
 
 @nutrition_bp.route('/api/nutrition_facts/<food_id>')
 def api_nutrition_facts(food_id):
     """API endpoint to get nutrition facts with quantity calculation"""
     quantity = float(request.args.get('quantity', 1))
     data_store = current_app.config['DATA_STORE']
-    food = data_store.get_food(food_id)
-    
-    if food:
-        nutrition_facts = {
-            'name': food['name'],
-            'quantity': quantity,
-            'calories': food['calories'] * quantity,
-            'protein': food['protein'] * quantity,
-            'carbs': food['carbs'] * quantity,
-            'fat': food['fat'] * quantity,
-            'fiber': food['fiber'] * quantity
-        }
-        return jsonify(nutrition_facts)
-    else:
+    nutrition_facts = data_store.calculate_nutrition_facts([(food_id, quantity)])[0]
+    if nutrition_facts is None:
         return jsonify({'error': 'Food not found'}), 404
+    return jsonify(nutrition_facts)
+
+@nutrition_bp.route('/api/nutrition_facts', methods=['POST'])
+def api_batch_nutrition_facts():
+    """API endpoint to get nutrition facts for many foods at once
+
+    Takes {"items": [{"food_id": ..., "quantity": ...}, ...]} and returns the
+    facts of each item plus their totals. Every item is validated up front;
+    any problems are reported together with the item indexes.
+    """
+    payload = request.get_json(silent=True)
+    items = payload.get('items') if isinstance(payload, dict) else None
+    if not isinstance(items, list):
+        return jsonify({'error': 'Expected a JSON object with an items list'}), 400
+    if len(items) > current_app.config['BATCH_MAX_ITEMS']:
+        return jsonify({'error': 'Too many items'}), 400
+    
+    errors = {}
+    pairs = []
+    for index, item in enumerate(items):
+        food_id = item.get('food_id') if isinstance(item, dict) else None
+        quantity = item.get('quantity', 1) if isinstance(item, dict) else None
+        if not isinstance(food_id, str):
+            errors[index] = 'food_id is required'
+        # JSON allows NaN, Infinity and integers too large for a float
+        elif (isinstance(quantity, bool) or not isinstance(quantity, (int, float))
+              or quantity < 0 or quantity > sys.float_info.max
+              or not math.isfinite(quantity)):
+            errors[index] = 'quantity must be a non-negative finite number'
+        # Invalid items still hold their place so indexes line up below
+        pairs.append((None, 0) if index in errors else (food_id, float(quantity)))
+    
+    data_store = current_app.config['DATA_STORE']
+    facts = data_store.calculate_nutrition_facts(pairs)
+    for index, item_facts in enumerate(facts):
+        if item_facts is None and index not in errors:
+            errors[index] = 'Food not found'
+    if errors:
+        return jsonify({'error': 'Invalid items', 'errors': [
+            {'index': index, 'error': errors[index]} for index in sorted(errors)
+        ]}), 400
+    
+    try:
+        totals = data_store.calculate_nutrition(pairs)
+    except KeyError as error:
+        # The food was deleted after its facts were read
+        return jsonify({'error': 'Invalid items', 'errors': [
+            {'index': index, 'error': 'Food not found'}
+            for index, (food_id, _) in enumerate(pairs) if food_id == error.args[0]
+        ]}), 400
+    for (food_id, _), item_facts in zip(pairs, facts):
+        item_facts['food_id'] = food_id
+    return jsonify({'items': facts, 'totals': totals})
+
+@nutrition_bp.route('/api/nutrition_summary')
+@login_required
+def api_nutrition_summary():
+    """API endpoint for the user's nutrient totals and averages over a date range
+
+    Defaults to the last 30 days; pass granularity=day|week|month to also
+    get a per-bucket series for charts.
+    """
+    try:
+        end = date.fromisoformat(request.args.get('end', date.today().isoformat()))
+        start = date.fromisoformat(request.args.get('start', (end - timedelta(days=29)).isoformat()))
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    if start > end:
+        return jsonify({'error': 'start must not be after end'}), 400
+    if (end - start).days >= current_app.config['SUMMARY_MAX_DAYS']:
+        return jsonify({'error': 'Date range too long'}), 400
+    granularity = request.args.get('granularity')
+    if granularity is not None and granularity not in GRANULARITIES:
+        return jsonify({'error': 'Unsupported granularity'}), 400
+    
+    data_store = current_app.config['DATA_STORE']
+    user_id = session['user_id']
+    summary = data_store.get_nutrition_summary(user_id, start, end)
+    if granularity is not None:
+        summary['series'] = data_store.get_nutrition_series(user_id, start, end, granularity)
+    return jsonify(summary)
@@ -0,0 +1,268 @@
+import logging
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Without POSIX locks nothing stops two processes sharing a log
+    fcntl = None
+
+# Record header: payload length and CRC-32 of the payload
+_HEADER = struct.Struct('<II')
+
+logger = logging.getLogger(__name__)
+
+def _read_records(log_file):
+    """Yield (end offset, seq, op, args) for each intact record in the file
+
+    Stops at the first short or corrupt record, which is where a crash
+    cut off the last write.
+    """
+    offset = 0
+    while True:
+        header = log_file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return
+        length, checksum = _HEADER.unpack(header)
+        payload = log_file.read(length)
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return
+        offset += _HEADER.size + length
+        seq, op, args = pickle.loads(payload)
+        yield offset, seq, op, args
+
+class OperationLog:
+    """Append-only log of store mutations with group commit
+
+    Each mutation is appended as a checksummed pickle of (seq, op, args),
+    where seq is a sequence number that only grows. Appends only buffer
+    the record; a background thread writes and fsyncs everything buffered
+    every sync_interval seconds, so many writes share one fsync. With a
+    sync_interval of 0 every append is written and synced before it
+    returns.
+
+    Call replay once before appending, to load the log and pick up its
+    last sequence number.
+
+    Only one process may write a log: the constructor locks PATH.lock and
+    raises RuntimeError if another process holds it. Forking hands the log
+    over to the child, as when a preloading server forks its worker; the
+    parent and any other children can then no longer append. Once that
+    child has exited, the next fork hands the log over again: the new
+    child starts from the parent's out-of-date copy, so it calls
+    catch_up, which must bring its state up to date (replaying the
+    records logged since) before it takes any writes. The background
+    thread is restarted in the child that takes over.
+    """
+
+    def __init__(self, path, sync_interval):
+        self.path = path
+        self.sync_interval = sync_interval
+        self._seq = 0
+        self._pending = []
+        # Guards the sequence number and the pending buffer
+        self._lock = threading.Lock()
+        # Serializes writes to the file with compaction
+        self._write_lock = threading.Lock()
+        self._file = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = False
+        self._owner = os.getpid()
+        self._handing_over = False
+        # Set in a process that handed the log over to a child, which takes
+        # it back for the next child once that one has exited
+        self._handed_over = False
+        # Set when the child being forked takes over from an exited one
+        self._stale = False
+        # Called in a child taking over from an exited one; see above
+        self.catch_up = None
+        self._lock_file = None
+        if not self._lock_path():
+            raise RuntimeError(f'Operation log {path} is in use by another process; '
+                               'only one process may write it')
+        if fcntl is not None:
+            os.register_at_fork(before=self._before_fork,
+                                after_in_parent=self._after_fork_in_parent,
+                                after_in_child=self._after_fork_in_child)
+
+    def get_seq(self):
+        """Sequence number of the last appended record"""
+        return self._seq
+
+    def replay(self, apply, after=0):
+        """Call apply(op, args) for each record after seq after, in order
+
+        A torn record at the end of the file is cut off. Returns the number
+        of records applied.
+        """
+        applied = 0
+        end = 0
+        try:
+            with open(self.path, 'rb') as log_file:
+                for end, seq, op, args in _read_records(log_file):
+                    self._seq = seq
+                    if seq > after:
+                        apply(op, args)
+                        applied += 1
+        except FileNotFoundError:
+            pass
+        self._seq = max(self._seq, after)
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, 'ab')
+        if self._file.tell() != end:
+            logger.warning('Truncating torn record at the end of %s', self.path)
+            self._file.truncate(end)
+        return applied
+
+    def start(self):
+        """Start the background thread committing buffered records"""
+        self._started = True
+        self._start_thread()
+
+    def _start_thread(self):
+        if self.sync_interval > 0:
+            self._thread = threading.Thread(target=self._run, name='oplog-writer', daemon=True)
+            self._thread.start()
+
+    def check_writable(self):
+        """Raise RuntimeError unless this process owns the log"""
+        if self._owner != os.getpid():
+            raise RuntimeError(f'Operation log {self.path} is written by another process')
+
+    def _lock_path(self):
+        """Take the lock on PATH.lock, returning False if another process holds it"""
+        lock_file = open(f'{self.path}.lock', 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._lock_file = lock_file
+        return True
+
+    def _before_fork(self):
+        self._handing_over = self._owner == os.getpid()
+        self._stale = False
+        if self._handing_over:
+            self.flush()
+        elif self._handed_over and self._lock_path():
+            # The child the log was handed to has exited (a recycled or
+            # crashed worker), so hand it to this one
+            self._handing_over = self._stale = True
+        # Hold the locks across the fork so the child gets them unlocked
+        self._write_lock.acquire()
+        self._lock.acquire()
+
+    def _after_fork_in_parent(self):
+        self._lock.release()
+        self._write_lock.release()
+        if self._handing_over:
+            self._owner = None
+            self._handed_over = True
+            self._stop.set()
+            # The child's copy of the descriptor keeps the lock held
+            self._lock_file.close()
+
+    def _after_fork_in_child(self):
+        self._lock.release()
+        self._write_lock.release()
+        self._handed_over = False
+        if self._handing_over:
+            self._owner = os.getpid()
+            self._stop = threading.Event()
+            self._thread = None
+            if self._stale:
+                try:
+                    self.catch_up()
+                except BaseException:
+                    # Better to refuse writes than to log over a stale state
+                    self._owner = None
+                    raise
+            if self._started:
+                self._start_thread()
+
+    def close(self):
+        """Stop the background thread and commit anything still buffered"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._write_lock:
+            self._file.close()
+        self._lock_file.close()
+        self._owner = None
+        self._handed_over = False
+
+    def append(self, op, args):
+        """Append a mutation, returning its sequence number"""
+        self.check_writable()
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            payload = pickle.dumps((seq, op, args), protocol=5)
+            self._pending.append(_HEADER.pack(len(payload), zlib.crc32(payload)))
+            self._pending.append(payload)
+        if self._thread is None:
+            self.flush()
+        return seq
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Writing operation log %s failed', self.path)
+
+    def flush(self):
+        """Write and fsync all buffered records"""
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if pending:
+                self._file.write(b''.join(pending))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def compact(self, seq):
+        """Drop records up to seq, once a snapshot covers them
+
+        The remaining records are copied to a new file that atomically
+        replaces the log; appends keep buffering meanwhile.
+        """
+        self.check_writable()
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, temp_path = tempfile.mkstemp(prefix='.oplog-', dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as new_file, open(self.path, 'rb') as log_file:
+                    start = None
+                    for end, record_seq, _, _ in _read_records(log_file):
+                        if record_seq > seq:
+                            break
+                        start = end
+                    log_file.seek(start or 0)
+                    while True:
+                        chunk = log_file.read(1 << 20)
+                        if not chunk:
+                            break
+                        new_file.write(chunk)
+                    new_file.write(b''.join(pending))
+                    new_file.flush()
+                    os.fsync(new_file.fileno())
+                os.replace(temp_path, self.path)
+            except BaseException:
+                os.unlink(temp_path)
+                with self._lock:
+                    self._pending[:0] = pending
+                raise
+            self._file.close()
+            self._file = open(self.path, 'ab')
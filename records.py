@@ -0,0 +1,115 @@
+import sys
+import time
+import uuid
+from collections.abc import Mapping
+from datetime import datetime
+
+def format_uuid(value):
+    """Canonical string form of a 128-bit UUID integer"""
+    digits = f'{value:032x}'
+    return f'{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}'
+
+def parse_uuid(text):
+    """128-bit integer of a UUID string, or None if it is not one"""
+    try:
+        return uuid.UUID(text).int
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+class Record(Mapping):
+    """Slotted record that reads like the dict records the store used to hold
+
+    Fields are attributes, but records also work as read-only mappings of
+    their FIELDS, so templates, dict(record) and record['name'] / .get()
+    callers keep working. Timestamps are kept as epoch seconds and exposed
+    as ISO strings through created_at.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+    @property
+    def created_at(self):
+        """Creation time as a local ISO timestamp"""
+        return datetime.fromtimestamp(self.created).isoformat()
+
+class User(Record):
+    """A user account; sid is the integer surrogate key the store assigns"""
+
+    __slots__ = ('id', 'sid', 'username', 'email', 'password_hash', 'is_admin', 'created')
+    FIELDS = ('id', 'username', 'email', 'password_hash', 'is_admin', 'created_at')
+
+    def __init__(self, id, username, email, password_hash, is_admin=False, created=None,
+                 sid=None):
+        self.id = id
+        self.sid = sid
+        self.username = username
+        self.email = email
+        self.password_hash = password_hash
+        self.is_admin = is_admin
+        self.created = time.time() if created is None else created
+
+class Food(Record):
+    """A catalog food with its nutrients per serving"""
+
+    __slots__ = ('id', 'name', 'calories', 'protein', 'carbs', 'fat', 'fiber', 'created')
+    FIELDS = ('id', 'name', 'calories', 'protein', 'carbs', 'fat', 'fiber', 'created_at')
+
+    def __init__(self, id, name, calories, protein, carbs, fat, fiber, created=None):
+        self.id = id
+        self.name = name
+        self.calories = calories
+        self.protein = protein
+        self.carbs = carbs
+        self.fat = fat
+        self.fiber = fiber
+        self.created = time.time() if created is None else created
+
+class Meal(Record):
+    """A logged meal with the nutrients of the quantity eaten
+
+    The external id is held as its 128-bit integer rather than a 36-character
+    string; sid is the integer surrogate key the store assigns.
+    """
+
+    __slots__ = ('uuid_int', 'sid', 'user_id', 'food_id', 'food_name', 'quantity', 'date',
+                 'calories', 'protein', 'carbs', 'fat', 'fiber', 'created')
+    FIELDS = ('id', 'user_id', 'food_id', 'food_name', 'quantity', 'date',
+              'calories', 'protein', 'carbs', 'fat', 'fiber', 'created_at')
+
+    def __init__(self, uuid_int, user_id, food_id, food_name, quantity, date,
+                 calories, protein, carbs, fat, fiber, created=None, sid=None):
+        self.uuid_int = uuid_int
+        self.sid = sid
+        # Users, foods and dates repeat across many meals; interning makes
+        # every meal share one copy of each string
+        self.user_id = sys.intern(user_id)
+        self.food_id = sys.intern(food_id)
+        self.food_name = sys.intern(food_name)
+        self.quantity = quantity
+        self.date = sys.intern(date)
+        self.calories = calories
+        self.protein = protein
+        self.carbs = carbs
+        self.fat = fat
+        self.fiber = fiber
+        self.created = time.time() if created is None else created
+
+    @property
+    def id(self):
+        """External id as a UUID string"""
+        return format_uuid(self.uuid_int)
@@ -0,0 +1,221 @@
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import date, timedelta
+from itertools import groupby
+
+# Nutrient fields carried by foods (per serving) and meals (per quantity eaten)
+NUTRIENTS = ('calories', 'protein', 'carbs', 'fat', 'fiber')
+
+# Bucket sizes accepted for nutrition series
+GRANULARITIES = ('day', 'week', 'month')
+
+def _next_month(day):
+    """First day of the month after day"""
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+def bucket_ranges(start, end, granularity):
+    """Split the inclusive date range into (bucket_start, bucket_end) pairs
+
+    Weeks run Monday to Sunday and months are calendar months; the first and
+    last buckets are clipped to the range.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'Unknown granularity: {granularity}')
+    ranges = []
+    bucket_start = start
+    while bucket_start <= end:
+        if granularity == 'day':
+            next_start = bucket_start + timedelta(days=1)
+        elif granularity == 'week':
+            next_start = bucket_start + timedelta(days=7 - bucket_start.weekday())
+        else:
+            next_start = _next_month(bucket_start)
+        ranges.append((bucket_start, min(next_start - timedelta(days=1), end)))
+        bucket_start = next_start
+    return ranges
+
+def summarize(start, end, totals, logged_days):
+    """Range summary with totals and per-logged-day averages"""
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'days': (end - start).days + 1,
+        'logged_days': logged_days,
+        'totals': totals,
+        'averages': {nutrient: (totals[nutrient] / logged_days if logged_days else 0)
+                     for nutrient in NUTRIENTS},
+    }
+
+def summarize_rows(day_rows, start, end):
+    """Range summary from per-date nutrient rows, one row per logged date"""
+    totals = dict.fromkeys(NUTRIENTS, 0)
+    for row in day_rows:
+        for nutrient in NUTRIENTS:
+            totals[nutrient] += row[nutrient]
+    return summarize(start, end, totals, len(day_rows))
+
+def series_from_days(day_rows, start, end, granularity):
+    """Fold per-date nutrient rows into day, week or month summaries
+
+    Used by stores that total meals per date in the database; rows carry
+    an ISO 'date' key and must be ordered by it.
+    """
+    dates = [row['date'] for row in day_rows]
+    series = []
+    for bucket_start, bucket_end in bucket_ranges(start, end, granularity):
+        low = bisect_left(dates, bucket_start.isoformat())
+        high = bisect_right(dates, bucket_end.isoformat())
+        series.append(summarize_rows(day_rows[low:high], bucket_start, bucket_end))
+    return series
+
+class _Bucket:
+    """Meal and logged-day counts plus nutrient totals for one period"""
+
+    __slots__ = ('meals', 'days', 'totals')
+
+    def __init__(self, meals=0, days=0, totals=None):
+        self.meals = meals
+        self.days = days
+        self.totals = dict.fromkeys(NUTRIENTS, 0) if totals is None else totals
+
+class NutritionRollup:
+    """Per-user nutrient totals kept in day, month and year buckets
+
+    Meals are folded into the buckets as they are added or removed, so a
+    date range is answered from at most ~60 day buckets at its ragged
+    ends plus the month and year buckets in between, however many meals
+    it covers.
+    """
+
+    def __init__(self):
+        # user_id -> (days, months, years); days are keyed by ISO date,
+        # months by 'YYYY-MM' and years by 'YYYY'
+        self._users = {}
+
+    def add(self, meal, sign=1):
+        """Fold a meal into its user's buckets (sign=-1 removes it)"""
+        self.add_totals(meal['user_id'], meal['date'], sign,
+                        [sign * meal[nutrient] for nutrient in NUTRIENTS])
+
+    def remove(self, meal):
+        """Take a meal back out of its user's buckets"""
+        self.add(meal, sign=-1)
+
+    def add_totals(self, user_id, meal_date, meals, values):
+        """Fold the summed nutrients (in NUTRIENTS order) of meals logged on one date
+
+        A negative meal count takes meals back out.
+        """
+        buckets = self._users.get(user_id)
+        if buckets is None:
+            buckets = self._users[user_id] = ({}, {}, {})
+        days, months, years = buckets
+
+        day = days.get(meal_date)
+        new_day = day is None
+        if new_day:
+            if meals < 0:
+                return
+            day = days[meal_date] = _Bucket()
+            day.days = 1
+        day.meals += meals
+        emptied_day = day.meals == 0
+        if emptied_day:
+            # Drop the day outright rather than keep float residue
+            del days[meal_date]
+            if not days:
+                del self._users[user_id]
+        else:
+            self._apply(day, values)
+
+        # Meal dates that are not ISO formatted only get a day bucket
+        if len(meal_date) != 10 or meal_date[4] != '-':
+            return
+        day_delta = 1 if new_day else -1 if emptied_day else 0
+        for key, index in ((meal_date[:7], months), (meal_date[:4], years)):
+            bucket = index.get(key)
+            if bucket is None:
+                bucket = index[key] = _Bucket()
+            bucket.meals += meals
+            bucket.days += day_delta
+            if bucket.meals == 0:
+                del index[key]
+            else:
+                self._apply(bucket, values)
+
+    def add_sorted(self, user_id, dates, columns):
+        """Fold in a user's meals given as their dates in order and nutrient columns
+
+        columns holds one list of values per nutrient, in NUTRIENTS order.
+        Each day, month and year bucket of a user with no buckets yet is
+        summed from its run of rows in one go, rather than meal by meal.
+        """
+        # Dates are sorted, so the counts come out in date order
+        counts = Counter(dates)
+        if user_id in self._users or not all(len(meal_date) == 10 and meal_date[4] == '-'
+                                             for meal_date in counts):
+            start = 0
+            for meal_date, count in counts.items():
+                self.add_totals(user_id, meal_date, count,
+                                [sum(column[start:start + count]) for column in columns])
+                start += count
+            return
+        day_runs = []
+        start = 0
+        for meal_date, count in counts.items():
+            day_runs.append((meal_date, start, start + count))
+            start += count
+        buckets = self._users[user_id] = ({}, {}, {})
+        for index, width in zip(buckets, (10, 7, 4)):
+            for key, runs in groupby(day_runs, key=lambda run: run[0][:width]):
+                runs = list(runs)
+                first, last = runs[0][1], runs[-1][2]
+                index[key] = _Bucket(last - first, len(runs),
+                                     dict(zip(NUTRIENTS, [sum(column[first:last])
+                                                          for column in columns])))
+
+    @staticmethod
+    def _apply(bucket, values):
+        totals = bucket.totals
+        for nutrient, value in zip(NUTRIENTS, values):
+            totals[nutrient] += value
+
+    def drop_user(self, user_id):
+        """Forget all of a user's buckets"""
+        self._users.pop(user_id, None)
+
+    def day_totals(self, user_id, meal_date):
+        """Nutrient totals for one date"""
+        buckets = self._users.get(user_id)
+        day = buckets[0].get(meal_date) if buckets else None
+        return dict(day.totals) if day else dict.fromkeys(NUTRIENTS, 0)
+
+    def summary(self, user_id, start, end):
+        """Totals and averages between two dates (inclusive) from the buckets"""
+        totals = dict.fromkeys(NUTRIENTS, 0)
+        logged_days = 0
+        buckets = self._users.get(user_id)
+        if buckets:
+            days, months, years = buckets
+            current = start
+            while current <= end:
+                if current.month == 1 and current.day == 1 and date(current.year, 12, 31) <= end:
+                    bucket = years.get(f'{current.year:04d}')
+                    next_start = date(current.year + 1, 1, 1)
+                elif current.day == 1 and _next_month(current) - timedelta(days=1) <= end:
+                    bucket = months.get(f'{current.year:04d}-{current.month:02d}')
+                    next_start = _next_month(current)
+                else:
+                    bucket = days.get(current.isoformat())
+                    next_start = current + timedelta(days=1)
+                if bucket is not None:
+                    logged_days += bucket.days
+                    for nutrient in NUTRIENTS:
+                        totals[nutrient] += bucket.totals[nutrient]
+                current = next_start
+        return summarize(start, end, totals, logged_days)
+
+    def series(self, user_id, start, end, granularity):
+        """Range summaries for each day, week or month bucket of the range"""
+        return [self.summary(user_id, bucket_start, bucket_end)
+                for bucket_start, bucket_end in bucket_ranges(start, end, granularity)]
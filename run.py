@@ -10,10 +10,11 @@ if __name__ == '__main__':
     # Set environment variables for local development
     os.environ.setdefault('SESSION_SECRET', 'your-secret-key-change-this-in-production')
     
-    # Run the application
+    # Run the application; the reloader runs the app in a second process,
+    # which cannot take over a snapshot's operation log from this one
     app.run(
         host='0.0.0.0',
         port=5001,
         debug=True,
-        use_reloader=True
+        use_reloader=not os.environ.get('SNAPSHOT_PATH')
     )
\ No newline at end of file
@@ -0,0 +1,84 @@
+import threading
+from contextlib import contextmanager
+
+class ReadWriteLock:
+    """Lock shared by any number of readers or held by a single writer
+
+    Waiting writers block new readers, so a steady stream of reads cannot
+    starve writes. Both sides are reentrant within a thread, and a thread
+    holding the write lock may also read; upgrading a read lock to a write
+    lock raises RuntimeError, since two upgrading readers would deadlock.
+
+    acquire_read and acquire_write return whether they took the lock, and
+    that flag is passed back to the matching release; nested acquisitions
+    return False and their releases do nothing.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._waiting_writers = 0
+        self._writer = None
+        self._local = threading.local()
+
+    def acquire_read(self):
+        if self._writer == threading.get_ident() or getattr(self._local, 'reading', False):
+            return False
+        with self._condition:
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        self._local.reading = True
+        return True
+
+    def reading(self):
+        """Whether the calling thread holds the lock shared"""
+        return getattr(self._local, 'reading', False)
+
+    def release_read(self, acquired):
+        if acquired:
+            self._local.reading = False
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            return False
+        if getattr(self._local, 'reading', False):
+            raise RuntimeError('Cannot upgrade a read lock to a write lock')
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+        return True
+
+    def release_write(self, acquired):
+        if acquired:
+            with self._condition:
+                self._writer = None
+                self._condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        """Hold the lock shared for the duration of the block"""
+        acquired = self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read(acquired)
+
+    @contextmanager
+    def write(self):
+        """Hold the lock exclusively for the duration of the block"""
+        acquired = self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write(acquired)
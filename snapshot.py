@@ -0,0 +1,90 @@
+import logging
+import mmap
+import os
+import pickle
+import tempfile
+import threading
+
+# Bumped whenever the snapshot layout changes
+SNAPSHOT_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+def write_snapshot(path, state):
+    """Atomically replace the file at path with a pickled snapshot of state
+
+    The snapshot is written to a temporary file in the same directory,
+    synced and renamed over path, so readers only ever see a whole file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as snapshot_file:
+            pickle.dump({'format': SNAPSHOT_FORMAT, **state}, snapshot_file, protocol=5)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def read_snapshot(path):
+    """Load a snapshot written by write_snapshot, or None if there is none
+
+    The file is memory-mapped and unpickled straight from the mapping.
+    """
+    try:
+        snapshot_file = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with snapshot_file, mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        state = pickle.loads(mapped)
+    if state.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f'Unsupported snapshot format in {path}: {state.get("format")}')
+    return state
+
+class SnapshotWriter:
+    """Background thread saving a store's snapshot every interval seconds it changed"""
+
+    def __init__(self, store, path, interval):
+        self.store = store
+        self.path = path
+        self.interval = interval
+        # Whatever the store holds now is either restored from path or the seed data
+        self._written_revision = store.get_revision()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='snapshot-writer', daemon=True)
+        self._started = False
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork_in_child)
+
+    def start(self):
+        self._started = True
+        self._thread.start()
+
+    def _after_fork_in_child(self):
+        # Threads do not survive a fork, so keep saving from a new one
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='snapshot-writer', daemon=True)
+        if self._started:
+            self._thread.start()
+
+    def stop(self):
+        """Stop the thread and save any changes made since the last snapshot"""
+        self._stop.set()
+        self._thread.join()
+        self.save()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.save()
+            except Exception:
+                logger.exception('Writing snapshot %s failed', self.path)
+
+    def save(self):
+        """Write a snapshot if the store changed since the last one"""
+        revision = self.store.get_revision()
+        if revision != self._written_revision:
+            self.store.save_snapshot(self.path)
+            self._written_revision = revision
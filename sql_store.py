@@ -0,0 +1,609 @@
+import uuid
+from datetime import datetime, timezone
+from sqlalchemy import (MetaData, Table, Column, Integer, BigInteger, String, Float,
+                        Boolean, Index, create_engine, select, insert, update, delete,
+                        case, func, text, literal)
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash, check_password_hash
+from data_store import (DEFAULT_FOODS, DEFAULT_ADMIN_USERNAME, DEFAULT_ADMIN_EMAIL,
+                        DEFAULT_ADMIN_PASSWORD, NUTRIENTS)
+from nutrient_matrix import NutrientMatrix
+from rollup import series_from_days, summarize_rows
+
+# Surrogate insertion-order key; SQLite only autoincrements INTEGER PRIMARY KEY
+SeqType = BigInteger().with_variant(Integer(), 'sqlite')
+
+metadata = MetaData()
+
+users = Table(
+    'users', metadata,
+    Column('seq', SeqType, primary_key=True, autoincrement=True),
+    Column('id', String(36), nullable=False, unique=True),
+    Column('username', String(255), nullable=False),
+    Column('email', String(255), nullable=False),
+    Column('password_hash', String(255), nullable=False),
+    Column('is_admin', Boolean, nullable=False, default=False),
+    Column('created_at', String(32), nullable=False),
+)
+Index('ix_users_username_lower', func.lower(users.c.username), unique=True)
+Index('ix_users_email_lower', func.lower(users.c.email), unique=True)
+
+foods = Table(
+    'foods', metadata,
+    Column('seq', SeqType, primary_key=True, autoincrement=True),
+    Column('id', String(36), nullable=False, unique=True),
+    Column('name', String(255), nullable=False),
+    Column('calories', Float, nullable=False),
+    Column('protein', Float, nullable=False),
+    Column('carbs', Float, nullable=False),
+    Column('fat', Float, nullable=False),
+    Column('fiber', Float, nullable=False),
+    Column('created_at', String(32), nullable=False),
+)
+Index('ix_foods_name_lower', func.lower(foods.c.name))
+
+# Single-row table holding the catalog version used for HTTP cache validation
+catalog_meta = Table(
+    'catalog_meta', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('version', BigInteger, nullable=False),
+    Column('modified', String(40), nullable=False),
+)
+
+food_revisions = Table(
+    'food_revisions', metadata,
+    Column('food_id', String(36), primary_key=True),
+    Column('revision', Integer, nullable=False),
+    Column('modified', String(40), nullable=False),
+)
+
+meals = Table(
+    'meals', metadata,
+    Column('seq', SeqType, primary_key=True, autoincrement=True),
+    Column('id', String(36), nullable=False, unique=True),
+    Column('user_id', String(36), nullable=False),
+    Column('food_id', String(36)),
+    Column('food_name', String(255)),
+    Column('quantity', Float, nullable=False),
+    Column('date', String(10), nullable=False),
+    Column('calories', Float, nullable=False),
+    Column('protein', Float, nullable=False),
+    Column('carbs', Float, nullable=False),
+    Column('fat', Float, nullable=False),
+    Column('fiber', Float, nullable=False),
+    Column('created_at', String(32), nullable=False),
+)
+Index('ix_meals_user_date', meals.c.user_id, meals.c.date)
+Index('ix_meals_date', meals.c.date)
+
+# Single-row tables of running counts behind get_counts and get_meal_stats,
+# updated in the same transaction as every write to users, foods and meals
+row_counts = Table(
+    'row_counts', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('users', BigInteger, nullable=False),
+    Column('foods', BigInteger, nullable=False),
+)
+
+meal_totals = Table(
+    'meal_totals', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('meals', BigInteger, nullable=False),
+    Column('users', BigInteger, nullable=False),
+    *(Column(nutrient, Float, nullable=False) for nutrient in NUTRIENTS),
+)
+
+# Public columns of each table (everything except the surrogate key)
+USER_COLUMNS = [c for c in users.c if c.name != 'seq']
+FOOD_COLUMNS = [c for c in foods.c if c.name != 'seq']
+MEAL_COLUMNS = [c for c in meals.c if c.name != 'seq']
+
+# Rows per statement on bulk insert paths
+BULK_INSERT_CHUNK = 1000
+
+# Ids per IN (...) list when fetching rows by id
+IN_LIST_CHUNK = 1000
+
+class SQLAlchemyDataStore:
+    """Relational data storage (PostgreSQL or SQLite) with the DataStore interface"""
+
+    def __init__(self, url, pool_size=5, max_overflow=10, pool_recycle=1800):
+        if url.startswith('postgres://'):
+            # Heroku/Replit style URLs use a scheme SQLAlchemy no longer accepts
+            url = 'postgresql://' + url[len('postgres://'):]
+        engine_options = {'pool_pre_ping': True}
+        if not url.startswith('sqlite'):
+            engine_options.update(pool_size=pool_size, max_overflow=max_overflow,
+                                  pool_recycle=pool_recycle)
+        self.engine = create_engine(url, **engine_options)
+        metadata.create_all(self.engine)
+
+        with self.engine.begin() as conn:
+            if self.engine.dialect.name == 'postgresql':
+                # Keep concurrently starting workers from seeding twice
+                conn.execute(text('LOCK TABLE foods, users, meals, catalog_meta, row_counts, '
+                                  'meal_totals IN EXCLUSIVE MODE'))
+            if conn.execute(select(catalog_meta.c.id)).first() is None:
+                # First start with catalog versioning: give existing foods a revision
+                now = datetime.now(timezone.utc).isoformat()
+                conn.execute(insert(catalog_meta).values(id=0, version=0, modified=now))
+                conn.execute(insert(food_revisions).from_select(
+                    ['food_id', 'revision', 'modified'],
+                    select(foods.c.id, literal(1), literal(now))
+                ))
+            if conn.execute(select(row_counts.c.id)).first() is None:
+                # First start with running counts: count the rows stored so far
+                conn.execute(insert(row_counts).values(
+                    id=0,
+                    users=select(func.count()).select_from(users).scalar_subquery(),
+                    foods=select(func.count()).select_from(foods).scalar_subquery()
+                ))
+            if conn.execute(select(meal_totals.c.id)).first() is None:
+                totals = conn.execute(select(
+                    func.count(), func.count(meals.c.user_id.distinct()),
+                    *(func.coalesce(func.sum(meals.c[nutrient]), 0) for nutrient in NUTRIENTS)
+                )).one()
+                conn.execute(insert(meal_totals).values(
+                    id=0, meals=totals[0], users=totals[1], **dict(zip(NUTRIENTS, totals[2:]))))
+            if conn.execute(select(row_counts.c.foods)).scalar() == 0:
+                self._initialize_food_database(conn)
+            if conn.execute(select(users.c.seq).where(users.c.is_admin)
+                            .limit(1)).first() is None:
+                self._create_admin_user(conn)
+
+    def close(self):
+        """Dispose of the connection pool"""
+        self.engine.dispose()
+
+    def _initialize_food_database(self, conn):
+        """Initialize the food database with common foods"""
+        created_at = datetime.now().isoformat()
+        rows = [dict(food, id=str(uuid.uuid4()), created_at=created_at)
+                for food in DEFAULT_FOODS]
+        conn.execute(insert(foods), rows)
+        self._touch_foods(conn, added=[row['id'] for row in rows])
+
+    @staticmethod
+    def _touch_foods(conn, added=(), updated=(), deleted=()):
+        """Record changed foods in the catalog version, their revisions and the food count"""
+        now = datetime.now(timezone.utc).isoformat()
+        conn.execute(update(catalog_meta).where(catalog_meta.c.id == 0).values(
+            version=catalog_meta.c.version + 1, modified=now))
+        if added or deleted:
+            conn.execute(update(row_counts).where(row_counts.c.id == 0).values(
+                foods=row_counts.c.foods + len(added) - len(deleted)))
+        for start in range(0, len(added), BULK_INSERT_CHUNK):
+            conn.execute(insert(food_revisions), [
+                {'food_id': food_id, 'revision': 1, 'modified': now}
+                for food_id in added[start:start + BULK_INSERT_CHUNK]
+            ])
+        for food_id in updated:
+            conn.execute(update(food_revisions).where(food_revisions.c.food_id == food_id)
+                         .values(revision=food_revisions.c.revision + 1, modified=now))
+        if deleted:
+            conn.execute(delete(food_revisions)
+                         .where(food_revisions.c.food_id.in_(list(deleted))))
+
+    def _create_admin_user(self, conn):
+        """Create default admin user"""
+        conn.execute(insert(users).values(
+            id=str(uuid.uuid4()),
+            username=DEFAULT_ADMIN_USERNAME,
+            email=DEFAULT_ADMIN_EMAIL,
+            password_hash=generate_password_hash(DEFAULT_ADMIN_PASSWORD),
+            is_admin=True,
+            created_at=datetime.now().isoformat()
+        ))
+        self._count_users(conn, 1)
+
+    @staticmethod
+    def _count_users(conn, added):
+        """Add to the running user count"""
+        conn.execute(update(row_counts).where(row_counts.c.id == 0).values(
+            users=row_counts.c.users + added))
+
+    @staticmethod
+    def _count_meals(conn, user_id, added, totals):
+        """Add meals of one user to the running meal totals, after inserting or deleting them
+
+        Updating the totals row first makes concurrent meal writes queue
+        behind this transaction, so the check for whether the user still
+        has meals sees theirs. Totals restart from zero with the last
+        meal, dropping rounding error.
+        """
+        remaining = meal_totals.c.meals + added
+        conn.execute(update(meal_totals).where(meal_totals.c.id == 0).values(
+            meals=remaining,
+            **{nutrient: case((remaining == 0, 0.0), else_=meal_totals.c[nutrient] + totals[nutrient])
+               for nutrient in NUTRIENTS}
+        ))
+        # The user's meals now number exactly those added if they had none,
+        # or none if the last ones were removed
+        window = select(meals.c.seq).where(meals.c.user_id == user_id).limit(abs(added) + 1)
+        left = conn.execute(select(func.count()).select_from(window.subquery())).scalar()
+        if left == max(added, 0):
+            conn.execute(update(meal_totals).where(meal_totals.c.id == 0).values(
+                users=meal_totals.c.users + (1 if added > 0 else -1)))
+
+    def _query(self, statement):
+        """Run a read statement and return the rows as dicts"""
+        with self.engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(statement)]
+
+    def _query_batches(self, table, statement, batch_size):
+        """Yield batches of rows of a select over table in seq order, fetched by keyset
+
+        statement must select table.c.seq, which is dropped from the rows.
+        """
+        after = None
+        while True:
+            page = statement.order_by(table.c.seq).limit(batch_size)
+            if after is not None:
+                page = page.where(table.c.seq > after)
+            rows = self._query(page)
+            if not rows:
+                return
+            after = rows[-1]['seq']
+            for row in rows:
+                del row['seq']
+            yield rows
+            if len(rows) < batch_size:
+                return
+
+    def _query_one(self, statement):
+        """Run a read statement and return the first row as a dict, or None"""
+        with self.engine.connect() as conn:
+            row = conn.execute(statement).first()
+        return dict(row._mapping) if row is not None else None
+
+    # User management methods
+    def create_user(self, username, email, password):
+        """Create a new user"""
+        user_id = str(uuid.uuid4())
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(users).values(
+                    id=user_id,
+                    username=username,
+                    email=email,
+                    password_hash=generate_password_hash(password),
+                    is_admin=False,
+                    created_at=datetime.now().isoformat()
+                ))
+                self._count_users(conn, 1)
+        except IntegrityError:
+            # Username or email already exists
+            return None
+        return user_id
+
+    def get_user(self, user_id):
+        """Get user by ID"""
+        return self._query_one(select(*USER_COLUMNS).where(users.c.id == user_id))
+
+    def get_user_by_username(self, username):
+        """Get user by username"""
+        return self._query_one(select(*USER_COLUMNS).where(
+            func.lower(users.c.username) == (username or '').lower()))
+
+    def get_all_users(self):
+        """Get all users"""
+        return self._query(select(*USER_COLUMNS).order_by(users.c.seq))
+
+    def iter_users(self, batch_size=1000):
+        """Iterate over all users in registration order, fetching them in keyset batches"""
+        for rows in self._query_batches(users, select(users.c.seq, *USER_COLUMNS), batch_size):
+            yield from rows
+
+    def get_recent_users(self, limit):
+        """Get the most recently registered users, newest first"""
+        return self._query(select(*USER_COLUMNS).order_by(users.c.seq.desc()).limit(limit))
+
+    def verify_password(self, user, password):
+        """Verify user password"""
+        return check_password_hash(user['password_hash'], password)
+
+    def delete_user(self, user_id):
+        """Delete a user"""
+        with self.engine.begin() as conn:
+            if conn.execute(delete(users).where(users.c.id == user_id)).rowcount == 0:
+                return False
+            self._count_users(conn, -1)
+            # Also delete user's meals
+            deleted = conn.execute(delete(meals).where(meals.c.user_id == user_id)
+                                   .returning(*(meals.c[nutrient] for nutrient in NUTRIENTS))).all()
+            if deleted:
+                self._count_meals(conn, user_id, -len(deleted), {
+                    nutrient: -sum(row[column] for row in deleted)
+                    for column, nutrient in enumerate(NUTRIENTS)})
+        return True
+
+    # Food management methods
+    def get_all_foods(self):
+        """Get all foods"""
+        return self._query(select(*FOOD_COLUMNS).order_by(foods.c.seq))
+
+    def iter_foods(self, batch_size=1000):
+        """Iterate over all foods in catalog order, fetching them in keyset batches"""
+        cursor = None
+        while True:
+            foods_page, cursor = self.get_foods_page(batch_size, cursor)
+            yield from foods_page
+            if cursor is None:
+                return
+
+    def get_food(self, food_id):
+        """Get food by ID"""
+        return self._query_one(select(*FOOD_COLUMNS).where(foods.c.id == food_id))
+
+    def get_catalog_version(self):
+        """Get the food catalog's (version, last modified UTC datetime)"""
+        meta = self._query_one(select(catalog_meta.c.version, catalog_meta.c.modified))
+        return meta['version'], datetime.fromisoformat(meta['modified'])
+
+    def get_food_revision(self, food_id):
+        """Get a food's (revision, last modified UTC datetime), or None if missing"""
+        row = self._query_one(select(food_revisions.c.revision, food_revisions.c.modified)
+                              .where(food_revisions.c.food_id == food_id))
+        if row is None:
+            return None
+        return row['revision'], datetime.fromisoformat(row['modified'])
+
+    def get_foods_page(self, limit, after=None):
+        """Get up to limit foods in catalog order following the cursor position
+
+        Returns the foods and the cursor for the next page (None on the last page).
+        """
+        statement = select(foods.c.seq, *FOOD_COLUMNS).order_by(foods.c.seq).limit(limit + 1)
+        if after is not None:
+            statement = statement.where(foods.c.seq > after)
+        rows = self._query(statement)
+        next_cursor = rows[limit - 1]['seq'] if len(rows) > limit else None
+        page = rows[:limit]
+        for food in page:
+            del food['seq']
+        return page, next_cursor
+
+    def search_foods(self, query, limit=None, offset=0):
+        """Search foods by name"""
+        return self._query(
+            select(*FOOD_COLUMNS)
+            .where(func.lower(foods.c.name).contains(query.lower(), autoescape=True))
+            .order_by(foods.c.seq)
+            .limit(limit)
+            .offset(offset)
+        )
+
+    def add_food(self, name, calories, protein, carbs, fat, fiber):
+        """Add a new food"""
+        return self.add_foods([{'name': name, 'calories': calories, 'protein': protein,
+                                'carbs': carbs, 'fat': fat, 'fiber': fiber}])[0]
+
+    def add_foods(self, foods_data):
+        """Add many foods with batched inserts, returning their ids in order"""
+        with self.engine.begin() as conn:
+            return self._insert_foods(conn, foods_data)
+
+    def import_foods(self, batches):
+        """Add foods from an iterable of lists of food dicts, returning how many were added
+
+        The whole import is one transaction, so it lands all at once.
+        """
+        added = 0
+        with self.engine.begin() as conn:
+            for batch in batches:
+                added += len(self._insert_foods(conn, batch))
+        return added
+
+    def _insert_foods(self, conn, foods_data):
+        """Insert food dicts inside a transaction, returning their new ids in order"""
+        created_at = datetime.now().isoformat()
+        rows = [{'id': str(uuid.uuid4()), 'name': food['name'],
+                 'calories': food['calories'], 'protein': food['protein'],
+                 'carbs': food['carbs'], 'fat': food['fat'], 'fiber': food['fiber'],
+                 'created_at': created_at}
+                for food in foods_data]
+        for start in range(0, len(rows), BULK_INSERT_CHUNK):
+            conn.execute(insert(foods), rows[start:start + BULK_INSERT_CHUNK])
+        self._touch_foods(conn, added=[row['id'] for row in rows])
+        return [row['id'] for row in rows]
+
+    def update_food(self, food_id, name, calories, protein, carbs, fat, fiber):
+        """Update a food"""
+        with self.engine.begin() as conn:
+            result = conn.execute(update(foods).where(foods.c.id == food_id).values(
+                name=name, calories=calories, protein=protein, carbs=carbs,
+                fat=fat, fiber=fiber
+            ))
+            if result.rowcount:
+                self._touch_foods(conn, updated=[food_id])
+        return result.rowcount > 0
+
+    def delete_food(self, food_id):
+        """Delete a food"""
+        with self.engine.begin() as conn:
+            result = conn.execute(delete(foods).where(foods.c.id == food_id))
+            if result.rowcount:
+                self._touch_foods(conn, deleted=[food_id])
+        return result.rowcount > 0
+
+    def calculate_nutrition(self, items):
+        """Total the nutrients of many (food_id, quantity) items
+
+        Raises KeyError for a food id not in the catalog.
+        """
+        items = list(items)
+        return self._nutrient_matrix(items).totals(items)
+
+    def calculate_nutrition_facts(self, items):
+        """Nutrition facts of each (food_id, quantity) item, None for unknown foods"""
+        items = list(items)
+        return self._nutrient_matrix(items).facts(items)
+
+    def _nutrient_matrix(self, items):
+        """Nutrient matrix of just the foods the (food_id, quantity) items refer to"""
+        food_ids = list({food_id for food_id, _ in items})
+        matrix = NutrientMatrix()
+        for start in range(0, len(food_ids), IN_LIST_CHUNK):
+            chunk = food_ids[start:start + IN_LIST_CHUNK]
+            matrix.extend(self._query(select(*FOOD_COLUMNS).where(foods.c.id.in_(chunk))))
+        return matrix
+
+    # Meal management methods
+    def add_meal(self, meal_data):
+        """Add a meal"""
+        meal_id = str(uuid.uuid4())
+        meal_data['id'] = meal_id
+        meal_data['created_at'] = datetime.now().isoformat()
+        with self.engine.begin() as conn:
+            conn.execute(insert(meals).values(
+                {column.name: meal_data.get(column.name) for column in MEAL_COLUMNS}
+            ))
+            self._count_meals(conn, meal_data['user_id'], 1,
+                              {nutrient: meal_data[nutrient] for nutrient in NUTRIENTS})
+        return meal_id
+
+    def get_user_meals(self, user_id):
+        """Get all meals for a user, most recent date first"""
+        return self._query(
+            select(*MEAL_COLUMNS).where(meals.c.user_id == user_id)
+            .order_by(meals.c.date.desc(), meals.c.seq.desc())
+        )
+
+    def get_recent_user_meals(self, user_id, limit):
+        """Get a user's latest meals, most recent date first"""
+        return self._query(
+            select(*MEAL_COLUMNS).where(meals.c.user_id == user_id)
+            .order_by(meals.c.date.desc(), meals.c.seq.desc())
+            .limit(max(limit, 0))
+        )
+
+    def get_user_meals_by_date(self, user_id, meal_date):
+        """Get meals for a user on a specific date"""
+        return self.get_user_meals_between(user_id, meal_date, meal_date)
+
+    def get_user_meals_between(self, user_id, start_date=None, end_date=None):
+        """Get a user's meals between two dates (inclusive), oldest first"""
+        statement = select(*MEAL_COLUMNS).where(meals.c.user_id == user_id)
+        if start_date is not None:
+            statement = statement.where(meals.c.date >= start_date)
+        if end_date is not None:
+            statement = statement.where(meals.c.date <= end_date)
+        return self._query(statement.order_by(meals.c.date, meals.c.seq))
+
+    def get_daily_totals(self, user_id, meal_date):
+        """Get a user's summed nutrients for one date"""
+        # Served by the (user_id, date) index, so cost tracks that day's meals
+        return self._query_one(
+            select(*(func.coalesce(func.sum(meals.c[nutrient]), 0).label(nutrient)
+                     for nutrient in NUTRIENTS))
+            .where(meals.c.user_id == user_id, meals.c.date == meal_date)
+        )
+
+    def get_nutrition_summary(self, user_id, start_date, end_date):
+        """Get a user's nutrient totals and daily averages between two dates (inclusive)"""
+        return summarize_rows(self._totals_by_date(user_id, start_date, end_date),
+                              start_date, end_date)
+
+    def get_nutrition_series(self, user_id, start_date, end_date, granularity):
+        """Get nutrition summaries per day, week or month between two dates"""
+        return series_from_days(self._totals_by_date(user_id, start_date, end_date),
+                                start_date, end_date, granularity)
+
+    def _totals_by_date(self, user_id, start_date, end_date):
+        """A user's nutrient sums per logged date in the range, ordered by date"""
+        # One row per logged day via the (user_id, date) index
+        return self._query(
+            select(meals.c.date, *(func.sum(meals.c[nutrient]).label(nutrient)
+                                   for nutrient in NUTRIENTS))
+            .where(meals.c.user_id == user_id,
+                   meals.c.date >= start_date.isoformat(),
+                   meals.c.date <= end_date.isoformat())
+            .group_by(meals.c.date)
+            .order_by(meals.c.date)
+        )
+
+    def delete_meal(self, meal_id, user_id=None):
+        """Delete a meal"""
+        statement = delete(meals).where(meals.c.id == meal_id)
+        if user_id is not None:
+            statement = statement.where(meals.c.user_id == user_id)
+        statement = statement.returning(meals.c.user_id, *(meals.c[nutrient] for nutrient in NUTRIENTS))
+        with self.engine.begin() as conn:
+            meal = conn.execute(statement).first()
+            if meal is None:
+                return False
+            self._count_meals(conn, meal.user_id, -1,
+                              {nutrient: -meal._mapping[nutrient] for nutrient in NUTRIENTS})
+        return True
+
+    def get_all_meals(self):
+        """Get all meals (admin function)"""
+        return self._query(select(*MEAL_COLUMNS).order_by(meals.c.seq))
+
+    def get_recent_meals(self, limit):
+        """Get the most recently logged meals, newest first"""
+        return self._query(select(*MEAL_COLUMNS).order_by(meals.c.seq.desc()).limit(limit))
+
+    def iter_meals(self, start_date=None, end_date=None, user_id=None, batch_size=1000):
+        """Iterate over meals in the order they were logged, fetching them in keyset batches
+
+        Optionally only one user's meals, or those between two dates (inclusive).
+        """
+        statement = select(meals.c.seq, *MEAL_COLUMNS)
+        if user_id is not None:
+            statement = statement.where(meals.c.user_id == user_id)
+        if start_date is not None:
+            statement = statement.where(meals.c.date >= start_date)
+        if end_date is not None:
+            statement = statement.where(meals.c.date <= end_date)
+        for rows in self._query_batches(meals, statement, batch_size):
+            yield from rows
+
+    # Meal analytics (admin functions)
+    def get_counts(self):
+        """Get the number of users, foods and meals"""
+        # Counter rows kept current by every write, rather than COUNT(*) over each table
+        return self._query_one(
+            select(row_counts.c.users, row_counts.c.foods, meal_totals.c.meals)
+            .select_from(row_counts.join(meal_totals, meal_totals.c.id == row_counts.c.id))
+        )
+
+    def get_meal_stats(self):
+        """Get the meal count, users with meals and nutrient totals across all meals"""
+        row = self._query_one(select(meal_totals.c.meals, meal_totals.c.users,
+                                     *(meal_totals.c[nutrient] for nutrient in NUTRIENTS)))
+        return {
+            'meals': row['meals'],
+            'users': row['users'],
+            'totals': {nutrient: row[nutrient] for nutrient in NUTRIENTS}
+        }
+
+    def get_meal_trend(self, start_date, end_date):
+        """Get meal counts and nutrient totals per logged date across all users"""
+        return self._query(
+            select(meals.c.date, func.count().label('meals'),
+                   *(func.sum(meals.c[nutrient]).label(nutrient) for nutrient in NUTRIENTS))
+            .where(meals.c.date >= start_date.isoformat(), meals.c.date <= end_date.isoformat())
+            .group_by(meals.c.date)
+            .order_by(meals.c.date)
+        )
+
+    def get_popular_foods(self, limit):
+        """Get the most logged foods with their meal counts and total quantity"""
+        meal_count = func.count().label('meals')
+        return self._query(
+            select(meals.c.food_id, meal_count, func.sum(meals.c.quantity).label('quantity'))
+            .group_by(meals.c.food_id)
+            .order_by(meal_count.desc(), meals.c.food_id)
+            .limit(limit)
+        )
+
+    def get_most_active_users(self, limit):
+        """Get the users with the most meals, with their meal counts and calories"""
+        meal_count = func.count().label('meals')
+        return self._query(
+            select(meals.c.user_id, meal_count, func.sum(meals.c.calories).label('calories'))
+            .group_by(meals.c.user_id)
+            .order_by(meal_count.desc(), meals.c.user_id)
+            .limit(limit)
+        )
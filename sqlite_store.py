@@ -0,0 +1,619 @@
+import json
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from werkzeug.security import generate_password_hash, check_password_hash
+from data_store import (DEFAULT_FOODS, DEFAULT_ADMIN_USERNAME, DEFAULT_ADMIN_EMAIL,
+                        DEFAULT_ADMIN_PASSWORD, NUTRIENTS)
+from nutrient_matrix import NutrientMatrix
+from rollup import series_from_days, summarize_rows
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    email TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS foods (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    calories REAL NOT NULL,
+    protein REAL NOT NULL,
+    carbs REAL NOT NULL,
+    fat REAL NOT NULL,
+    fiber REAL NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_foods_name ON foods (name COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL,
+    modified TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS food_revisions (
+    food_id TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL,
+    modified TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meals (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    food_id TEXT,
+    food_name TEXT,
+    quantity REAL NOT NULL,
+    date TEXT NOT NULL,
+    calories REAL NOT NULL,
+    protein REAL NOT NULL,
+    carbs REAL NOT NULL,
+    fat REAL NOT NULL,
+    fiber REAL NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_meals_user_date ON meals (user_id, date);
+CREATE INDEX IF NOT EXISTS idx_meals_date ON meals (date);
+
+-- Running totals behind get_meal_stats, kept up to date by the triggers
+-- below so the admin dashboard does not aggregate the whole meals table
+CREATE TABLE IF NOT EXISTS meal_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    meals INTEGER NOT NULL,
+    users INTEGER NOT NULL,
+    calories REAL NOT NULL,
+    protein REAL NOT NULL,
+    carbs REAL NOT NULL,
+    fat REAL NOT NULL,
+    fiber REAL NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS meal_totals_insert AFTER INSERT ON meals BEGIN
+    UPDATE meal_totals SET
+        meals = meals + 1,
+        users = users + NOT EXISTS (SELECT 1 FROM meals
+                                    WHERE user_id = NEW.user_id AND rowid != NEW.rowid),
+        calories = calories + NEW.calories,
+        protein = protein + NEW.protein,
+        carbs = carbs + NEW.carbs,
+        fat = fat + NEW.fat,
+        fiber = fiber + NEW.fiber
+    WHERE id = 0;
+END;
+-- Totals restart from zero with the last meal, dropping rounding error
+CREATE TRIGGER IF NOT EXISTS meal_totals_delete AFTER DELETE ON meals BEGIN
+    UPDATE meal_totals SET
+        meals = meals - 1,
+        users = users - NOT EXISTS (SELECT 1 FROM meals WHERE user_id = OLD.user_id),
+        calories = CASE WHEN meals = 1 THEN 0 ELSE calories - OLD.calories END,
+        protein = CASE WHEN meals = 1 THEN 0 ELSE protein - OLD.protein END,
+        carbs = CASE WHEN meals = 1 THEN 0 ELSE carbs - OLD.carbs END,
+        fat = CASE WHEN meals = 1 THEN 0 ELSE fat - OLD.fat END,
+        fiber = CASE WHEN meals = 1 THEN 0 ELSE fiber - OLD.fiber END
+    WHERE id = 0;
+END;
+
+-- Row counts of users and foods behind get_counts, kept the same way
+CREATE TABLE IF NOT EXISTS row_counts (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    users INTEGER NOT NULL,
+    foods INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS row_counts_user_insert AFTER INSERT ON users BEGIN
+    UPDATE row_counts SET users = users + 1 WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS row_counts_user_delete AFTER DELETE ON users BEGIN
+    UPDATE row_counts SET users = users - 1 WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS row_counts_food_insert AFTER INSERT ON foods BEGIN
+    UPDATE row_counts SET foods = foods + 1 WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS row_counts_food_delete AFTER DELETE ON foods BEGIN
+    UPDATE row_counts SET foods = foods - 1 WHERE id = 0;
+END;
+"""
+
+USER_COLUMNS = 'id, username, email, password_hash, is_admin, created_at'
+FOOD_COLUMNS = 'id, name, calories, protein, carbs, fat, fiber, created_at'
+MEAL_COLUMNS = ('id, user_id, food_id, food_name, quantity, date, '
+                'calories, protein, carbs, fat, fiber, created_at')
+
+# Statements are kept as constants so sqlite3's per-connection statement
+# cache can reuse the prepared form across requests
+INSERT_USER = f'INSERT INTO users ({USER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)'
+SELECT_USER = f'SELECT {USER_COLUMNS} FROM users WHERE id = ?'
+SELECT_USER_BY_USERNAME = f'SELECT {USER_COLUMNS} FROM users WHERE username = ? COLLATE NOCASE'
+SELECT_ADMIN = 'SELECT 1 FROM users WHERE is_admin = 1 LIMIT 1'
+SELECT_USERS = f'SELECT {USER_COLUMNS} FROM users ORDER BY rowid'
+SELECT_RECENT_USERS = f'SELECT {USER_COLUMNS} FROM users ORDER BY rowid DESC LIMIT ?'
+SELECT_USERS_AFTER = (f'SELECT rowid AS seq, {USER_COLUMNS} FROM users WHERE rowid > ? '
+                      'ORDER BY rowid LIMIT ?')
+DELETE_USER = 'DELETE FROM users WHERE id = ?'
+
+INSERT_FOOD = f'INSERT INTO foods ({FOOD_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+SELECT_FOOD = f'SELECT {FOOD_COLUMNS} FROM foods WHERE id = ?'
+SELECT_FOODS = f'SELECT {FOOD_COLUMNS} FROM foods ORDER BY rowid'
+# Takes the ids as one JSON array, so the statement stays the same for any number of them
+SELECT_FOODS_BY_IDS = f'SELECT {FOOD_COLUMNS} FROM foods WHERE id IN (SELECT value FROM json_each(?))'
+SEARCH_FOODS = (f"SELECT {FOOD_COLUMNS} FROM foods WHERE name LIKE ? ESCAPE '\\' "
+                'ORDER BY rowid LIMIT ? OFFSET ?')
+SELECT_FOODS_PAGE = (f'SELECT rowid AS seq, {FOOD_COLUMNS} FROM foods WHERE rowid > ? '
+                     'ORDER BY rowid LIMIT ?')
+UPDATE_FOOD = ('UPDATE foods SET name = ?, calories = ?, protein = ?, carbs = ?, '
+               'fat = ?, fiber = ? WHERE id = ?')
+DELETE_FOOD = 'DELETE FROM foods WHERE id = ?'
+
+INSERT_CATALOG_META = 'INSERT OR IGNORE INTO catalog_meta (id, version, modified) VALUES (0, 0, ?)'
+SELECT_CATALOG_VERSION = 'SELECT version, modified FROM catalog_meta WHERE id = 0'
+BUMP_CATALOG_VERSION = 'UPDATE catalog_meta SET version = version + 1, modified = ? WHERE id = 0'
+BACKFILL_FOOD_REVISIONS = ('INSERT OR IGNORE INTO food_revisions (food_id, revision, modified) '
+                           'SELECT id, 1, ? FROM foods')
+UPSERT_FOOD_REVISION = ('INSERT INTO food_revisions (food_id, revision, modified) '
+                        'VALUES (?, 1, ?) ON CONFLICT (food_id) DO UPDATE SET '
+                        'revision = revision + 1, modified = excluded.modified')
+SELECT_FOOD_REVISION = 'SELECT revision, modified FROM food_revisions WHERE food_id = ?'
+DELETE_FOOD_REVISION = 'DELETE FROM food_revisions WHERE food_id = ?'
+
+INSERT_MEAL = f'INSERT INTO meals ({MEAL_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+SELECT_MEALS = f'SELECT {MEAL_COLUMNS} FROM meals ORDER BY rowid'
+SELECT_RECENT_MEALS = f'SELECT {MEAL_COLUMNS} FROM meals ORDER BY rowid DESC LIMIT ?'
+SELECT_MEALS_AFTER = (f'SELECT rowid AS seq, {MEAL_COLUMNS} FROM meals WHERE rowid > ? '
+                      'AND date >= ? AND date <= ? ORDER BY rowid LIMIT ?')
+SELECT_USER_MEALS_AFTER = (f'SELECT rowid AS seq, {MEAL_COLUMNS} FROM meals WHERE rowid > ? '
+                           'AND user_id = ? AND date >= ? AND date <= ? ORDER BY rowid LIMIT ?')
+SELECT_USER_MEALS = (f'SELECT {MEAL_COLUMNS} FROM meals WHERE user_id = ? '
+                     'ORDER BY date DESC, rowid DESC')
+SELECT_RECENT_USER_MEALS = SELECT_USER_MEALS + ' LIMIT ?'
+SELECT_USER_MEALS_BETWEEN = (f'SELECT {MEAL_COLUMNS} FROM meals WHERE user_id = ? '
+                             'AND date >= ? AND date <= ? ORDER BY date, rowid')
+SELECT_DAILY_TOTALS = ('SELECT ' + ', '.join(f'COALESCE(SUM({n}), 0) AS {n}' for n in NUTRIENTS) +
+                       ' FROM meals WHERE user_id = ? AND date = ?')
+SELECT_TOTALS_BY_DATE = ('SELECT date, ' + ', '.join(f'SUM({n}) AS {n}' for n in NUTRIENTS) +
+                         ' FROM meals WHERE user_id = ? AND date >= ? AND date <= ?'
+                         ' GROUP BY date ORDER BY date')
+SELECT_COUNTS = ('SELECT row_counts.users, row_counts.foods, meal_totals.meals '
+                 'FROM row_counts, meal_totals WHERE row_counts.id = 0 AND meal_totals.id = 0')
+INSERT_ROW_COUNTS = 'INSERT OR IGNORE INTO row_counts (id, users, foods) VALUES (0, 0, 0)'
+BACKFILL_ROW_COUNTS = ('UPDATE row_counts SET (users, foods) = '
+                       '((SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM foods)) WHERE id = 0')
+INSERT_MEAL_TOTALS = ('INSERT OR IGNORE INTO meal_totals (id, meals, users, ' + ', '.join(NUTRIENTS) +
+                      ') VALUES (0, 0, 0' + ', 0' * len(NUTRIENTS) + ')')
+BACKFILL_MEAL_TOTALS = ('UPDATE meal_totals SET (meals, users, ' + ', '.join(NUTRIENTS) + ') = '
+                        '(SELECT COUNT(*), COUNT(DISTINCT user_id), ' +
+                        ', '.join(f'COALESCE(SUM({n}), 0)' for n in NUTRIENTS) +
+                        ' FROM meals) WHERE id = 0')
+SELECT_MEAL_STATS = 'SELECT meals, users, ' + ', '.join(NUTRIENTS) + ' FROM meal_totals WHERE id = 0'
+SELECT_MEAL_TREND = ('SELECT date, COUNT(*) AS meals, ' + ', '.join(f'SUM({n}) AS {n}' for n in NUTRIENTS) +
+                     ' FROM meals WHERE date >= ? AND date <= ? GROUP BY date ORDER BY date')
+SELECT_POPULAR_FOODS = ('SELECT food_id, COUNT(*) AS meals, SUM(quantity) AS quantity FROM meals '
+                        'GROUP BY food_id ORDER BY meals DESC, food_id LIMIT ?')
+SELECT_MOST_ACTIVE_USERS = ('SELECT user_id, COUNT(*) AS meals, SUM(calories) AS calories FROM meals '
+                            'GROUP BY user_id ORDER BY meals DESC, user_id LIMIT ?')
+DELETE_MEAL = 'DELETE FROM meals WHERE id = ?'
+DELETE_USER_MEAL = 'DELETE FROM meals WHERE id = ? AND user_id = ?'
+DELETE_USER_MEALS = 'DELETE FROM meals WHERE user_id = ?'
+
+# Bounds used for open-ended date ranges; ISO dates sort between them
+MIN_DATE = ''
+MAX_DATE = '\uffff'
+
+class SQLiteDataStore:
+    """SQLite-backed data storage with the same interface as DataStore"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        self._connect().executescript(SCHEMA)
+
+        # Seed an empty database; BEGIN IMMEDIATE keeps concurrently
+        # starting workers from seeding twice
+        with self._transaction() as conn:
+            now = datetime.now(timezone.utc).isoformat()
+            if conn.execute(INSERT_CATALOG_META, (now,)).rowcount:
+                # First start with catalog versioning: give existing foods a revision
+                conn.execute(BACKFILL_FOOD_REVISIONS, (now,))
+            if conn.execute(INSERT_MEAL_TOTALS).rowcount:
+                # First start with running meal totals: count the meals logged so far
+                conn.execute(BACKFILL_MEAL_TOTALS)
+            if conn.execute(INSERT_ROW_COUNTS).rowcount:
+                conn.execute(BACKFILL_ROW_COUNTS)
+            if conn.execute(SELECT_COUNTS).fetchone()['foods'] == 0:
+                self._initialize_food_database(conn)
+            if conn.execute(SELECT_ADMIN).fetchone() is None:
+                self._create_admin_user(conn)
+
+    def _connect(self):
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None,
+                                   check_same_thread=False, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Run a block inside a write transaction on this thread's connection"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _initialize_food_database(self, conn):
+        """Initialize the food database with common foods"""
+        created_at = datetime.now().isoformat()
+        rows = [(str(uuid.uuid4()), food['name'], food['calories'], food['protein'],
+                 food['carbs'], food['fat'], food['fiber'], created_at)
+                for food in DEFAULT_FOODS]
+        conn.executemany(INSERT_FOOD, rows)
+        self._touch_foods(conn, [row[0] for row in rows])
+
+    @staticmethod
+    def _touch_foods(conn, food_ids, deleted=False):
+        """Record changed foods in the catalog version and their revisions"""
+        now = datetime.now(timezone.utc).isoformat()
+        conn.execute(BUMP_CATALOG_VERSION, (now,))
+        if deleted:
+            conn.executemany(DELETE_FOOD_REVISION, [(food_id,) for food_id in food_ids])
+        else:
+            conn.executemany(UPSERT_FOOD_REVISION, [(food_id, now) for food_id in food_ids])
+
+    def _create_admin_user(self, conn):
+        """Create default admin user"""
+        conn.execute(INSERT_USER, (
+            str(uuid.uuid4()), DEFAULT_ADMIN_USERNAME, DEFAULT_ADMIN_EMAIL,
+            generate_password_hash(DEFAULT_ADMIN_PASSWORD), 1,
+            datetime.now().isoformat()
+        ))
+
+    @staticmethod
+    def _user(row):
+        """Convert a users row into the dict shape DataStore returns"""
+        if row is None:
+            return None
+        user = dict(row)
+        user['is_admin'] = bool(user['is_admin'])
+        return user
+
+    def _query(self, sql, params=()):
+        """Run a read query and return the rows as dicts"""
+        return [dict(row) for row in self._connect().execute(sql, params)]
+
+    def _query_batches(self, sql, params, batch_size):
+        """Yield batches of rows of a keyset query in rowid order
+
+        sql selects rowid AS seq and takes the last seq already seen, then
+        params, then the batch size; seq is dropped from the rows.
+        """
+        after = 0
+        while True:
+            rows = self._query(sql, (after, *params, batch_size))
+            if not rows:
+                return
+            after = rows[-1]['seq']
+            for row in rows:
+                del row['seq']
+            yield rows
+            if len(rows) < batch_size:
+                return
+
+    def _query_one(self, sql, params=()):
+        """Run a read query and return the first row as a dict, or None"""
+        row = self._connect().execute(sql, params).fetchone()
+        return dict(row) if row is not None else None
+
+    # User management methods
+    def create_user(self, username, email, password):
+        """Create a new user"""
+        user_id = str(uuid.uuid4())
+        try:
+            with self._transaction() as conn:
+                conn.execute(INSERT_USER, (
+                    user_id, username, email, generate_password_hash(password), 0,
+                    datetime.now().isoformat()
+                ))
+        except sqlite3.IntegrityError:
+            # Username or email already exists
+            return None
+        return user_id
+
+    def get_user(self, user_id):
+        """Get user by ID"""
+        return self._user(self._connect().execute(SELECT_USER, (user_id,)).fetchone())
+
+    def get_user_by_username(self, username):
+        """Get user by username"""
+        row = self._connect().execute(SELECT_USER_BY_USERNAME, (username,)).fetchone()
+        return self._user(row)
+
+    def get_all_users(self):
+        """Get all users"""
+        return [self._user(row) for row in self._connect().execute(SELECT_USERS)]
+
+    def iter_users(self, batch_size=1000):
+        """Iterate over all users in registration order, fetching them in keyset batches"""
+        for rows in self._query_batches(SELECT_USERS_AFTER, (), batch_size):
+            yield from map(self._user, rows)
+
+    def get_recent_users(self, limit):
+        """Get the most recently registered users, newest first"""
+        return [self._user(row) for row in self._connect().execute(SELECT_RECENT_USERS, (limit,))]
+
+    def verify_password(self, user, password):
+        """Verify user password"""
+        return check_password_hash(user['password_hash'], password)
+
+    def delete_user(self, user_id):
+        """Delete a user"""
+        with self._transaction() as conn:
+            if conn.execute(DELETE_USER, (user_id,)).rowcount == 0:
+                return False
+            # Also delete user's meals
+            conn.execute(DELETE_USER_MEALS, (user_id,))
+        return True
+
+    # Food management methods
+    def get_all_foods(self):
+        """Get all foods"""
+        return self._query(SELECT_FOODS)
+
+    def iter_foods(self, batch_size=1000):
+        """Iterate over all foods in catalog order, fetching them in keyset batches"""
+        cursor = None
+        while True:
+            foods_page, cursor = self.get_foods_page(batch_size, cursor)
+            yield from foods_page
+            if cursor is None:
+                return
+
+    def get_food(self, food_id):
+        """Get food by ID"""
+        return self._query_one(SELECT_FOOD, (food_id,))
+
+    def get_catalog_version(self):
+        """Get the food catalog's (version, last modified UTC datetime)"""
+        version, modified = self._connect().execute(SELECT_CATALOG_VERSION).fetchone()
+        return version, datetime.fromisoformat(modified)
+
+    def get_food_revision(self, food_id):
+        """Get a food's (revision, last modified UTC datetime), or None if missing"""
+        row = self._connect().execute(SELECT_FOOD_REVISION, (food_id,)).fetchone()
+        return (row[0], datetime.fromisoformat(row[1])) if row is not None else None
+
+    def get_foods_page(self, limit, after=None):
+        """Get up to limit foods in catalog order following the cursor position
+
+        Returns the foods and the cursor for the next page (None on the last page).
+        """
+        rows = self._query(SELECT_FOODS_PAGE, (-1 if after is None else after, limit + 1))
+        next_cursor = rows[limit - 1]['seq'] if len(rows) > limit else None
+        foods = rows[:limit]
+        for food in foods:
+            del food['seq']
+        return foods, next_cursor
+
+    def search_foods(self, query, limit=None, offset=0):
+        """Search foods by name"""
+        pattern = (query.replace('\\', '\\\\').replace('%', '\\%')
+                   .replace('_', '\\_'))
+        # A negative LIMIT means no limit in SQLite
+        return self._query(SEARCH_FOODS, (f'%{pattern}%', -1 if limit is None else limit,
+                                          offset))
+
+    def add_food(self, name, calories, protein, carbs, fat, fiber):
+        """Add a new food"""
+        food_id = str(uuid.uuid4())
+        with self._transaction() as conn:
+            conn.execute(INSERT_FOOD, (food_id, name, calories, protein, carbs, fat,
+                                       fiber, datetime.now().isoformat()))
+            self._touch_foods(conn, [food_id])
+        return food_id
+
+    def add_foods(self, foods):
+        """Add many foods in one transaction, returning their ids in order"""
+        with self._transaction() as conn:
+            return self._insert_foods(conn, foods)
+
+    def import_foods(self, batches):
+        """Add foods from an iterable of lists of food dicts, returning how many were added
+
+        Each batch is committed on its own, so other writers wait for one
+        batch at a time rather than the whole import, and an import that
+        stops on an error from batches keeps the foods inserted before it.
+        The name index is kept up to date as batches go in; dropping it and
+        rebuilding it at the end would hold off writers for the rebuild.
+        """
+        added = 0
+        for batch in batches:
+            with self._transaction() as conn:
+                added += len(self._insert_foods(conn, batch))
+        return added
+
+    def _insert_foods(self, conn, foods):
+        """Insert food dicts inside a transaction, returning their new ids in order"""
+        created_at = datetime.now().isoformat()
+        rows = [(str(uuid.uuid4()), food['name'], food['calories'], food['protein'],
+                 food['carbs'], food['fat'], food['fiber'], created_at)
+                for food in foods]
+        conn.executemany(INSERT_FOOD, rows)
+        self._touch_foods(conn, [row[0] for row in rows])
+        return [row[0] for row in rows]
+
+    def update_food(self, food_id, name, calories, protein, carbs, fat, fiber):
+        """Update a food"""
+        with self._transaction() as conn:
+            cursor = conn.execute(UPDATE_FOOD, (name, calories, protein, carbs, fat,
+                                                fiber, food_id))
+            if cursor.rowcount:
+                self._touch_foods(conn, [food_id])
+        return cursor.rowcount > 0
+
+    def delete_food(self, food_id):
+        """Delete a food"""
+        with self._transaction() as conn:
+            cursor = conn.execute(DELETE_FOOD, (food_id,))
+            if cursor.rowcount:
+                self._touch_foods(conn, [food_id], deleted=True)
+        return cursor.rowcount > 0
+
+    def calculate_nutrition(self, items):
+        """Total the nutrients of many (food_id, quantity) items
+
+        Raises KeyError for a food id not in the catalog.
+        """
+        items = list(items)
+        return self._nutrient_matrix(items).totals(items)
+
+    def calculate_nutrition_facts(self, items):
+        """Nutrition facts of each (food_id, quantity) item, None for unknown foods"""
+        items = list(items)
+        return self._nutrient_matrix(items).facts(items)
+
+    def _nutrient_matrix(self, items):
+        """Nutrient matrix of just the foods the (food_id, quantity) items refer to"""
+        food_ids = json.dumps(list({food_id for food_id, _ in items}))
+        return NutrientMatrix(self._query(SELECT_FOODS_BY_IDS, (food_ids,)))
+
+    # Meal management methods
+    def add_meal(self, meal_data):
+        """Add a meal"""
+        meal_id = str(uuid.uuid4())
+        meal_data['id'] = meal_id
+        meal_data['created_at'] = datetime.now().isoformat()
+        with self._transaction() as conn:
+            conn.execute(INSERT_MEAL, (
+                meal_id, meal_data['user_id'], meal_data.get('food_id'),
+                meal_data.get('food_name'), meal_data['quantity'], meal_data['date'],
+                meal_data['calories'], meal_data['protein'], meal_data['carbs'],
+                meal_data['fat'], meal_data['fiber'], meal_data['created_at']
+            ))
+        return meal_id
+
+    def get_user_meals(self, user_id):
+        """Get all meals for a user, most recent date first"""
+        return self._query(SELECT_USER_MEALS, (user_id,))
+
+    def get_recent_user_meals(self, user_id, limit):
+        """Get a user's latest meals, most recent date first"""
+        return self._query(SELECT_RECENT_USER_MEALS, (user_id, max(limit, 0)))
+
+    def get_user_meals_by_date(self, user_id, meal_date):
+        """Get meals for a user on a specific date"""
+        return self.get_user_meals_between(user_id, meal_date, meal_date)
+
+    def get_user_meals_between(self, user_id, start_date=None, end_date=None):
+        """Get a user's meals between two dates (inclusive), oldest first"""
+        return self._query(SELECT_USER_MEALS_BETWEEN, (
+            user_id,
+            MIN_DATE if start_date is None else start_date,
+            MAX_DATE if end_date is None else end_date
+        ))
+
+    def get_daily_totals(self, user_id, meal_date):
+        """Get a user's summed nutrients for one date"""
+        # Served by the (user_id, date) index, so cost tracks that day's meals
+        return self._query_one(SELECT_DAILY_TOTALS, (user_id, meal_date))
+
+    def get_nutrition_summary(self, user_id, start_date, end_date):
+        """Get a user's nutrient totals and daily averages between two dates (inclusive)"""
+        return summarize_rows(self._totals_by_date(user_id, start_date, end_date),
+                              start_date, end_date)
+
+    def get_nutrition_series(self, user_id, start_date, end_date, granularity):
+        """Get nutrition summaries per day, week or month between two dates"""
+        return series_from_days(self._totals_by_date(user_id, start_date, end_date),
+                                start_date, end_date, granularity)
+
+    def _totals_by_date(self, user_id, start_date, end_date):
+        """A user's nutrient sums per logged date in the range, ordered by date"""
+        # One row per logged day via the (user_id, date) index
+        return self._query(SELECT_TOTALS_BY_DATE,
+                           (user_id, start_date.isoformat(), end_date.isoformat()))
+
+    def delete_meal(self, meal_id, user_id=None):
+        """Delete a meal"""
+        with self._transaction() as conn:
+            if user_id is None:
+                cursor = conn.execute(DELETE_MEAL, (meal_id,))
+            else:
+                cursor = conn.execute(DELETE_USER_MEAL, (meal_id, user_id))
+        return cursor.rowcount > 0
+
+    def get_all_meals(self):
+        """Get all meals (admin function)"""
+        return self._query(SELECT_MEALS)
+
+    def get_recent_meals(self, limit):
+        """Get the most recently logged meals, newest first"""
+        return self._query(SELECT_RECENT_MEALS, (limit,))
+
+    def iter_meals(self, start_date=None, end_date=None, user_id=None, batch_size=1000):
+        """Iterate over meals in the order they were logged, fetching them in keyset batches
+
+        Optionally only one user's meals, or those between two dates (inclusive).
+        """
+        dates = (MIN_DATE if start_date is None else start_date,
+                 MAX_DATE if end_date is None else end_date)
+        if user_id is None:
+            batches = self._query_batches(SELECT_MEALS_AFTER, dates, batch_size)
+        else:
+            batches = self._query_batches(SELECT_USER_MEALS_AFTER, (user_id, *dates), batch_size)
+        for rows in batches:
+            yield from rows
+
+    # Meal analytics (admin functions)
+    def get_counts(self):
+        """Get the number of users, foods and meals"""
+        # Counter rows kept current by the row_counts and meal_totals triggers
+        return self._query_one(SELECT_COUNTS)
+
+    def get_meal_stats(self):
+        """Get the meal count, users with meals and nutrient totals across all meals"""
+        # One row kept current by the meal_totals triggers
+        row = self._query_one(SELECT_MEAL_STATS)
+        return {
+            'meals': row['meals'],
+            'users': row['users'],
+            'totals': {nutrient: row[nutrient] for nutrient in NUTRIENTS}
+        }
+
+    def get_meal_trend(self, start_date, end_date):
+        """Get meal counts and nutrient totals per logged date across all users"""
+        return self._query(SELECT_MEAL_TREND, (start_date.isoformat(), end_date.isoformat()))
+
+    def get_popular_foods(self, limit):
+        """Get the most logged foods with their meal counts and total quantity"""
+        return self._query(SELECT_POPULAR_FOODS, (limit,))
+
+    def get_most_active_users(self, limit):
+        """Get the users with the most meals, with their meal counts and calories"""
+        return self._query(SELECT_MOST_ACTIVE_USERS, (limit,))
@@ -0,0 +1,148 @@
+"""Stress the in-memory store with concurrent readers and writers
+
+Writer threads add and delete meals, users and foods while reader threads
+check that what they read under one read lock is consistent: the meal
+statistics, trend and counts agree with the meals themselves, and each
+user's rollups agree with their meal log. At the end every aggregate is
+recomputed from scratch and compared. CONCURRENCY_TEST_SECONDS sets how
+long the threads run (default 2).
+"""
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+import pytest
+
+from data_store import DataStore
+from food_catalog import SharedFoodCatalog
+from rollup import NUTRIENTS
+
+DURATION = float(os.environ.get('CONCURRENCY_TEST_SECONDS', 2))
+START = date(2024, 1, 1)
+END = date(2024, 3, 31)
+DAYS = (END - START).days + 1
+
+def close(a, b):
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+
+def meal_data(food, user_id, rnd):
+    return {'user_id': user_id, 'food_id': food['id'], 'food_name': food['name'],
+            'quantity': 1, 'date': (START + timedelta(days=rnd.randrange(DAYS))).isoformat(),
+            **{nutrient: food[nutrient] for nutrient in NUTRIENTS}}
+
+def check_consistent(store, user_id):
+    """Assert that one user's aggregates and the store-wide ones match the meals"""
+    meals = store.get_all_meals()
+    stats = store.get_meal_stats()
+    assert stats['meals'] == len(meals) == store.get_counts()['meals']
+    for nutrient in NUTRIENTS:
+        assert close(stats['totals'][nutrient], sum(getattr(meal, nutrient) for meal in meals))
+    trend = store.get_meal_trend(START, END)
+    assert sum(day['meals'] for day in trend) == len(meals)
+
+    user_meals = store.get_user_meals(user_id)
+    assert [meal.date for meal in user_meals] == sorted((meal.date for meal in user_meals),
+                                                        reverse=True)
+    summary = store.get_nutrition_summary(user_id, START, END)
+    assert close(summary['totals']['calories'], sum(meal.calories for meal in user_meals))
+    monthly = store.get_nutrition_series(user_id, START, END, 'month')
+    assert close(sum(bucket['totals']['calories'] for bucket in monthly),
+                 summary['totals']['calories'])
+
+@pytest.fixture(params=['private', 'shared'])
+def store(request, tmp_path):
+    if request.param == 'shared':
+        return DataStore(shared_catalog=SharedFoodCatalog(str(tmp_path / 'catalog')))
+    return DataStore()
+
+@pytest.fixture(autouse=True)
+def frequent_switches():
+    # Switch threads often so interleavings that need the locks turn up
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    yield
+    sys.setswitchinterval(interval)
+
+def test_concurrent_readers_and_writers_stay_consistent(store):
+    user_ids = [store.create_user(f'user{i}', f'user{i}@example.com', 'pw') for i in range(8)]
+    stop = threading.Event()
+    errors = []
+    counts = Counter()
+
+    def run(name, step, seed):
+        rnd = random.Random(seed)
+        state = []
+        try:
+            while not stop.is_set():
+                step(rnd, state)
+                counts[name] += 1
+        except Exception as e:
+            errors.append(f'{name}: {e!r}')
+            stop.set()
+
+    def write_meals(rnd, meal_ids):
+        food = rnd.choice(store.get_all_foods())
+        meal_ids.append(store.add_meal(meal_data(food, rnd.choice(user_ids), rnd)))
+        if rnd.random() < 0.3:
+            store.delete_meal(meal_ids.pop(rnd.randrange(len(meal_ids))))
+
+    def edit_foods(rnd, state):
+        food_id = store.add_food(f'Food {rnd.random()}', 1, 2, 3, 4, 5)
+        store.update_food(food_id, 'Renamed food', 2, 2, 2, 2, 2)
+        store.search_foods('renamed', 10)
+        store.delete_food(food_id)
+        time.sleep(0.01)
+
+    def churn_users(rnd, state):
+        user_id = store.create_user(f'churn{rnd.random()}', f'{rnd.random()}@example.com', 'pw')
+        store.add_meal(meal_data(store.get_all_foods()[0], user_id, rnd))
+        store.delete_user(user_id)
+
+    def read(rnd, state):
+        user_id = rnd.choice(user_ids)
+        # Separate reads only need to be valid on their own
+        store.get_user_meals_between(user_id, '2024-01-05', '2024-02-10')
+        store.search_foods('apple', 10)
+        store.get_popular_foods(3)
+        store.get_recent_meals(10)
+        with store._lock.read():
+            check_consistent(store, user_id)
+
+    threads = [threading.Thread(target=run, args=('writer', write_meals, seed))
+               for seed in range(6)]
+    threads += [threading.Thread(target=run, args=('reader', read, 100 + seed))
+                for seed in range(8)]
+    threads.append(threading.Thread(target=run, args=('foods', edit_foods, 200)))
+    threads.append(threading.Thread(target=run, args=('users', churn_users, 300)))
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert counts['writer'] and counts['reader']
+
+    # Every aggregate matches a recount of the meals left
+    meals = store.get_all_meals()
+    for user_id in user_ids:
+        check_consistent(store, user_id)
+        for day in (START, START + timedelta(days=40), END):
+            day_meals = [meal for meal in meals
+                         if meal.user_id == user_id and meal.date == day.isoformat()]
+            totals = store.get_daily_totals(user_id, day.isoformat())
+            assert close(totals['protein'], sum(meal.protein for meal in day_meals))
+    trend = store.get_meal_trend(START, END)
+    assert {day['date']: day['meals'] for day in trend if day['meals']} == \
+        Counter(meal.date for meal in meals)
+    popular = store.get_popular_foods(3)
+    food_counts = Counter(meal.food_id for meal in meals)
+    assert [food['meals'] for food in popular] == \
+        sorted(food_counts.values(), reverse=True)[:3]
+    assert store.get_meal_stats()['users'] == len({meal.user_id for meal in meals})
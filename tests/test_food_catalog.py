@@ -0,0 +1,85 @@
+"""Round trips through shared food catalog images
+
+Stores attached to the same catalog directory stand in for worker
+processes: edits one of them publishes as a new generation must read
+back the same from the others.
+"""
+import threading
+import time
+
+import pytest
+
+from data_store import DataStore
+from food_catalog import SharedFoodCatalog
+from records import Food
+
+def open_store(tmp_path):
+    return DataStore(shared_catalog=SharedFoodCatalog(str(tmp_path / 'catalog')))
+
+def foods(store):
+    return [tuple(food[field] for field in Food.FIELDS) for food in store.iter_foods()]
+
+def test_generation_round_trips_to_another_store(tmp_path):
+    store = open_store(tmp_path)
+    added = store.add_foods([{'name': name, 'calories': 100 + i, 'protein': 1.5, 'carbs': 2,
+                              'fat': 3.25, 'fiber': 0}
+                             for i, name in enumerate(['Crème Brûlée', 'Pão de Queijo', 'Kale'])])
+    first = store.get_all_foods()[0]
+    store.update_food(first['id'], 'Apple, raw', 52, 0.3, 14, 0.2, 2.4)
+    store.delete_food(added[2])
+
+    other = open_store(tmp_path)
+    assert foods(other) == foods(store)
+    assert other.get_catalog_version() == store.get_catalog_version()
+    assert other.search_foods('crème br') == store.search_foods('crème br') != []
+    items = [(added[0], 2), (first['id'], 1)]
+    assert other.calculate_nutrition(items) == store.calculate_nutrition(items)
+
+    # Edits published afterwards reach the attached store on its next read
+    store.delete_food(added[0])
+    assert other.get_food(added[0]) is None
+    assert foods(other) == foods(store)
+
+def test_concurrent_edits_share_a_generation(tmp_path):
+    store = open_store(tmp_path)
+    catalog = store._shared_catalog
+    food_ids = [food['id'] for food in store.get_all_foods()]
+    generation = catalog.generation()
+
+    # Hold up the first publish so the other edits queue behind it
+    publishing = threading.Event()
+    release = threading.Event()
+    def blocking_edit(image, slots):
+        publishing.set()
+        release.wait(10)
+        return False
+    blocker = threading.Thread(target=catalog.update, args=(blocking_edit,), daemon=True)
+    blocker.start()
+    publishing.wait()
+
+    def failing_edit(image, slots):
+        slots.append(None)
+        raise ValueError('bad edit')
+    failures = []
+    def fail():
+        with pytest.raises(ValueError):
+            catalog.update(failing_edit)
+        failures.append(True)
+    threads = [threading.Thread(target=store.update_food,
+                                args=(food_id, f'Food {i}', i, 0, 0, 0, 0), daemon=True)
+               for i, food_id in enumerate(food_ids)]
+    threads.append(threading.Thread(target=fail, daemon=True))
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 10
+    while len(catalog._pending) < len(threads) and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads + [blocker]:
+        thread.join()
+
+    assert failures == [True]
+    assert catalog.generation() == generation + 1
+    assert [food['name'] for food in store.get_all_foods()] == [
+        f'Food {i}' for i in range(len(food_ids))]
+    assert foods(open_store(tmp_path)) == foods(store)
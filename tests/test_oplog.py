@@ -0,0 +1,153 @@
+"""Round trips through the in-memory store's snapshot and operation log
+
+Most tests write through a DataStore backed by an OperationLog, reopen
+the store from disk as a restarted server would and compare what it
+holds. The fork tests hand the log over to child processes the way a
+preloading server hands it to its workers.
+"""
+import os
+import traceback
+
+import pytest
+
+from data_store import DataStore
+from oplog import OperationLog
+from records import Food, Meal, User
+from rollup import NUTRIENTS
+
+def open_store(tmp_path, sync_interval=0):
+    snapshot_path = str(tmp_path / 'store.snapshot')
+    oplog = OperationLog(f'{snapshot_path}.log', sync_interval)
+    store = DataStore(snapshot_path=snapshot_path, oplog=oplog)
+    oplog.start()
+    return store, oplog
+
+def contents(store):
+    """Everything a store holds that has to survive a restart"""
+    return {
+        'users': [tuple(user[field] for field in User.FIELDS) for user in store.iter_users()],
+        'foods': [tuple(food[field] for field in Food.FIELDS) for food in store.iter_foods()],
+        'meals': [tuple(meal[field] for field in Meal.FIELDS) for meal in store.iter_meals()],
+        'stats': store.get_meal_stats(),
+        'recent': [meal.id for meal in store.get_recent_meals(5)]
+    }
+
+def log_changes(store, name):
+    """Register a user and log, delete and edit a few meals and foods"""
+    user_id = store.create_user(name, f'{name}@example.com', 'pw')
+    foods = store.get_all_foods()
+    meal_ids = []
+    for i, food in enumerate(foods[:6]):
+        meal_ids.append(store.add_meal({
+            'user_id': user_id, 'food_id': food['id'], 'food_name': food['name'],
+            'quantity': 1 + i, 'date': f'2024-01-{1 + i % 3:02d}',
+            **{nutrient: food[nutrient] * (1 + i) for nutrient in NUTRIENTS}}))
+    store.delete_meal(meal_ids[2])
+    food_id = store.add_food(f'{name} bar', 200, 10, 20, 8, 3)
+    store.update_food(foods[0]['id'], foods[0]['name'], 1, 2, 3, 4, 5)
+    store.delete_food(foods[1]['id'])
+    return user_id, food_id
+
+def reopened(tmp_path, store, oplog):
+    """Contents of the store before and after closing and reopening it"""
+    before = contents(store)
+    oplog.close()
+    store, oplog = open_store(tmp_path)
+    after = contents(store)
+    oplog.close()
+    return before, after
+
+def test_log_replays_changes(tmp_path):
+    store, oplog = open_store(tmp_path)
+    log_changes(store, 'alice')
+    user_id, _ = log_changes(store, 'bob')
+    store.delete_user(user_id)
+    before, after = reopened(tmp_path, store, oplog)
+    assert after == before
+    assert [user[1] for user in after['users']] == ['admin', 'alice']
+
+def test_log_replays_on_top_of_snapshot(tmp_path):
+    store, oplog = open_store(tmp_path)
+    log_changes(store, 'alice')
+    size = os.path.getsize(oplog.path)
+    store.save_snapshot(store._snapshot_path)
+    # The snapshot covers every record so far
+    assert os.path.getsize(oplog.path) == 0
+    log_changes(store, 'bob')
+    assert 0 < os.path.getsize(oplog.path) < size * 2
+    before, after = reopened(tmp_path, store, oplog)
+    assert after == before
+
+def test_group_commit_writes_everything_on_close(tmp_path):
+    store, oplog = open_store(tmp_path, sync_interval=0.05)
+    for i in range(20):
+        log_changes(store, f'user{i}')
+    before, after = reopened(tmp_path, store, oplog)
+    assert after == before
+
+def test_torn_record_is_cut_off(tmp_path):
+    store, oplog = open_store(tmp_path)
+    log_changes(store, 'alice')
+    before = contents(store)
+    oplog.close()
+    with open(oplog.path, 'ab') as log_file:
+        log_file.write(b'\x40\x00\x00\x00torn')
+    store, oplog = open_store(tmp_path)
+    assert contents(store) == before
+    # Appends after the cut replay too
+    log_changes(store, 'bob')
+    before, after = reopened(tmp_path, store, oplog)
+    assert after == before
+
+def test_second_writer_is_refused(tmp_path):
+    store, oplog = open_store(tmp_path)
+    with pytest.raises(RuntimeError):
+        open_store(tmp_path)
+    oplog.close()
+
+def in_child(function):
+    """Run function in a forked child, returning its exit code"""
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            function()
+            code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(code)
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+@pytest.mark.parametrize('snapshot', [False, True], ids=['log', 'snapshot'])
+def test_log_is_handed_to_each_forked_worker_in_turn(tmp_path, snapshot):
+    store, oplog = open_store(tmp_path, sync_interval=0.05)
+    log_changes(store, 'master')
+
+    def first_worker():
+        log_changes(store, 'first')
+        if snapshot:
+            # Compacts the log past everything the parent has seen
+            store.save_snapshot(store._snapshot_path)
+            log_changes(store, 'after_snapshot')
+        oplog.close()
+
+    def second_worker():
+        # Picks up what the first worker logged before taking writes
+        assert store.get_user_by_username('first') is not None
+        assert (store.get_user_by_username('after_snapshot') is not None) == snapshot
+        log_changes(store, 'second')
+        oplog.close()
+
+    assert in_child(first_worker) == 0
+    # The parent handed the log over and can no longer write it
+    with pytest.raises(RuntimeError):
+        store.create_user('parent', 'parent@example.com', 'pw')
+    assert in_child(second_worker) == 0
+    oplog.close()
+
+    store, oplog = open_store(tmp_path)
+    names = [user['username'] for user in store.iter_users()]
+    oplog.close()
+    expected = ['admin', 'master', 'first'] + ['after_snapshot'] * snapshot + ['second']
+    assert names == expected
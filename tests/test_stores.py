@@ -0,0 +1,171 @@
+"""The storage interface, run against every backend
+
+DataStore, SQLiteDataStore and SQLAlchemyDataStore (on SQLite) are
+driven through the same calls and must return the same results.
+"""
+import math
+from datetime import date
+
+import pytest
+
+from data_store import DataStore, DEFAULT_ADMIN_USERNAME, DEFAULT_FOODS
+from rollup import NUTRIENTS
+from sql_store import SQLAlchemyDataStore
+from sqlite_store import SQLiteDataStore
+
+@pytest.fixture(params=['memory', 'sqlite', 'sqlalchemy'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        yield DataStore()
+    elif request.param == 'sqlite':
+        yield SQLiteDataStore(str(tmp_path / 'store.db'))
+    else:
+        store = SQLAlchemyDataStore(f"sqlite:///{tmp_path / 'store.db'}")
+        yield store
+        store.close()
+
+def log_meal(store, user_id, food, quantity, meal_date):
+    return store.add_meal({
+        'user_id': user_id, 'food_id': food['id'], 'food_name': food['name'],
+        'quantity': quantity, 'date': meal_date,
+        **{nutrient: food[nutrient] * quantity for nutrient in NUTRIENTS}})
+
+def ids(records):
+    return [record['id'] for record in records]
+
+def test_users(store):
+    assert [user['username'] for user in store.get_all_users()] == [DEFAULT_ADMIN_USERNAME]
+    user_id = store.create_user('alice', 'alice@example.com', 'secret')
+    assert store.create_user('ALICE', 'other@example.com', 'pw') is None
+    assert store.create_user('other', 'Alice@Example.com', 'pw') is None
+    user = store.get_user(user_id)
+    assert user['username'] == 'alice'
+    assert not user['is_admin']
+    assert store.get_user_by_username('Alice')['id'] == user_id
+    assert store.verify_password(user, 'secret')
+    assert not store.verify_password(user, 'wrong')
+    bob_id = store.create_user('bob', 'bob@example.com', 'pw')
+    assert ids(store.get_recent_users(2)) == [bob_id, user_id]
+    assert ids(store.iter_users())[1:] == [user_id, bob_id]
+
+    assert store.delete_user(user_id)
+    assert not store.delete_user(user_id)
+    assert store.get_user(user_id) is None
+    assert store.get_user_by_username('alice') is None
+    assert store.get_counts()['users'] == 2
+
+def test_foods(store):
+    foods = store.get_all_foods()
+    assert [food['name'] for food in foods] == [food['name'] for food in DEFAULT_FOODS]
+    food_id = store.add_food('Teff, cooked', 120, 4.4, 21.3, 1.9, 2.8)
+    added = store.add_foods([{'name': f'Bar {i}', 'calories': i, 'protein': 1, 'carbs': 2,
+                              'fat': 3, 'fiber': 4} for i in range(3)])
+    assert store.import_foods([[{'name': 'Imported oats', 'calories': 389, 'protein': 16.9,
+                                 'carbs': 66.3, 'fat': 6.9, 'fiber': 10.6}]]) == 1
+    assert store.get_food(food_id)['calories'] == 120
+    assert ids(store.search_foods('teff')) == [food_id]
+    assert [food['name'] for food in store.search_foods('imported')] == ['Imported oats']
+
+    version, _ = store.get_catalog_version()
+    revision, _ = store.get_food_revision(food_id)
+    assert store.update_food(food_id, 'Teff', 110, 4, 20, 2, 3)
+    assert store.get_food(food_id)['name'] == 'Teff'
+    assert store.get_catalog_version()[0] != version
+    assert store.get_food_revision(food_id)[0] != revision
+
+    assert store.delete_food(added[1])
+    assert not store.delete_food(added[1])
+    assert not store.update_food(added[1], 'Gone', 0, 0, 0, 0, 0)
+    assert store.get_food(added[1]) is None
+    assert store.get_food_revision(added[1]) is None
+    assert store.get_counts()['foods'] == len(DEFAULT_FOODS) + 4
+
+    totals = store.calculate_nutrition([(food_id, 2), (added[0], 1)])
+    assert totals['calories'] == 220
+    facts = store.calculate_nutrition_facts([(food_id, 2), (added[1], 1)])
+    assert facts[0]['name'] == 'Teff' and facts[0]['protein'] == 8
+    assert facts[1] is None
+    with pytest.raises(KeyError):
+        store.calculate_nutrition([(added[1], 1)])
+
+def test_food_pagination(store):
+    store.delete_food(store.get_all_foods()[3]['id'])
+    expected = ids(store.get_all_foods())
+    pages = []
+    cursor = None
+    while True:
+        page, cursor = store.get_foods_page(4, cursor)
+        pages.append(ids(page))
+        if cursor is None:
+            break
+    assert [food_id for page in pages for food_id in page] == expected
+    assert all(len(page) == 4 for page in pages[:-1])
+    assert ids(store.iter_foods()) == expected
+    assert ids(store.search_foods('', limit=3, offset=2)) == expected[2:5]
+
+def test_meals(store):
+    alice = store.create_user('alice', 'alice@example.com', 'pw')
+    bob = store.create_user('bob', 'bob@example.com', 'pw')
+    apple, banana = store.get_all_foods()[:2]
+    first = log_meal(store, alice, apple, 1, '2024-01-01')
+    second = log_meal(store, alice, banana, 2, '2024-01-02')
+    third = log_meal(store, alice, apple, 0.5, '2024-01-02')
+    bobs = log_meal(store, bob, banana, 1, '2024-01-01')
+
+    assert ids(store.get_user_meals(alice))[0] in (second, third)
+    assert set(ids(store.get_user_meals(alice))) == {first, second, third}
+    assert ids(store.get_user_meals_by_date(alice, '2024-01-02')) in ([second, third],
+                                                                      [third, second])
+    assert ids(store.get_user_meals_between(alice, '2024-01-01', '2024-01-01')) == [first]
+    assert ids(store.get_recent_meals(2)) == [bobs, third]
+    assert len(store.get_recent_user_meals(alice, 2)) == 2
+    assert ids(store.iter_meals(user_id=alice)) == [first, second, third]
+    assert ids(store.iter_meals(start_date='2024-01-02')) == [second, third]
+    assert ids(store.get_all_meals()) == [first, second, third, bobs]
+
+    daily = store.get_daily_totals(alice, '2024-01-02')
+    assert math.isclose(daily['calories'], banana['calories'] * 2 + apple['calories'] * 0.5)
+    summary = store.get_nutrition_summary(alice, date(2024, 1, 1), date(2024, 1, 2))
+    assert math.isclose(summary['totals']['calories'],
+                        apple['calories'] * 1.5 + banana['calories'] * 2)
+
+    # Only the owner (or an admin call without user_id) may delete a meal
+    assert not store.delete_meal(first, bob)
+    assert store.delete_meal(first, alice)
+    assert not store.delete_meal(first)
+    assert store.delete_meal(bobs)
+    assert ids(store.get_recent_meals(5)) == [third, second]
+    assert store.get_daily_totals(alice, '2024-01-01')['calories'] == 0
+
+    assert store.delete_user(alice)
+    assert store.get_all_meals() == []
+    assert store.get_recent_meals(5) == []
+
+def test_stats(store):
+    alice = store.create_user('alice', 'alice@example.com', 'pw')
+    bob = store.create_user('bob', 'bob@example.com', 'pw')
+    apple, banana = store.get_all_foods()[:2]
+    log_meal(store, alice, apple, 1, '2024-01-01')
+    log_meal(store, alice, apple, 2, '2024-01-02')
+    dropped = log_meal(store, bob, banana, 1, '2024-01-02')
+
+    stats = store.get_meal_stats()
+    assert (stats['meals'], stats['users']) == (3, 2)
+    assert math.isclose(stats['totals']['calories'], apple['calories'] * 3 + banana['calories'])
+    assert dict(store.get_counts()) == {'users': 3, 'foods': len(DEFAULT_FOODS), 'meals': 3}
+    trend = store.get_meal_trend(date(2024, 1, 1), date(2024, 1, 2))
+    assert [(day['date'], day['meals']) for day in trend] == [('2024-01-01', 1), ('2024-01-02', 2)]
+    popular = store.get_popular_foods(1)
+    assert (popular[0]['food_id'], popular[0]['meals'], popular[0]['quantity']) == (apple['id'], 2, 3)
+    active = store.get_most_active_users(1)
+    assert (active[0]['user_id'], active[0]['meals']) == (alice, 2)
+
+    store.delete_meal(dropped)
+    stats = store.get_meal_stats()
+    assert (stats['meals'], stats['users']) == (2, 1)
+    assert math.isclose(stats['totals']['calories'], apple['calories'] * 3)
+    store.delete_user(alice)
+    stats = store.get_meal_stats()
+    assert (stats['meals'], stats['users']) == (0, 0)
+    assert stats['totals'] == dict.fromkeys(NUTRIENTS, 0)
+    assert dict(store.get_counts()) == {'users': 2, 'foods': len(DEFAULT_FOODS), 'meals': 0}